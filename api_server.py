@@ -3,16 +3,31 @@ Flask API Server for Vietnamese Stock Prices
 Exposes database queries as REST API endpoints for Google AI Studio integration
 """
 
-from flask import Flask, jsonify, request
+import flask
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
 from get_stock_prices import StockPriceFetcher
+from database_connection import get_pool, start_token_refresher, token_stats
+import arrow_format
+from conditional import frame_digest, is_not_modified, make_etag, not_modified, set_validators
+from fast_json import encode_frame, envelope
+from history_pages import wants_page
+from warmup import WARMUP_TICKERS, WarmUp, fetcher_steps
+import metrics
+import diagnostics
+import shared_routes
 from datetime import datetime
 import traceback
+import os
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for Google AI Studio to access
+metrics.init_flask(app)  # Request latency per route, served at /metrics
 
-# Initialize fetcher (reuse connection)
+# Upper bound for ?days= when the history is streamed (?stream=ndjson)
+MAX_STREAM_DAYS = int(os.getenv('MAX_STREAM_DAYS', 7300))
+
+# Initialize fetcher (connections come from the shared pool)
 fetcher = None
 
 def get_fetcher():
@@ -23,6 +38,20 @@ def get_fetcher():
     return fetcher
 
 
+# Primes the pool, queries and caches in the background - /api/ready is 503 until it has passed
+warmup = WarmUp()
+
+# Pool, cache and token counters for /metrics (read from their stats() per scrape)
+metrics.register_pool(get_pool)
+metrics.register_fetcher(get_fetcher)
+metrics.register_cache('market', lambda: get_fetcher().market_cache.stats())
+metrics.register_stats('token', token_stats, counters=('refreshes', 'failures', 'rotations', 'unchanged'),
+                       gauges={'version': 'version', 'refresh_in': 'refresh_in_seconds'})
+
+# /api/ready, /metrics, /api/debug/* and the Vary header, shared with the other servers
+app.register_blueprint(shared_routes.blueprint(flask, warmup, lambda: diagnostics.cache_sizes(get_fetcher())))
+
+
 # --------------------------------------------------------------------------------
 # API ENDPOINTS
 # --------------------------------------------------------------------------------
@@ -33,7 +62,16 @@ def health_check():
     return jsonify({
         'status': 'ok',
         'timestamp': datetime.now().isoformat(),
-        'message': 'Vietnamese Stock Price API is running'
+        'message': 'Vietnamese Stock Price API is running',
+        'pool': get_pool().stats(),
+        'warmup': warmup.stats(),
+        'token': token_stats(),
+        'cache': get_fetcher().cache.stats(),
+        'single_flight': dict(get_fetcher().flight.stats(), keys=get_fetcher().flight.key_stats(10)),
+        'micro_batch': get_fetcher().batcher.stats(),
+        'revalidate': get_fetcher().revalidator.stats(),
+        'history_cache': get_fetcher().history_cache.stats(),
+        'market_cache': get_fetcher().market_cache.stats()
     })
 
 
@@ -46,13 +84,18 @@ def get_stock_price(symbol):
     """
     try:
         f = get_fetcher()
-        price = f.get_latest_price(symbol.upper())
+        price, stale = f.get_latest_price_status(symbol.upper())
 
         if price:
-            return jsonify({
+            etag = make_etag('quote', price)
+            if is_not_modified(request, etag):
+                return not_modified(Response, etag)
+
+            return set_validators(jsonify({
                 'success': True,
-                'data': price
-            })
+                'data': price,
+                'stale': stale
+            }), etag)
         else:
             return jsonify({
                 'success': False,
@@ -107,18 +150,30 @@ def get_stock_history(symbol):
     Get historical prices for a stock
 
     Example: GET /api/stock/VNM/history?days=30
+    Stream: GET /api/stock/VNM/history?days=3650&stream=ndjson (one JSON row per line)
+    Pages: GET /api/stock/VNM/history?start=2010-01-01&end=2024-12-31&limit=1000,
+           then repeat with ?cursor=<next_cursor> until next_cursor is null
     """
     try:
+        if wants_page(request.args):
+            return shared_routes.history_page(Response, request, symbol, get_fetcher().get_history_page)
+
         days = request.args.get('days', default=30, type=int)
+        stream = request.args.get('stream') == 'ndjson'
+        max_days = MAX_STREAM_DAYS if stream else 365
 
-        if days < 1 or days > 365:
+        if days < 1 or days > max_days:
             return jsonify({
                 'success': False,
-                'error': 'days must be between 1 and 365'
+                'error': f'days must be between 1 and {max_days}'
             }), 400
 
         f = get_fetcher()
-        history = f.get_price_history(symbol.upper(), days=days)
+
+        if stream:
+            return shared_routes.stream_history(Response, symbol, f.iter_price_history(symbol.upper(), days=days))
+
+        history, stale = f.get_price_history_status(symbol.upper(), days=days)
 
         if history.empty:
             return jsonify({
@@ -126,19 +181,7 @@ def get_stock_history(symbol):
                 'error': f'No historical data found for {symbol}'
             }), 404
 
-        # Convert DataFrame to list of dicts
-        data = history.to_dict('records')
-
-        # Convert dates to strings
-        for item in data:
-            if 'trade_date' in item and item['trade_date']:
-                item['trade_date'] = item['trade_date'].strftime('%Y-%m-%d')
-
-        return jsonify({
-            'success': True,
-            'data': data,
-            'count': len(data)
-        })
+        return shared_routes.history_response(Response, request, history, stale)
 
     except Exception as e:
         return jsonify({
@@ -174,19 +217,18 @@ def get_market_summary(market_name):
                 'error': f'No data found for market {market}'
             }), 404
 
-        # Convert DataFrame to list of dicts
-        data = summary.to_dict('records')
+        # No snapshot here - the validator is a hash of the rows, which come
+        # from the fetcher's market cache, so repeat polls 304 without a query
+        mimetype = arrow_format.negotiate(request.accept_mimetypes)
+        etag = make_etag('market', market, mimetype, frame_digest(summary))
+        if is_not_modified(request, etag):
+            return not_modified(Response, etag)
 
-        # Convert dates to strings
-        for item in data:
-            if 'trade_date' in item and item['trade_date']:
-                item['trade_date'] = item['trade_date'].strftime('%Y-%m-%d')
+        if mimetype != arrow_format.JSON_MIMETYPE:
+            return set_validators(Response(arrow_format.encode_frame(summary, mimetype), mimetype=mimetype), etag)
 
-        return jsonify({
-            'success': True,
-            'data': data,
-            'count': len(data)
-        })
+        body = envelope(encode_frame(summary), count=len(summary))
+        return set_validators(Response(body, mimetype='application/json'), etag)
 
     except Exception as e:
         return jsonify({
@@ -255,11 +297,39 @@ if __name__ == '__main__':
     print("="*60)
     print("Vietnamese Stock Price API Server")
     print("="*60)
+    if os.getenv('DC_LOCAL_DB'):
+        print(f"🧪 DC_LOCAL_DB is set - using local database {os.getenv('DC_LOCAL_DB')} (no Entra ID)")
+
+    def start_token_renewal():
+        # Renew the Entra ID token in the background before it expires
+        if start_token_refresher():
+            print(f"🔑 Token refresher started (renews {token_stats()['refresh_in']}s from now)")
+
+    # Open the pool and run every query for the hot tickers while the server
+    # starts - /api/ready is 503 until the pool is up (WARMUP=0 skips it,
+    # WARMUP_TICKERS sets the list)
+    if warmup.enabled:
+        print(f"\n🔥 Warming up in the background ({', '.join(WARMUP_TICKERS)})...")
+        warmup.start(fetcher_steps(get_fetcher(), get_pool()), then=start_token_renewal)
+    else:
+        try:
+            get_pool().prefill()
+        except Exception as e:
+            print(f"❌ Could not prefill pool: {e}")
+        stats = get_pool().stats()
+        print(f"✅ Pool ready ({stats['size']} open, max {stats['max_size']})")
+        start_token_renewal()
+
     print("\nAvailable Endpoints:")
     print("  GET  /api/health")
+    print("  GET  /metrics")
+    print("  GET  /api/debug/profile?seconds=10  (DEBUG_TOKEN)")
+    print("  GET  /api/debug/memory  (DEBUG_TOKEN)")
     print("  GET  /api/stock/<symbol>")
     print("  POST /api/stocks")
     print("  GET  /api/stock/<symbol>/history?days=30")
+    print("  GET  /api/stock/<symbol>/history?days=3650&stream=ndjson")
+    print("  GET  /api/stock/<symbol>/history?start=2010-01-01&end=2024-12-31[&cursor=...]")
     print("  GET  /api/market/<market>")
     print("  GET  /api/search?q=keyword")
     print("\n" + "="*60)
@@ -0,0 +1,406 @@
+"""
+Async (ASGI) API Server for Vietnamese Stock Prices - Using pymssql
+Same routes and JSON as api_server_pymssql.py, built on Quart (async Flask).
+Blocking driver calls run on a bounded thread pool and independent queries
+run concurrently, so one process can hold hundreds of in-flight requests.
+
+Run: python api_server_async.py
+ or: hypercorn api_server_async:app --bind 0.0.0.0:$PORT
+"""
+
+import quart
+from quart import Quart, Response, jsonify, request
+from quart_cors import cors
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from get_stock_prices_pymssql import StockPriceFetcher, STREAM_BATCH_SIZE
+from database_connection_pymssql import get_pool, POOL_MAX_SIZE
+from market_snapshot import MarketSnapshot
+import arrow_format
+from conditional import is_not_modified, make_etag, not_modified, set_validators
+from fast_json import envelope
+from history_pages import wants_page
+from warmup import WARMUP_TICKERS, WarmUp, fetcher_steps
+import metrics
+import diagnostics
+import shared_routes
+from datetime import datetime
+import asyncio
+import contextvars
+import traceback
+import os
+
+app = cors(Quart(__name__), allow_origin='*')  # Enable CORS for Google AI Studio to access
+metrics.init_quart(app)  # Request latency per route, served at /metrics
+
+# Threads running blocking database calls - more than the pool size would only queue on it
+DB_WORKERS = int(os.getenv('ASYNC_DB_WORKERS', POOL_MAX_SIZE))
+
+# Symbols per concurrent query when /api/stocks fans out to the database
+FANOUT_CHUNK = int(os.getenv('ASYNC_FANOUT_CHUNK', 50))
+
+# Upper bound for ?days= when the history is streamed (?stream=ndjson)
+MAX_STREAM_DAYS = int(os.getenv('MAX_STREAM_DAYS', 7300))
+
+executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix='db')
+
+# Initialize fetcher (connections come from the shared pool)
+fetcher = StockPriceFetcher()
+
+# Market-wide latest prices, reloaded in the background (started before serving)
+snapshot = MarketSnapshot(fetcher.get_all_latest_prices)
+
+# Primes the pool, queries and caches in the background - /api/ready is 503 until it has passed
+warmup = WarmUp()
+
+# Pool, cache and snapshot counters for /metrics (read from their stats() per scrape)
+metrics.register_pool(get_pool)
+metrics.register_fetcher(lambda: fetcher)
+metrics.register_snapshot(snapshot)
+
+# /api/ready, /metrics, /api/debug/* and the Vary header, shared with the Flask servers
+app.register_blueprint(shared_routes.blueprint(quart, warmup, lambda: diagnostics.cache_sizes(fetcher, snapshot)))
+
+
+async def run_db(func, *args, **kwargs):
+    """Run a blocking fetcher call on the database thread pool"""
+    loop = asyncio.get_running_loop()
+    # In a copy of the request's context, so its phases land in Server-Timing
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(executor, partial(context.run, func, *args, **kwargs))
+
+
+# --------------------------------------------------------------------------------
+# LIFECYCLE
+# --------------------------------------------------------------------------------
+
+@app.before_serving
+async def startup():
+    """Start the warm-up (or just open the pool) and the background jobs"""
+    def start_background_jobs():
+        if snapshot.enabled:
+            snapshot.start()
+        if fetcher.history_store is not None:
+            fetcher.history_store.start_sync(fetcher)
+
+    if warmup.enabled:
+        # On its own thread, not awaited - the server takes requests meanwhile
+        # and /api/ready answers 503 until the pool and snapshot are up
+        print(f"🔥 Warming up in the background ({', '.join(WARMUP_TICKERS)})...")
+        warmup.start(fetcher_steps(fetcher, get_pool(), snapshot), then=start_background_jobs)
+        return
+
+    try:
+        await run_db(get_pool().prefill)
+    except Exception as e:
+        print(f"❌ Could not prefill pool: {e}")
+    print(f"✅ Pool ready ({get_pool().stats()['size']} open, max {POOL_MAX_SIZE})")
+    start_background_jobs()
+
+
+@app.after_serving
+async def shutdown():
+    warmup.stop()
+    snapshot.stop()
+    executor.shutdown(wait=False)
+
+
+# --------------------------------------------------------------------------------
+# API ENDPOINTS
+# --------------------------------------------------------------------------------
+
+@app.route('/api/health', methods=['GET'])
+async def health_check():
+    """Check if API is running"""
+    return jsonify({
+        'status': 'ok',
+        'timestamp': datetime.now().isoformat(),
+        'message': 'Vietnamese Stock Price API is running (REAL DATA, async)',
+        'source': 'DClab Database',
+        'driver': 'pymssql',
+        'pool': get_pool().stats(),
+        'warmup': warmup.stats(),
+        'cache': fetcher.cache.stats(),
+        'single_flight': dict(fetcher.flight.stats(), keys=fetcher.flight.key_stats(10)),
+        'micro_batch': fetcher.batcher.stats(),
+        'revalidate': fetcher.revalidator.stats(),
+        'snapshot': snapshot.stats(),
+        'history_store': fetcher.history_store.stats() if fetcher.history_store else None,
+        'db_workers': DB_WORKERS
+    })
+
+
+@app.route('/api/stock/<symbol>', methods=['GET'])
+async def get_stock_price(symbol):
+    """
+    Get latest price for a single stock
+
+    Example: GET /api/stock/VNM
+    """
+    try:
+        if snapshot.ready:
+            # Served from memory - snapshot_age tells clients how fresh it is
+            price = snapshot.get(symbol)
+            if price:
+                etag, modified = make_etag('quote', price), snapshot.modified(symbol)
+                if is_not_modified(request, etag, modified):
+                    return not_modified(Response, etag, modified)
+
+                return set_validators(jsonify({
+                    'success': True,
+                    'data': price,
+                    'source': 'real',
+                    'snapshot_age': snapshot.age(),
+                    'stale': snapshot.stale
+                }), etag, modified)
+
+        price, stale = await run_db(fetcher.get_latest_price_status, symbol.upper())
+
+        if price:
+            etag = make_etag('quote', price)
+            if is_not_modified(request, etag):
+                return not_modified(Response, etag)
+
+            return set_validators(jsonify({
+                'success': True,
+                'data': price,
+                'source': 'real',
+                'stale': stale
+            }), etag)
+        else:
+            return jsonify({
+                'success': False,
+                'error': f'No data found for symbol {symbol}'
+            }), 404
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'traceback': traceback.format_exc()
+        }), 500
+
+
+@app.route('/api/stocks', methods=['POST'])
+async def get_multiple_stocks():
+    """
+    Get prices for multiple stocks
+
+    Example: POST /api/stocks
+    Body: {"symbols": ["VNM", "VIC", "VHM"]}
+    """
+    try:
+        data = await request.get_json()
+        symbols = data.get('symbols', [])
+
+        if not symbols:
+            return jsonify({
+                'success': False,
+                'error': 'symbols array is required'
+            }), 400
+
+        if snapshot.ready:
+            prices = snapshot.get_many(symbols)
+            # Symbols the snapshot does not hold (e.g. listed since the last reload) come from the database
+            missing = [symbol for symbol, price in prices.items() if price is None]
+            if missing:
+                prices.update(await run_db(fetcher.get_multiple_prices, missing))
+
+            return jsonify({
+                'success': True,
+                'data': prices,
+                'source': 'real',
+                'snapshot_age': snapshot.age(),
+                'stale': snapshot.stale
+            })
+
+        # Fan out: each chunk is one batched query, all chunks run concurrently
+        chunks = [symbols[i:i + FANOUT_CHUNK] for i in range(0, len(symbols), FANOUT_CHUNK)]
+        results = await asyncio.gather(*(run_db(fetcher.get_multiple_prices, c) for c in chunks))
+
+        prices = {}
+        for result in results:
+            prices.update(result)
+
+        return jsonify({
+            'success': True,
+            'data': prices,
+            'source': 'real'
+        })
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'traceback': traceback.format_exc()
+        }), 500
+
+
+@app.route('/api/stock/<symbol>/history', methods=['GET'])
+async def get_stock_history(symbol):
+    """
+    Get historical prices for a stock
+
+    Example: GET /api/stock/VNM/history?days=30
+    Stream: GET /api/stock/VNM/history?days=3650&stream=ndjson (one JSON row per line)
+    Pages: GET /api/stock/VNM/history?start=2010-01-01&end=2024-12-31&limit=1000,
+           then repeat with ?cursor=<next_cursor> until next_cursor is null
+    """
+    try:
+        stream = request.args.get('stream') == 'ndjson'
+
+        if wants_page(request.args):
+            # Parsed, queried and encoded on a database thread (run_db keeps the request context)
+            return await run_db(shared_routes.history_page, Response, request, symbol, fetcher.get_history_page)
+
+        days = request.args.get('days', default=30, type=int)
+        max_days = MAX_STREAM_DAYS if stream else 365
+
+        if days < 1 or days > max_days:
+            return jsonify({
+                'success': False,
+                'error': f'days must be between 1 and {max_days}'
+            }), 400
+
+        if stream:
+            rows = fetcher.iter_price_history(symbol.upper(), days=days)
+            return await shared_routes.stream_history_async(Response, symbol, rows, run_db, STREAM_BATCH_SIZE)
+
+        history, stale = await run_db(fetcher.get_price_history_status, symbol.upper(), days=days)
+
+        if not history:
+            return jsonify({
+                'success': False,
+                'error': f'No historical data found for {symbol}'
+            }), 404
+
+        return shared_routes.history_response(Response, request, history, stale, source='real')
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'traceback': traceback.format_exc()
+        }), 500
+
+
+@app.route('/api/market/<market_name>', methods=['GET'])
+async def get_market_summary(market_name):
+    """
+    Get summary of all stocks in a market
+
+    Example: GET /api/market/HOSE
+    """
+    try:
+        valid_markets = ['HOSE', 'HNX', 'UPCOM']
+        market = market_name.upper()
+
+        if market not in valid_markets:
+            return jsonify({
+                'success': False,
+                'error': f'Invalid market. Must be one of: {valid_markets}'
+            }), 400
+
+        # Sliced from the snapshot's column store; loaded here - once for all
+        # waiting requests - before the first background reload or while disabled
+        if not await run_db(snapshot.ensure_loaded):
+            # Never loaded (database down since startup) - an outage, not an empty market
+            return jsonify({
+                'success': False,
+                'error': 'Market data is not available yet',
+                'last_error': snapshot.last_error
+            }), 503
+
+        mimetype = arrow_format.negotiate(request.accept_mimetypes)
+        etag, modified = make_etag('market', market, mimetype, snapshot.digest), snapshot.modified()
+        if is_not_modified(request, etag, modified):
+            return not_modified(Response, etag, modified)
+
+        # Encoded straight from the column store, no per-row dicts
+        if mimetype == arrow_format.JSON_MIMETYPE:
+            data, count = snapshot.market_json(market)
+        else:
+            data, count = snapshot.market_binary(market, mimetype)
+
+        if not count:
+            return jsonify({
+                'success': False,
+                'error': f'No data found for market {market}'
+            }), 404
+
+        if mimetype != arrow_format.JSON_MIMETYPE:
+            return set_validators(Response(data, mimetype=mimetype), etag, modified)
+
+        body = envelope(data, count=count, source='real', snapshot_age=snapshot.age(), stale=snapshot.stale)
+        return set_validators(Response(body, mimetype='application/json'), etag, modified)
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'traceback': traceback.format_exc()
+        }), 500
+
+
+# --------------------------------------------------------------------------------
+# ERROR HANDLERS
+# --------------------------------------------------------------------------------
+
+@app.errorhandler(404)
+async def not_found(error):
+    return jsonify({
+        'success': False,
+        'error': 'Endpoint not found'
+    }), 404
+
+
+@app.errorhandler(500)
+async def internal_error(error):
+    return jsonify({
+        'success': False,
+        'error': 'Internal server error'
+    }), 500
+
+
+# --------------------------------------------------------------------------------
+# MAIN
+# --------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    # Get port from environment variable (Railway) or default to 5001
+    port = int(os.environ.get('PORT', 5001))
+
+    print("="*60)
+    print("Vietnamese Stock Price API Server - REAL DATA (async)")
+    print("="*60)
+    print("\n⚠️  Using REAL DATABASE (DClab)")
+    print("📦 Driver: pymssql (no ODBC required)")
+    print(f"🧵 Database threads: {DB_WORKERS}")
+
+    # Check environment variable
+    print("\n🔍 Checking environment...")
+    if os.getenv('DC_LOCAL_DB'):
+        print(f"🧪 DC_LOCAL_DB is set - using local database {os.getenv('DC_LOCAL_DB')}")
+    elif os.getenv('DC_DB_STRING'):
+        print("✅ DC_DB_STRING is set")
+    else:
+        print("❌ DC_DB_STRING is NOT set!")
+        print("⚠️  App will crash on first database request")
+
+    print("\nAvailable Endpoints:")
+    print("  GET  /api/health")
+    print("  GET  /metrics")
+    print("  GET  /api/debug/profile?seconds=10  (DEBUG_TOKEN)")
+    print("  GET  /api/debug/memory  (DEBUG_TOKEN)")
+    print("  GET  /api/stock/<symbol>")
+    print("  POST /api/stocks")
+    print("  GET  /api/stock/<symbol>/history?days=30")
+    print("  GET  /api/stock/<symbol>/history?days=3650&stream=ndjson")
+    print("  GET  /api/stock/<symbol>/history?start=2010-01-01&end=2024-12-31[&cursor=...]")
+    print("  GET  /api/market/<market>")
+    print("\n" + "="*60)
+    print(f"\nStarting server on http://0.0.0.0:{port}")
+    print("Press Ctrl+C to stop")
+    print("="*60 + "\n")
+
+    app.run(host='0.0.0.0', port=port, debug=False)
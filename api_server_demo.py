@@ -3,13 +3,15 @@ Flask API Server for Vietnamese Stock Prices - DEMO VERSION
 Uses mock data so you can test without database connection
 """
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
 from datetime import datetime, timedelta
 import random
+import metrics
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for browser access
+metrics.init_flask(app)  # Request latency per route, served at /metrics
 
 # Mock stock data
 MOCK_STOCKS = {
@@ -105,6 +107,12 @@ def health_check():
     })
 
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus scrape endpoint (text exposition format)"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
 @app.route('/api/stock/<symbol>', methods=['GET'])
 def get_stock_price(symbol):
     """Get latest price for a single stock"""
@@ -250,6 +258,7 @@ if __name__ == '__main__':
     print("\n⚠️  Using MOCK DATA (no database connection required)")
     print("\nAvailable Endpoints:")
     print("  GET  /api/health")
+    print("  GET  /metrics")
     print("  GET  /api/stock/<symbol>")
     print("  POST /api/stocks")
     print("  GET  /api/stock/<symbol>/history?days=30")
@@ -2,17 +2,32 @@
 Flask API Server for Vietnamese Stock Prices - Using pymssql (Railway compatible)
 """
 
-from flask import Flask, jsonify, request
+import flask
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
 from get_stock_prices_pymssql import StockPriceFetcher
+from database_connection_pymssql import get_pool
+from market_snapshot import MarketSnapshot
+import arrow_format
+from conditional import is_not_modified, make_etag, not_modified, set_validators
+from fast_json import envelope
+from history_pages import wants_page
+from warmup import WARMUP_TICKERS, WarmUp, fetcher_steps
+import metrics
+import diagnostics
+import shared_routes
 from datetime import datetime
 import traceback
 import os
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for Google AI Studio to access
+metrics.init_flask(app)  # Request latency per route, served at /metrics
 
-# Initialize fetcher (reuse connection)
+# Upper bound for ?days= when the history is streamed (?stream=ndjson)
+MAX_STREAM_DAYS = int(os.getenv('MAX_STREAM_DAYS', 7300))
+
+# Initialize fetcher (connections come from the shared pool)
 fetcher = None
 
 def get_fetcher():
@@ -23,6 +38,21 @@ def get_fetcher():
     return fetcher
 
 
+# Market-wide latest prices, reloaded in the background (started in main)
+snapshot = MarketSnapshot(lambda: get_fetcher().get_all_latest_prices())
+
+# Primes the pool, queries and caches in the background - /api/ready is 503 until it has passed
+warmup = WarmUp()
+
+# Pool, cache and snapshot counters for /metrics (read from their stats() per scrape)
+metrics.register_pool(get_pool)
+metrics.register_fetcher(get_fetcher)
+metrics.register_snapshot(snapshot)
+
+# /api/ready, /metrics, /api/debug/* and the Vary header, shared with the other servers
+app.register_blueprint(shared_routes.blueprint(flask, warmup, lambda: diagnostics.cache_sizes(get_fetcher(), snapshot)))
+
+
 # --------------------------------------------------------------------------------
 # API ENDPOINTS
 # --------------------------------------------------------------------------------
@@ -35,7 +65,15 @@ def health_check():
         'timestamp': datetime.now().isoformat(),
         'message': 'Vietnamese Stock Price API is running (REAL DATA)',
         'source': 'DClab Database',
-        'driver': 'pymssql'
+        'driver': 'pymssql',
+        'pool': get_pool().stats(),
+        'warmup': warmup.stats(),
+        'cache': get_fetcher().cache.stats(),
+        'single_flight': dict(get_fetcher().flight.stats(), keys=get_fetcher().flight.key_stats(10)),
+        'micro_batch': get_fetcher().batcher.stats(),
+        'revalidate': get_fetcher().revalidator.stats(),
+        'snapshot': snapshot.stats(),
+        'history_store': get_fetcher().history_store.stats() if get_fetcher().history_store else None
     })
 
 
@@ -47,15 +85,36 @@ def get_stock_price(symbol):
     Example: GET /api/stock/VNM
     """
     try:
+        if snapshot.ready:
+            # Served from memory - snapshot_age tells clients how fresh it is
+            price = snapshot.get(symbol)
+            if price:
+                etag, modified = make_etag('quote', price), snapshot.modified(symbol)
+                if is_not_modified(request, etag, modified):
+                    return not_modified(Response, etag, modified)
+
+                return set_validators(jsonify({
+                    'success': True,
+                    'data': price,
+                    'source': 'real',
+                    'snapshot_age': snapshot.age(),
+                    'stale': snapshot.stale
+                }), etag, modified)
+
         f = get_fetcher()
-        price = f.get_latest_price(symbol.upper())
+        price, stale = f.get_latest_price_status(symbol.upper())
 
         if price:
-            return jsonify({
+            etag = make_etag('quote', price)
+            if is_not_modified(request, etag):
+                return not_modified(Response, etag)
+
+            return set_validators(jsonify({
                 'success': True,
                 'data': price,
-                'source': 'real'
-            })
+                'source': 'real',
+                'stale': stale
+            }), etag)
         else:
             return jsonify({
                 'success': False,
@@ -88,6 +147,21 @@ def get_multiple_stocks():
                 'error': 'symbols array is required'
             }), 400
 
+        if snapshot.ready:
+            prices = snapshot.get_many(symbols)
+            # Symbols the snapshot does not hold (e.g. listed since the last reload) come from the database
+            missing = [symbol for symbol, price in prices.items() if price is None]
+            if missing:
+                prices.update(get_fetcher().get_multiple_prices(missing))
+
+            return jsonify({
+                'success': True,
+                'data': prices,
+                'source': 'real',
+                'snapshot_age': snapshot.age(),
+                'stale': snapshot.stale
+            })
+
         f = get_fetcher()
         prices = f.get_multiple_prices(symbols)
 
@@ -111,18 +185,31 @@ def get_stock_history(symbol):
     Get historical prices for a stock
 
     Example: GET /api/stock/VNM/history?days=30
+    Stream: GET /api/stock/VNM/history?days=3650&stream=ndjson (one JSON row per line)
+    Pages: GET /api/stock/VNM/history?start=2010-01-01&end=2024-12-31&limit=1000,
+           then repeat with ?cursor=<next_cursor> until next_cursor is null
     """
     try:
+        stream = request.args.get('stream') == 'ndjson'
+
+        if wants_page(request.args):
+            return shared_routes.history_page(Response, request, symbol, get_fetcher().get_history_page)
+
         days = request.args.get('days', default=30, type=int)
+        max_days = MAX_STREAM_DAYS if stream else 365
 
-        if days < 1 or days > 365:
+        if days < 1 or days > max_days:
             return jsonify({
                 'success': False,
-                'error': 'days must be between 1 and 365'
+                'error': f'days must be between 1 and {max_days}'
             }), 400
 
         f = get_fetcher()
-        history = f.get_price_history(symbol.upper(), days=days)
+
+        if stream:
+            return shared_routes.stream_history(Response, symbol, f.iter_price_history(symbol.upper(), days=days))
+
+        history, stale = f.get_price_history_status(symbol.upper(), days=days)
 
         if not history:
             return jsonify({
@@ -130,12 +217,65 @@ def get_stock_history(symbol):
                 'error': f'No historical data found for {symbol}'
             }), 404
 
+        return shared_routes.history_response(Response, request, history, stale, source='real')
+
+    except Exception as e:
         return jsonify({
-            'success': True,
-            'data': history,
-            'count': len(history),
-            'source': 'real'
-        })
+            'success': False,
+            'error': str(e),
+            'traceback': traceback.format_exc()
+        }), 500
+
+
+@app.route('/api/market/<market_name>', methods=['GET'])
+def get_market_summary(market_name):
+    """
+    Get summary of all stocks in a market
+
+    Example: GET /api/market/HOSE
+    """
+    try:
+        valid_markets = ['HOSE', 'HNX', 'UPCOM']
+        market = market_name.upper()
+
+        if market not in valid_markets:
+            return jsonify({
+                'success': False,
+                'error': f'Invalid market. Must be one of: {valid_markets}'
+            }), 400
+
+        # Sliced from the snapshot's column store; loaded here - once for all
+        # waiting requests - before the first background reload or while disabled
+        if not snapshot.ensure_loaded():
+            # Never loaded (database down since startup) - an outage, not an empty market
+            return jsonify({
+                'success': False,
+                'error': 'Market data is not available yet',
+                'last_error': snapshot.last_error
+            }), 503
+
+        mimetype = arrow_format.negotiate(request.accept_mimetypes)
+        etag, modified = make_etag('market', market, mimetype, snapshot.digest), snapshot.modified()
+        if is_not_modified(request, etag, modified):
+            return not_modified(Response, etag, modified)
+
+        # Encoded straight from the column store, no per-row dicts
+        if mimetype == arrow_format.JSON_MIMETYPE:
+            data, count = snapshot.market_json(market)
+        else:
+            data, count = snapshot.market_binary(market, mimetype)
+
+        if not count:
+            return jsonify({
+                'success': False,
+                'error': f'No data found for market {market}'
+            }), 404
+
+        if mimetype != arrow_format.JSON_MIMETYPE:
+            return set_validators(Response(data, mimetype=mimetype), etag, modified)
+
+        body = envelope(data, count=count, source='real', snapshot_age=snapshot.age(), stale=snapshot.stale)
+        return set_validators(Response(body, mimetype='application/json'), etag, modified)
 
     except Exception as e:
         return jsonify({
@@ -181,17 +321,52 @@ if __name__ == '__main__':
 
     # Check environment variable
     print("\n🔍 Checking environment...")
-    if os.getenv('DC_DB_STRING'):
+    if os.getenv('DC_LOCAL_DB'):
+        print(f"🧪 DC_LOCAL_DB is set - using local database {os.getenv('DC_LOCAL_DB')}")
+    elif os.getenv('DC_DB_STRING'):
         print("✅ DC_DB_STRING is set")
     else:
         print("❌ DC_DB_STRING is NOT set!")
         print("⚠️  App will crash on first database request")
 
+    def start_background_jobs():
+        # Load the market snapshot in the background (SNAPSHOT_INTERVAL=0 disables it)
+        if snapshot.enabled:
+            print(f"\n📸 Market snapshot refreshes every {snapshot.interval:.0f}s")
+            snapshot.start()
+
+        # Keep the local history store in sync with Market_Data (HISTORY_STORE_DIR)
+        store = get_fetcher().history_store
+        if store is not None:
+            print(f"\n💾 History store at {store.root} (synced up to {store.high_water_mark or 'never'})")
+            store.start_sync(get_fetcher())
+
+    # Open the pool, run every query for the hot tickers and load the snapshot
+    # while the server starts - /api/ready is 503 until the pool and snapshot
+    # are up (WARMUP=0 skips it, WARMUP_TICKERS sets the list)
+    if warmup.enabled:
+        print(f"\n🔥 Warming up in the background ({', '.join(WARMUP_TICKERS)})...")
+        warmup.start(fetcher_steps(get_fetcher(), get_pool(), snapshot), then=start_background_jobs)
+    else:
+        try:
+            get_pool().prefill()
+        except Exception as e:
+            print(f"❌ Could not prefill pool: {e}")
+        stats = get_pool().stats()
+        print(f"✅ Pool ready ({stats['size']} open, max {stats['max_size']})")
+        start_background_jobs()
+
     print("\nAvailable Endpoints:")
     print("  GET  /api/health")
+    print("  GET  /metrics")
+    print("  GET  /api/debug/profile?seconds=10  (DEBUG_TOKEN)")
+    print("  GET  /api/debug/memory  (DEBUG_TOKEN)")
     print("  GET  /api/stock/<symbol>")
     print("  POST /api/stocks")
     print("  GET  /api/stock/<symbol>/history?days=30")
+    print("  GET  /api/stock/<symbol>/history?days=3650&stream=ndjson")
+    print("  GET  /api/stock/<symbol>/history?start=2010-01-01&end=2024-12-31[&cursor=...]")
+    print("  GET  /api/market/<market>")
     print("\n" + "="*60)
     print(f"\nStarting server on http://0.0.0.0:{port}")
     print("Press Ctrl+C to stop")
@@ -0,0 +1,106 @@
+"""
+Binary columnar responses (Apache Arrow IPC stream, Parquet)
+Chosen by the Accept header on the history and market routes, so pandas clients
+can load a response with pyarrow instead of parsing JSON:
+
+    pa.ipc.open_stream(resp.content).read_pandas()
+    pd.read_parquet(io.BytesIO(resp.content))
+"""
+
+import io
+from typing import Dict, List, Mapping
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Optional - JSON is served when pyarrow is not installed
+    pa = None
+    pq = None
+
+
+JSON_MIMETYPE = 'application/json'
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+PARQUET_MIMETYPE = 'application/vnd.apache.parquet'
+
+# Columns holding dates, sent as Arrow date32 instead of strings
+DATE_COLUMNS = ('trade_date', 'date')
+
+
+def available() -> bool:
+    return pa is not None
+
+
+def negotiate(accept) -> str:
+    """
+    Response mimetype for a request's Accept header
+
+    Args:
+        accept: request.accept_mimetypes (Flask/Quart MIMEAccept)
+
+    Returns:
+        ARROW_MIMETYPE, PARQUET_MIMETYPE or JSON_MIMETYPE (the default, and
+        the only choice when pyarrow is missing)
+    """
+    if not available():
+        return JSON_MIMETYPE
+
+    # Binary formats only when named explicitly - */* and browsers keep getting JSON
+    listed = dict(accept)  # mimetype -> quality as sent by the client
+    best = max((ARROW_MIMETYPE, PARQUET_MIMETYPE), key=lambda m: listed.get(m, 0))
+    if listed.get(best, 0) > 0 and listed[best] >= listed.get(JSON_MIMETYPE, 0):
+        return best
+    return JSON_MIMETYPE
+
+
+def table_from_columns(columns: Mapping[str, object]):
+    """Arrow table from {name: array or list}; date columns become date32"""
+    arrays = {}
+    for name, values in columns.items():
+        values = np.asarray(values)
+        if name in DATE_COLUMNS:
+            if values.dtype.kind != 'M':
+                values = np.array([v if v else None for v in values.tolist()], dtype='datetime64[D]')
+            values = values.astype('datetime64[D]')
+        elif values.dtype == object:
+            values = values.tolist()
+        arrays[name] = pa.array(values, from_pandas=True)
+    return pa.table(arrays)
+
+
+def table_from_frame(frame):
+    """Arrow table from a DataFrame (same date handling as table_from_columns)"""
+    return table_from_columns({name: frame[name].to_numpy() for name in frame.columns})
+
+
+def table_from_records(records: List[Dict]):
+    """Arrow table from a list of row dicts"""
+    if not records:
+        return pa.table({})
+    return table_from_columns({name: [r.get(name) for r in records] for name in records[0]})
+
+
+def encode(table, mimetype: str) -> bytes:
+    """Serialize a table as an Arrow IPC stream or a Parquet file"""
+    if mimetype == PARQUET_MIMETYPE:
+        sink = io.BytesIO()
+        pq.write_table(table, sink)
+        return sink.getvalue()
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def encode_columns(columns: Mapping[str, object], mimetype: str) -> bytes:
+    return encode(table_from_columns(columns), mimetype)
+
+
+def encode_frame(frame, mimetype: str) -> bytes:
+    return encode(table_from_frame(frame), mimetype)
+
+
+def encode_records(records: List[Dict], mimetype: str) -> bytes:
+    return encode(table_from_records(records), mimetype)
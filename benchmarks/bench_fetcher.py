@@ -0,0 +1,229 @@
+"""
+Benchmark: StockPriceFetcher hot paths, stage by stage
+Runs the pymssql fetcher's queries against the local database (DC_LOCAL_DB, see
+database_connection_local.py) at realistic sizes and times each stage on its own:
+
+    execute    cursor.execute() - query planning and the first rows
+    fetch      fetchall() - moving rows out of the driver
+    convert    row -> quote / history dict (and DataFrame for the pandas path)
+    serialize  response body as the routes build it
+
+Quotes for 1, 30 and 1,600 tickers, history for 30 days to 10 years, and the
+whole market. The public methods are timed end to end too, with caches cleared
+and micro-batching off so every call reaches the database.
+
+SQLite produces rows lazily, so most of the query time shows up under fetch
+rather than execute - compare stages between runs, not with SQL Server.
+
+Run: python benchmarks/bench_fetcher.py --local-db market_data.db [--repeat 20] [--large-repeat 3]
+                                         [--json out.json]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class Stages:
+    """Wall time per named stage, summed within a run, across repeated runs"""
+
+    def __init__(self):
+        self.times = defaultdict(list)  # stage -> milliseconds per run
+        self._current = defaultdict(float)
+
+    @contextmanager
+    def __call__(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._current[name] += (time.perf_counter() - start) * 1000
+
+    def lap(self):
+        """End one run - a stage entered several times (one query per batch) counts once"""
+        for name, elapsed in self._current.items():
+            self.times[name].append(elapsed)
+        self._current = defaultdict(float)
+
+    def summary(self):
+        """Median and best milliseconds per stage, plus their total"""
+        result = {
+            name: {'median': round(statistics.median(t), 3), 'best': round(min(t), 3)}
+            for name, t in self.times.items()
+        }
+        result['total'] = {
+            'median': round(sum(s['median'] for s in result.values()), 3),
+            'best': round(sum(s['best'] for s in result.values()), 3),
+        }
+        return result
+
+
+def timed(func, repeat):
+    stages = Stages()
+    for _ in range(repeat):
+        with stages('call'):
+            func()
+        stages.lap()
+    return stages.summary()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--local-db', default=os.getenv('DC_LOCAL_DB', 'market_data.db'))
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--large-repeat', type=int, default=3,
+                        help='Runs of the 1,600-ticker and whole-market cases')
+    parser.add_argument('--json', help='Write the results here as JSON')
+    args = parser.parse_args()
+
+    # The database modules read DC_LOCAL_DB at import; history always comes
+    # from the database here, not from a local history store
+    os.environ['DC_LOCAL_DB'] = os.path.abspath(args.local_db)
+    os.environ.pop('HISTORY_STORE_DIR', None)
+    import pandas as pd
+    from flask import Flask, jsonify
+
+    import get_stock_prices_pymssql as prices
+    from database_connection_pymssql import get_pool
+    from fast_json import dumps, encode_frame, envelope
+    from market_snapshot import MarketColumns
+
+    fetcher = prices.StockPriceFetcher()
+    fetcher.batcher.window = 0  # One query per call, no batching window in the timings
+    pool = get_pool()
+    pool.prefill()
+    app = Flask(__name__)
+
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT DISTINCT TICKER FROM Market_Data ORDER BY TICKER")
+        universe = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+    hot = 'VNM' if 'VNM' in universe else universe[0]
+
+    def query(stages, sql, params=()):
+        with pool.connection() as conn:
+            cursor = conn.cursor(as_dict=True)
+            with stages('execute'):
+                cursor.execute(sql, params)
+            with stages('fetch'):
+                rows = cursor.fetchall()
+            cursor.close()
+        return rows
+
+    results = {}
+
+    def record(name, summary):
+        results[name] = summary
+        stages = '  '.join(f"{k} {v['median']:.2f}" for k, v in summary.items() if k != 'total')
+        print(f"{name:<34}{summary['total']['median']:>10.2f} ms   {stages}")
+
+    print(f"{'case':<34}{'median':>13}   stages (median ms)")
+
+    # ----------------------------------------------------------------------------
+    # QUOTES - the IN query behind get_latest_price / get_multiple_prices
+    # ----------------------------------------------------------------------------
+
+    for count in (1, 30, 1600):
+        tickers = universe[:count]
+        stages = Stages()
+        for _ in range(args.large_repeat if count > 100 else args.repeat):
+            rows = []
+            for i in range(0, len(tickers), prices.BATCH_SIZE):
+                batch = tickers[i:i + prices.BATCH_SIZE]
+                where = f"WHERE TICKER IN ({', '.join(['%s'] * len(batch))})"
+                rows += query(stages, prices.LATEST_PRICES_QUERY.format(where=where), tuple(batch))
+            with stages('convert'):
+                data = {row['TICKER']: fetcher._format_price(row) for row in rows}
+            with stages('serialize'):
+                with app.app_context():
+                    if count == 1:
+                        jsonify({'success': True, 'data': data[tickers[0]], 'source': 'real',
+                                 'stale': False}).get_data()
+                    else:
+                        jsonify({'success': True, 'data': data, 'count': len(data),
+                                 'source': 'real'}).get_data()
+            stages.lap()
+        record(f'quotes x{count} (stages)', stages.summary())
+
+    def latest_uncached():
+        fetcher.cache.invalidate()
+        fetcher.get_latest_price(hot)
+    record('get_latest_price', timed(latest_uncached, args.repeat))
+
+    for count in (30, 1600):
+        def multiple_uncached(tickers=universe[:count]):
+            fetcher.cache.invalidate()
+            fetcher.get_multiple_prices(tickers)
+        repeat = args.large_repeat if count > 100 else args.repeat
+        record(f'get_multiple_prices x{count}', timed(multiple_uncached, repeat))
+
+    # ----------------------------------------------------------------------------
+    # HISTORY - one ticker, 30 days to 10 years
+    # ----------------------------------------------------------------------------
+
+    for days in (30, 365, 3650):
+        stages = Stages()
+        frames = Stages()
+        for _ in range(args.repeat):
+            rows = query(stages, prices.HISTORY_QUERY.format(where='TICKER = %s'), (days, hot))
+            with stages('convert'):
+                history = [fetcher._format_history_row(row) for row in rows]
+            with stages('serialize'):
+                envelope(dumps(history), count=len(history), source='real', stale=False)
+
+            # The pandas path of the pyodbc servers: rows -> DataFrame -> JSON
+            with frames('convert'):
+                frame = pd.DataFrame.from_records(rows)
+            with frames('serialize'):
+                envelope(encode_frame(frame, date_columns=('TRADE_DATE',)), count=len(frame), source='real')
+            stages.lap()
+            frames.lap()
+        record(f'history {days}d (stages)', stages.summary())
+        record(f'history {days}d DataFrame', frames.summary())
+
+        def history_uncached(days=days):
+            fetcher.history_cache.invalidate()
+            fetcher.get_price_history(hot, days)
+        record(f'get_price_history {days}d', timed(history_uncached, args.repeat))
+
+    # ----------------------------------------------------------------------------
+    # MARKET - every ticker (the snapshot load behind the market routes)
+    # ----------------------------------------------------------------------------
+
+    stages = Stages()
+    for _ in range(args.large_repeat):
+        sql = prices.MARKET_PRICES_QUERY.format(exchange_column=prices.EXCHANGE_COLUMN)
+        rows = query(stages, sql)
+        with stages('convert'):
+            quotes = {}
+            for row in rows:
+                quote = fetcher._format_price(row)
+                quote['exchange'] = row['exchange']
+                quotes[row['TICKER']] = quote
+            columns = MarketColumns(quotes)
+        with stages('serialize'):
+            for market in columns.markets():
+                data, count = columns.to_json(market)
+                envelope(data, count=count, source='real')
+        stages.lap()
+    record(f'market x{len(universe)} (stages)', stages.summary())
+
+    record('get_all_latest_prices', timed(fetcher.get_all_latest_prices, args.large_repeat))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'local_db': os.path.basename(args.local_db), 'repeat': args.repeat,
+                       'tickers': len(universe), 'results': results}, f, indent=2)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Benchmark: JSON serialization of market and history responses
+Compares the old path (to_dict('records') + strftime loop / per-row dicts + jsonify)
+with fast_json (column arrays straight to JSON text). No database needed.
+
+Run: python benchmarks/bench_json.py [--tickers 1600] [--years 10] [--repeat 20]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+from flask import Flask, jsonify
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fast_json import encode_columns, encode_frame, envelope
+from market_snapshot import MarketColumns
+
+
+def make_quotes(count):
+    """{ticker: quote dict} shaped like get_all_latest_prices"""
+    rng = np.random.default_rng(1)
+    exchanges = ['HSX', 'HNX', 'UPCOM']
+    quotes = {}
+    for i in range(count):
+        ticker = f'T{i:04d}'
+        close, open_ = rng.uniform(5, 200, 2).round(2).tolist()
+        quotes[ticker] = {
+            'symbol': ticker,
+            'ticker': ticker,
+            'exchange': exchanges[i % 3],
+            'price': close,
+            'open': open_,
+            'high': max(close, open_) + 1,
+            'low': min(close, open_) - 1,
+            'volume': int(rng.integers(0, 10_000_000)),
+            'trade_date': '2026-01-02',
+            'change': round(close - open_, 2),
+            'pct_change': round((close - open_) / open_ * 100, 2),
+        }
+    return quotes
+
+
+def make_history(years):
+    """DataFrame shaped like get_price_history (simple fetcher) for one ticker"""
+    days = pd.bdate_range(date.today() - timedelta(days=365 * years), date.today())
+    rng = np.random.default_rng(2)
+    close = rng.uniform(10, 100, len(days)).round(2)
+    open_ = (close + rng.normal(0, 1, len(days))).round(2)
+    frame = pd.DataFrame({
+        'ticker': 'VNM',
+        'trade_date': days,
+        'open_price': open_,
+        'high_price': np.maximum(open_, close) + 0.5,
+        'low_price': np.minimum(open_, close) - 0.5,
+        'close_price': close,
+        'volume': rng.integers(0, 5_000_000, len(days)),
+    })
+    frame['change_amount'] = (frame['close_price'] - frame['open_price']).round(2)
+    frame['change_percent'] = (frame['change_amount'] / frame['open_price'] * 100).round(2)
+    return frame
+
+
+def timed(func, repeat):
+    """Best and mean wall time of func() in milliseconds"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    return min(times), sum(times) / len(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--tickers', type=int, default=1600)
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    columns = MarketColumns(make_quotes(args.tickers))
+    history = make_history(args.years)
+
+    def market_old():
+        data = columns.records('HOSE')
+        return jsonify({'success': True, 'data': data, 'count': len(data), 'source': 'real'}).get_data()
+
+    def market_new():
+        # Encodes on every call, as on the first request after a reload
+        sliced = columns.slice('HOSE')
+        data = encode_columns(sliced, MarketColumns.RECORD_FIELDS)
+        return envelope(data, count=len(sliced['ticker']), source='real')
+
+    def market_cached():
+        # Later requests until the next reload reuse the encoded text
+        data, count = columns.to_json('HOSE')
+        return envelope(data, count=count, source='real')
+
+    def history_old():
+        data = history.to_dict('records')
+        for item in data:
+            if 'trade_date' in item and item['trade_date']:
+                item['trade_date'] = item['trade_date'].strftime('%Y-%m-%d')
+        return jsonify({'success': True, 'data': data, 'count': len(data), 'source': 'real'}).get_data()
+
+    def history_new():
+        return envelope(encode_frame(history), count=len(history), source='real')
+
+    rows = len(columns.slice('HOSE')['ticker'])
+    cases = [
+        (f'market ({rows} rows)', market_old, market_new),
+        ('market cached', market_old, market_cached),
+        (f'history ({len(history)} rows)', history_old, history_new),
+    ]
+
+    print(f"{'case':<22}{'path':<8}{'best ms':>10}{'mean ms':>10}{'bytes':>10}")
+    with app.app_context():
+        for name, old, new in cases:
+            # Both paths must produce the same document
+            assert json.loads(old()) == json.loads(new()), name
+
+            results = {}
+            for label, func in (('old', old), ('fast', new)):
+                best, mean = timed(func, args.repeat)
+                results[label] = best
+                print(f"{name:<22}{label:<8}{best:>10.2f}{mean:>10.2f}{len(func()):>10}")
+            print(f"{'':<22}speedup {results['old'] / results['fast']:>9.1f}x\n")
+
+
+if __name__ == '__main__':
+    main()
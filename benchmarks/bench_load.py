@@ -0,0 +1,374 @@
+"""
+Benchmark: end-to-end HTTP load against an API server
+Starts one of the api_server variants (or targets a running one with --url),
+drives a weighted mix of quote, batch, history and market requests at a fixed
+concurrency or a fixed arrival rate, and writes latency percentiles, RPS and
+error rates as JSON so runs can be compared over time.
+
+With --local-db every database-backed server (pymssql, pyodbc and async)
+runs against the local SQLite database instead of DClab (DC_LOCAL_DB, see
+database_connection_local.py); api_server_demo.py needs no database.
+
+Run: python benchmarks/bench_load.py --server api_server_pymssql.py --local-db market_data.db
+         [--concurrency 16 | --rate 200] [--duration 30]
+         [--mix quote=50,batch=10,history=30,market=10] [--output result.json]
+"""
+
+import argparse
+import http.client
+import json
+import os
+import queue
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import numpy as np
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Servers that ignore $PORT and always listen on 5001
+FIXED_PORT_SERVERS = {'api_server.py': 5001, 'api_server_demo.py': 5001}
+
+DEFAULT_MIX = 'quote=50,batch=10,history=30,market=10'
+DEFAULT_TICKERS = ['VNM', 'VCB', 'HPG', 'FPT', 'VIC', 'MWG', 'SSI', 'MSN']
+MARKETS = ['HOSE', 'HNX', 'UPCOM']
+
+
+# --------------------------------------------------------------------------------
+# SERVER
+# --------------------------------------------------------------------------------
+
+def start_server(script, port, local_db=None, env=None):
+    """Start an api_server variant as a subprocess, returns (process, base URL)"""
+    port = FIXED_PORT_SERVERS.get(os.path.basename(script), port)
+    server_env = dict(os.environ, PORT=str(port), **(env or {}))
+    if local_db:
+        server_env['DC_LOCAL_DB'] = os.path.abspath(local_db)
+
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, script)],
+        cwd=ROOT, env=server_env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    return process, f'http://127.0.0.1:{port}'
+
+
+def wait_ready(base_url, process=None, timeout=600):
+    """
+    Block until the server answers /api/ready with 200 (or /api/health on
+    servers without a readiness route)
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        for path in ('/api/ready', '/api/health'):
+            try:
+                status, _ = request_once(base_url, 'GET', path)
+            except OSError:
+                break
+            if status == 200:
+                return
+            if status != 404:
+                break
+        time.sleep(0.5)
+    raise TimeoutError(f"{base_url} not ready after {timeout}s")
+
+
+def request_once(base_url, method, path, body=None):
+    """One request on a fresh connection, returns (status, body bytes)"""
+    parts = urlsplit(base_url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+    try:
+        conn.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+
+def discover_tickers(base_url, limit):
+    """Tickers listed by the market routes, falling back to DEFAULT_TICKERS"""
+    tickers = []
+    for market in MARKETS:
+        try:
+            status, body = request_once(base_url, 'GET', f'/api/market/{market}')
+            if status == 200:
+                tickers += [row.get('symbol') or row.get('ticker') for row in json.loads(body)['data']]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+    tickers = [t for t in dict.fromkeys(tickers) if t]
+    return (tickers or DEFAULT_TICKERS)[:limit]
+
+
+# --------------------------------------------------------------------------------
+# WORKLOAD
+# --------------------------------------------------------------------------------
+
+def parse_mix(text):
+    """'quote=50,history=30' -> {'quote': 50.0, 'history': 30.0}"""
+    mix = {}
+    for part in text.split(','):
+        kind, _, weight = part.partition('=')
+        if kind.strip() not in ('quote', 'batch', 'history', 'market'):
+            raise ValueError(f"Unknown request kind '{kind}'")
+        mix[kind.strip()] = float(weight or 1)
+    return mix
+
+
+class Workload:
+    """Picks the next request at random according to the mix"""
+
+    def __init__(self, mix, tickers, batch_size=20, history_days=(30, 90, 365, 3650), seed=1):
+        self.kinds = list(mix)
+        self.weights = [mix[k] for k in self.kinds]
+        self.tickers = tickers
+        self.batch_size = min(batch_size, len(tickers))
+        self.history_days = history_days
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def next(self):
+        """(kind, method, path, body)"""
+        with self._lock:
+            rng = self._rng
+            kind = rng.choices(self.kinds, self.weights)[0]
+            if kind == 'quote':
+                return kind, 'GET', f'/api/stock/{rng.choice(self.tickers)}', None
+            if kind == 'batch':
+                symbols = rng.sample(self.tickers, self.batch_size)
+                return kind, 'POST', '/api/stocks', json.dumps({'symbols': symbols}).encode()
+            if kind == 'history':
+                days = rng.choice(self.history_days)
+                # Plain history is capped at a year - longer ranges are streamed
+                stream = '&stream=ndjson' if days > 365 else ''
+                return kind, 'GET', f'/api/stock/{rng.choice(self.tickers)}/history?days={days}{stream}', None
+            return kind, 'GET', f'/api/market/{rng.choice(MARKETS)}', None
+
+
+class Recorder:
+    """Latencies and status codes per request kind, shared by all workers"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)  # kind -> seconds
+        self.statuses = defaultdict(Counter)  # kind -> {status or error name: count}
+
+    def add(self, kind, latency, status):
+        with self._lock:
+            self.latencies[kind].append(latency)
+            self.statuses[kind][status] += 1
+
+
+class Client:
+    """Keep-alive HTTP connection owned by one worker thread"""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port
+        self.conn = None
+
+    def send(self, method, path, body):
+        """Returns the status code, or the exception class name on failure"""
+        try:
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            headers = {'Content-Type': 'application/json'} if body else {}
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+            response.read()
+            if response.will_close:
+                self.close()
+            return response.status
+        except (OSError, http.client.HTTPException) as e:
+            self.close()
+            return type(e).__name__
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def run_closed(base_url, workload, recorder, concurrency, duration):
+    """Fixed concurrency: each worker sends its next request as soon as one completes"""
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        client = Client(base_url)
+        while time.perf_counter() < deadline:
+            kind, method, path, body = workload.next()
+            start = time.perf_counter()
+            status = client.send(method, path, body)
+            recorder.add(kind, time.perf_counter() - start, status)
+        client.close()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def run_open(base_url, workload, recorder, rate, duration, max_workers):
+    """
+    Fixed arrival rate: requests are scheduled every 1/rate seconds whatever the
+    server does. Latency counts from the scheduled time, so queueing behind a
+    slow server is measured instead of hidden (no coordinated omission)
+    """
+    pending = queue.Queue()
+    total = int(rate * duration)
+
+    def worker():
+        client = Client(base_url)
+        while True:
+            item = pending.get()
+            if item is None:
+                break
+            scheduled, (kind, method, path, body) = item
+            status = client.send(method, path, body)
+            recorder.add(kind, time.perf_counter() - scheduled, status)
+        client.close()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(max_workers)]
+    for t in threads:
+        t.start()
+
+    start = time.perf_counter()
+    for i in range(total):
+        scheduled = start + i / rate
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        pending.put((scheduled, workload.next()))
+
+    for _ in threads:
+        pending.put(None)
+    for t in threads:
+        t.join()
+
+
+# --------------------------------------------------------------------------------
+# REPORT
+# --------------------------------------------------------------------------------
+
+def summarize(latencies, statuses, elapsed):
+    """Counts, RPS, error rate and latency percentiles (ms) for one set of requests"""
+    count = len(latencies)
+    errors = sum(n for status, n in statuses.items()
+                 if not isinstance(status, int) or status >= 400)
+    summary = {
+        'requests': count,
+        'errors': errors,
+        'error_rate': round(errors / count, 4) if count else 0.0,
+        'rps': round(count / elapsed, 2) if elapsed else 0.0,
+        'status': {str(status): n for status, n in sorted(statuses.items(), key=lambda kv: str(kv[0]))},
+    }
+    if count:
+        ms = np.asarray(latencies) * 1000
+        p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+        summary['latency_ms'] = {
+            'mean': round(float(ms.mean()), 3),
+            'p50': round(float(p50), 3),
+            'p95': round(float(p95), 3),
+            'p99': round(float(p99), 3),
+            'max': round(float(ms.max()), 3),
+        }
+    return summary
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--server', help='api_server script to start, e.g. api_server_pymssql.py')
+    target.add_argument('--url', help='Base URL of an already running server')
+    parser.add_argument('--local-db', default=os.getenv('DC_LOCAL_DB'),
+                        help='Local Market_Data file passed to the server as DC_LOCAL_DB')
+    parser.add_argument('--port', type=int, default=5099)
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument('--concurrency', type=int, default=16, help='Closed loop with N workers (default)')
+    load.add_argument('--rate', type=float, help='Open loop at this many requests per second')
+    parser.add_argument('--max-workers', type=int, default=64, help='Workers for --rate')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds of load')
+    parser.add_argument('--warmup', type=float, default=5, help='Seconds of unrecorded load first')
+    parser.add_argument('--mix', default=DEFAULT_MIX)
+    parser.add_argument('--tickers', type=int, default=200, help='Distinct tickers requested')
+    parser.add_argument('--batch-size', type=int, default=20, help='Symbols per POST /api/stocks')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Write the JSON result here as well as to stdout')
+    args = parser.parse_args()
+
+    process = None
+    base_url = args.url
+    if args.server:
+        process, base_url = start_server(args.server, args.port, args.local_db)
+
+    try:
+        wait_ready(base_url, process)
+        mix = parse_mix(args.mix)
+        tickers = discover_tickers(base_url, args.tickers)
+        workload = Workload(mix, tickers, batch_size=args.batch_size, seed=args.seed)
+
+        def run(recorder, duration):
+            if args.rate:
+                run_open(base_url, workload, recorder, args.rate, duration, args.max_workers)
+            else:
+                run_closed(base_url, workload, recorder, args.concurrency, duration)
+
+        if args.warmup > 0:
+            run(Recorder(), args.warmup)
+
+        recorder = Recorder()
+        started = time.perf_counter()
+        run(recorder, args.duration)
+        elapsed = time.perf_counter() - started
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+    all_latencies = [x for values in recorder.latencies.values() for x in values]
+    all_statuses = sum(recorder.statuses.values(), Counter())
+
+    result = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'server': args.server or base_url,
+        'local_db': os.path.basename(args.local_db) if args.local_db and args.server else None,
+        'mode': 'rate' if args.rate else 'concurrency',
+        'concurrency': None if args.rate else args.concurrency,
+        'rate': args.rate,
+        'duration': round(elapsed, 3),
+        'mix': mix,
+        'tickers': len(tickers),
+        'total': summarize(all_latencies, all_statuses, elapsed),
+        'by_kind': {
+            kind: summarize(recorder.latencies[kind], recorder.statuses[kind], elapsed)
+            for kind in sorted(recorder.latencies)
+        },
+    }
+
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
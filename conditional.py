@@ -0,0 +1,65 @@
+"""
+Conditional GET (ETag / Last-Modified -> 304 Not Modified)
+Quote and market validators come from the data version - a quote or the
+snapshot digest - so a matching request is answered before any query runs.
+History validators hash the rows actually returned, so a matching request
+still skips encoding and sending the body
+"""
+
+import hashlib
+from datetime import datetime, timezone
+from typing import Optional
+
+import pandas as pd
+
+
+def make_etag(*parts) -> str:
+    """Strong entity tag (unquoted) for the given version parts"""
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:24]
+
+
+def is_not_modified(request, etag: str, modified: Optional[float] = None) -> bool:
+    """
+    True if the client's cached copy is still current
+
+    If-None-Match wins over If-Modified-Since when both are sent (RFC 9110)
+
+    Args:
+        request: Flask or Quart request
+        etag: Current entity tag
+        modified: time.time() of the last change, if known
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if modified is not None and request.if_modified_since is not None:
+        # HTTP dates have whole-second precision
+        return int(modified) <= request.if_modified_since.timestamp()
+    return False
+
+
+def frame_digest(frame) -> str:
+    """
+    Content hash of a DataFrame, for validators of responses built from one
+    Row hashes are combined in order, so reordered rows give a different digest
+    """
+    rows = pd.util.hash_pandas_object(frame, index=False).to_numpy()
+    digest = hashlib.sha1(repr(list(frame.columns)).encode())
+    digest.update(rows.tobytes())
+    return digest.hexdigest()[:24]
+
+
+def set_validators(response, etag: Optional[str], modified: Optional[float] = None):
+    """Attach ETag / Last-Modified to a response and return it (unchanged if etag is None)"""
+    if etag is None:
+        return response
+    response.set_etag(etag)
+    if modified is not None:
+        response.last_modified = datetime.fromtimestamp(int(modified), tz=timezone.utc)
+    # Caches may store the body but must revalidate before reusing it
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def not_modified(response_class, etag: str, modified: Optional[float] = None):
+    """Empty 304 response carrying the current validators"""
+    return set_validators(response_class(status=304), etag, modified)
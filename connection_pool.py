@@ -0,0 +1,328 @@
+"""
+Thread-safe database connection pool
+Works with any DB-API driver (pymssql, pyodbc) through a connection factory
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict
+
+from metrics import phase
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within the timeout"""
+
+
+def ping(conn) -> bool:
+    """Default liveness check - run a trivial query on the connection"""
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1")
+        cursor.fetchone()
+        cursor.close()
+        return True
+    except Exception:
+        return False
+
+
+class ConnectionPool:
+    """
+    Bounded pool of reusable database connections
+
+    - Keeps at least min_size connections open once prefilled
+    - Never opens more than max_size connections at the same time
+    - Checks liveness when a connection that sat idle is borrowed
+    - Closes connections idle longer than max_idle seconds (down to min_size)
+    """
+
+    def __init__(self, factory: Callable, min_size: int = 1, max_size: int = 10,
+                 max_idle: float = 300, check_after: float = 30,
+                 timeout: float = 30, validate: Callable = ping):
+        """
+        Args:
+            factory: Callable returning a new DB-API connection
+            min_size: Connections kept open even when idle
+            max_size: Upper bound on open connections
+            max_idle: Seconds a connection may sit idle before being closed
+            check_after: Idle seconds after which a borrowed connection is pinged
+            timeout: Seconds to wait for a free connection before PoolTimeout
+            validate: Liveness check, returns True if the connection is usable
+        """
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Pool sizes must satisfy 0 <= min_size <= max_size, max_size >= 1")
+
+        self.factory = factory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self.timeout = timeout
+        self.validate = validate
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (connection, last_used) - most recently used on the right
+        self._size = 0  # Open connections, idle + borrowed
+        self._closed = False
+        self._generation = 0  # Bumped by rotate()
+        self._born = {}  # id(connection) -> generation it was opened in
+
+        self._stats = {
+            'created': 0,
+            'closed': 0,
+            'borrowed': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'timeouts': 0,
+            'failed_checks': 0,
+            'evicted': 0,
+            'rotations': 0,
+            'retired': 0,
+        }
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    # --------------------------------------------------------------------------------
+    # BORROW / RETURN
+    # --------------------------------------------------------------------------------
+
+    def acquire(self):
+        """Borrow a connection, creating one if the pool is below max_size"""
+        deadline = time.monotonic() + self.timeout
+
+        while True:
+            stale = []
+            try:
+                conn, last_used = self._checkout(deadline, stale)
+            finally:
+                # Close evicted connections outside the lock
+                for old in stale:
+                    self._close_quietly(old)
+
+            if conn is None:
+                # A slot was reserved for us - open a new connection
+                return self._create()
+
+            if time.monotonic() - last_used < self.check_after or self.validate(conn):
+                return conn
+
+            with self._cond:
+                self._stats['failed_checks'] += 1
+            self._discard(conn)
+
+    def release(self, conn, broken: bool = False):
+        """Return a borrowed connection (closed instead if broken)"""
+        if broken or self._closed:
+            self._discard(conn)
+            return
+
+        with self._cond:
+            retired = self._born.get(id(conn), self._generation) != self._generation
+            if retired:
+                self._stats['retired'] += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+        if retired:
+            # Opened before the last rotate() - replace rather than reuse
+            self._discard(conn)
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection for the duration of a with-block
+
+        If the block raises, the connection is pinged and dropped when dead.
+        If it is abandoned (e.g. a streaming generator closed mid-result set),
+        the connection may still have unread rows and is always dropped
+        """
+        with phase('connect'):  # Waiting for, or opening, a connection
+            conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except Exception:
+            broken = not self.validate(conn)
+            raise
+        except BaseException:
+            broken = True
+            raise
+        finally:
+            self.release(conn, broken=broken)
+
+    # --------------------------------------------------------------------------------
+    # MAINTENANCE
+    # --------------------------------------------------------------------------------
+
+    def prefill(self):
+        """Open connections until min_size are available"""
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            conn = self._create()
+            self.release(conn)
+
+    def evict_idle(self) -> int:
+        """Close connections idle longer than max_idle, returns number closed"""
+        with self._cond:
+            stale = self._collect_idle_locked()
+        for conn in stale:
+            self._close_quietly(conn)
+        return len(stale)
+
+    def rotate(self) -> int:
+        """
+        Retire every open connection, e.g. after the login credentials changed
+
+        Idle connections are closed now and borrowed ones when they are
+        returned, so no in-flight query is interrupted. The pool is then
+        prefilled again through the factory. Returns the number closed now
+        """
+        with self._cond:
+            if self._closed:
+                return 0
+            self._generation += 1
+            self._stats['rotations'] += 1
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            for conn in idle:
+                self._born.pop(id(conn), None)
+            self._size -= len(idle)
+            self._stats['closed'] += len(idle)
+            self._stats['retired'] += len(idle)
+            self._cond.notify_all()
+
+        for conn in idle:
+            self._close_quietly(conn)
+        self.prefill()
+        return len(idle)
+
+    def close(self):
+        """Close all idle connections; borrowed ones are closed when returned"""
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            for conn in idle:
+                self._born.pop(id(conn), None)
+            self._size -= len(idle)
+            self._stats['closed'] += len(idle)
+            self._cond.notify_all()
+
+        for conn in idle:
+            self._close_quietly(conn)
+
+    def stats(self) -> Dict:
+        """Pool size and usage counters"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats['wait_time'] = round(stats['wait_time'], 4)
+            stats.update({
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'generation': self._generation,
+            })
+        return stats
+
+    # --------------------------------------------------------------------------------
+    # INTERNALS
+    # --------------------------------------------------------------------------------
+
+    def _checkout(self, deadline: float, stale: list):
+        """
+        Take an idle connection or reserve a slot for a new one
+
+        Connections evicted on the way are appended to stale for closing
+        Returns (connection, last_used) or (None, None) when a slot was reserved
+        """
+        waited_since = None
+
+        with self._cond:
+            try:
+                while True:
+                    if self._closed:
+                        raise RuntimeError("Connection pool is closed")
+
+                    stale.extend(self._collect_idle_locked())
+
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        self._stats['borrowed'] += 1
+                        return conn, last_used
+
+                    if self._size < self.max_size:
+                        self._size += 1
+                        self._stats['borrowed'] += 1
+                        return None, None
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeout(
+                            f"No connection available after {self.timeout}s "
+                            f"(max_size={self.max_size})"
+                        )
+
+                    if waited_since is None:
+                        waited_since = time.monotonic()
+                        self._stats['waits'] += 1
+                    self._cond.wait(remaining)
+            finally:
+                if waited_since is not None:
+                    self._stats['wait_time'] += time.monotonic() - waited_since
+
+    def _collect_idle_locked(self):
+        """Remove connections idle past max_idle, keeping min_size open"""
+        stale = []
+        now = time.monotonic()
+        while (self._idle and self._size > self.min_size
+               and now - self._idle[0][1] > self.max_idle):
+            conn, _ = self._idle.popleft()
+            self._born.pop(id(conn), None)
+            self._size -= 1
+            self._stats['evicted'] += 1
+            self._stats['closed'] += 1
+            stale.append(conn)
+        return stale
+
+    def _create(self):
+        """Open a new connection for an already reserved slot"""
+        generation = self._generation
+        try:
+            conn = self.factory()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._stats['created'] += 1
+            self._born[id(conn)] = generation
+        return conn
+
+    def _discard(self, conn):
+        """Close a connection and free its slot"""
+        self._close_quietly(conn)
+        with self._cond:
+            self._born.pop(id(conn), None)
+            self._size -= 1
+            self._stats['closed'] += 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
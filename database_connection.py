@@ -5,10 +5,11 @@ Database connection with Microsoft Entra ID authentication for DClab
 import os
 import json
 import struct
-import pyodbc
+import threading
 from datetime import datetime, timedelta
 from typing import Optional
-from azure.identity import InteractiveBrowserCredential
+from connection_pool import ConnectionPool
+import metrics
 
 
 # --------------------------------------------------------------------------------
@@ -21,23 +22,73 @@ AZURE_SQL_SCOPE = "https://database.windows.net/.default"  # Required scope for
 # In-memory cache (avoids file I/O on every request)
 _token_cache = {
     'token': None,
-    'expires_at': None
+    'expires_at': None,
+    'version': 0  # Bumped every time a new token is obtained
 }
 
+# expires_at is the token's real expiry minus this many seconds
+TOKEN_EXPIRY_MARGIN = float(os.getenv('DC_TOKEN_EXPIRY_MARGIN', 60))
+
+# Background renewal - the token is replaced this many seconds before expires_at,
+# so request threads always find a valid token in memory. The credential's token
+# cache only hands out a new token in the last 5 minutes of the old one's life,
+# so TOKEN_EXPIRY_MARGIN + TOKEN_REFRESH_MARGIN must stay below 300 - earlier
+# attempts just get the same token back
+TOKEN_REFRESH_MARGIN = float(os.getenv('DC_TOKEN_REFRESH_MARGIN', 180))
+TOKEN_RETRY_DELAY = float(os.getenv('DC_TOKEN_RETRY_DELAY', 30))  # Seconds between failed attempts
+
+_token_lock = threading.Lock()  # Only one thread authenticates at a time
+_token_file_checked = False  # The file cache is read at most once per process
+_credential = None  # Reused so renewals are silent after the first browser login
+_refresher = None
+
+_token_stats = {
+    'refreshes': 0,
+    'failures': 0,
+    'rotations': 0,
+    'unchanged': 0,  # Refreshes that got the cached token back (no rotation)
+    'last_refresh': None,
+    'last_error': None,
+}
+
+# Pool settings - one connection per concurrent request thread
+POOL_MIN_SIZE = int(os.getenv('DC_POOL_MIN_SIZE', 1))
+POOL_MAX_SIZE = int(os.getenv('DC_POOL_MAX_SIZE', 10))
+POOL_MAX_IDLE = float(os.getenv('DC_POOL_MAX_IDLE', 300))  # Seconds
+
+# SQLite file made by database_connection_local.py - used instead of DC_DB_STRING
+# (and Entra ID) when set
+LOCAL_DB = os.getenv('DC_LOCAL_DB')
+
+_pool = None
+_pool_lock = threading.Lock()
+
 
 # --------------------------------------------------------------------------------
 # AUTHENTICATION
 # --------------------------------------------------------------------------------
 
+def _memory_token() -> Optional[str]:
+    """Token from the in-memory cache if it has not expired - no locking, no I/O"""
+    token, expires_at = _token_cache['token'], _token_cache['expires_at']
+    if token and expires_at and datetime.now() < expires_at:
+        return token
+    return None
+
+
 def get_cached_token() -> Optional[str]:
     """
     Retrieve cached token from memory or file
+    The file is only read the first time, later misses mean the token expired
     Returns None if no valid cached token exists
     """
+    global _token_file_checked
+
     # Check in-memory cache first
-    if _token_cache['token'] and _token_cache['expires_at']:
-        if datetime.now() < _token_cache['expires_at']:
-            return _token_cache['token']
+    token = _memory_token()
+    if token or _token_file_checked:
+        return token
+    _token_file_checked = True
 
     # Check file cache
     if os.path.exists(TOKEN_FILE):
@@ -50,6 +101,8 @@ def get_cached_token() -> Optional[str]:
                     # Update in-memory cache
                     _token_cache['token'] = data['token']
                     _token_cache['expires_at'] = expires_at
+                    _token_cache['version'] += 1
+                    print("Using cached authentication token")
                     return data['token']
         except Exception as e:
             print(f"Error reading token cache: {e}")
@@ -57,13 +110,7 @@ def get_cached_token() -> Optional[str]:
     return None
 
 
-def save_token_to_cache(token: str, expires_on: datetime):
-    """Save token to both memory and file cache"""
-    # Update in-memory cache
-    _token_cache['token'] = token
-    _token_cache['expires_at'] = expires_on
-
-    # Save to file
+def _write_token_file(token: str, expires_on: datetime):
     try:
         with open(TOKEN_FILE, 'w') as f:
             json.dump({
@@ -74,34 +121,188 @@ def save_token_to_cache(token: str, expires_on: datetime):
         print(f"Error saving token cache: {e}")
 
 
-def get_azure_sql_token() -> str:
+def save_token_to_cache(token: str, expires_on: datetime, background: bool = False):
     """
-    Get Azure SQL access token using Microsoft Entra ID (formerly Azure AD)
-    Uses cached token if available, otherwise authenticates interactively
+    Save token to both memory and file cache
+
+    Args:
+        background: Write the file from a separate thread (used on request threads)
     """
-    # Try to use cached token first
-    cached_token = get_cached_token()
-    if cached_token:
-        print("Using cached authentication token")
-        return cached_token
+    # Update in-memory cache
+    _token_cache['expires_at'] = expires_on
+    _token_cache['token'] = token
+    _token_cache['version'] += 1
+
+    # Save to file
+    if background:
+        threading.Thread(target=_write_token_file, args=(token, expires_on), daemon=True).start()
+    else:
+        _write_token_file(token, expires_on)
+
 
-    print("No valid cached token found. Starting interactive authentication...")
+def _acquire_token(background: bool = False) -> str:
+    """Request a new token from Entra ID and cache it - _token_lock held"""
+    global _credential
 
-    # Interactive browser authentication
-    credential = InteractiveBrowserCredential()
+    # Interactive browser authentication on first use; the credential keeps the
+    # refresh token, so later calls on the same instance renew silently
+    if _credential is None:
+        from azure.identity import InteractiveBrowserCredential
+        _credential = InteractiveBrowserCredential()
 
     # Get token for Azure SQL
-    token = credential.get_token(AZURE_SQL_SCOPE)
+    token = _credential.get_token(AZURE_SQL_SCOPE)
 
-    # Cache the token (subtract 5 minutes for safety margin)
-    expires_at = datetime.fromtimestamp(token.expires_on) - timedelta(minutes=5)
-    save_token_to_cache(token.token, expires_at)
+    # Cache the token (minus a safety margin)
+    expires_at = datetime.fromtimestamp(token.expires_on) - timedelta(seconds=TOKEN_EXPIRY_MARGIN)
+    if token.token == _token_cache['token'] and expires_at == _token_cache['expires_at']:
+        # The credential's cache returned the token we already hold
+        return token.token
+    save_token_to_cache(token.token, expires_at, background=background)
 
+    _token_stats['refreshes'] += 1
+    _token_stats['last_refresh'] = datetime.now().isoformat(timespec='seconds')
     print(f"Successfully authenticated. Token valid until {expires_at}")
 
     return token.token
 
 
+def get_azure_sql_token() -> str:
+    """
+    Get Azure SQL access token using Microsoft Entra ID (formerly Azure AD)
+    Uses cached token if available, otherwise authenticates interactively
+
+    Safe to call from many threads: a valid token is returned straight from
+    memory, and when a new one is needed only one thread authenticates while
+    the others wait for its result
+    """
+    token = _memory_token()
+    if token:
+        return token
+
+    with metrics.phase('token'), _token_lock:
+        # Another thread may have renewed the token while we waited
+        token = get_cached_token()
+        if token:
+            return token
+
+        print("No valid cached token found. Starting interactive authentication...")
+        return _acquire_token(background=True)
+
+
+def refresh_token() -> str:
+    """
+    Ask for a new token now, even if the current one is still valid, and retire
+    pooled connections that logged in with the old one
+
+    Connections are only rotated when the token actually changed
+    """
+    try:
+        with _token_lock:
+            version = _token_cache['version']
+            token = _acquire_token()
+            changed = _token_cache['version'] != version
+    except Exception as e:
+        _token_stats['failures'] += 1
+        _token_stats['last_error'] = str(e)
+        raise
+
+    if not changed:
+        _token_stats['unchanged'] += 1
+        return token
+
+    # Connections keep the token they were opened with - replace them gradually
+    # (idle ones now, borrowed ones when returned) so queries are not interrupted
+    pool = _pool
+    if pool is not None and not pool.closed:
+        try:
+            pool.rotate()
+            _token_stats['rotations'] += 1
+        except Exception as e:
+            print(f"Error rotating pooled connections: {e}")
+
+    return token
+
+
+def seconds_until_refresh(margin: float = TOKEN_REFRESH_MARGIN) -> float:
+    """Seconds until the current token is due for renewal (0 if there is none)"""
+    expires_at = _token_cache['expires_at']
+    if not _token_cache['token'] or expires_at is None:
+        return 0.0
+    return max((expires_at - datetime.now()).total_seconds() - margin, 0.0)
+
+
+class TokenRefresher(threading.Thread):
+    """
+    Daemon thread that renews the token before it expires
+
+    Keeps authentication (and the token file) off request threads: by the
+    time the token would run out, a new one is already in memory
+    """
+
+    def __init__(self, margin: float = TOKEN_REFRESH_MARGIN,
+                 retry_delay: float = TOKEN_RETRY_DELAY):
+        super().__init__(name='token-refresher', daemon=True)
+        self.margin = margin
+        self.retry_delay = retry_delay
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            delay = seconds_until_refresh(self.margin)
+            if delay > 0:
+                # Re-check after waking - the token may have been renewed meanwhile
+                if self._stopped.wait(delay):
+                    break
+                continue
+
+            try:
+                refresh_token()
+            except Exception as e:
+                print(f"Token refresh failed, retrying in {self.retry_delay:.0f}s: {e}")
+            else:
+                if seconds_until_refresh(self.margin) > 0:
+                    continue
+
+            # Failed, or the new token is already inside the margin
+            self._stopped.wait(self.retry_delay)
+
+    def stop(self):
+        self._stopped.set()
+
+
+def start_token_refresher() -> Optional[TokenRefresher]:
+    """Start the background refresher (once per process) - None with DC_LOCAL_DB, which needs no token"""
+    global _refresher
+    if LOCAL_DB:
+        return None
+    with _token_lock:
+        if _refresher is None or not _refresher.is_alive():
+            _refresher = TokenRefresher()
+            _refresher.start()
+        return _refresher
+
+
+def stop_token_refresher():
+    global _refresher
+    with _token_lock:
+        refresher, _refresher = _refresher, None
+    if refresher is not None:
+        refresher.stop()
+
+
+def token_stats() -> dict:
+    """Token expiry and refresh counters, for the health endpoint"""
+    expires_at = _token_cache['expires_at']
+    return {
+        **_token_stats,
+        'version': _token_cache['version'],
+        'expires_at': expires_at.isoformat(timespec='seconds') if expires_at else None,
+        'refresh_in': round(seconds_until_refresh(), 1) if expires_at else None,
+        'refresher_running': _refresher is not None and _refresher.is_alive(),
+    }
+
+
 # --------------------------------------------------------------------------------
 # DATABASE CONNECTION
 # --------------------------------------------------------------------------------
@@ -130,6 +331,8 @@ def connect_to_database():
     Returns:
         pyodbc.Connection: Active database connection
     """
+    import pyodbc
+
     # Get access token
     access_token = get_azure_sql_token()
 
@@ -153,6 +356,37 @@ def connect_to_database():
     return connection
 
 
+def get_pool() -> ConnectionPool:
+    """
+    Get the shared connection pool (created on first use)
+    Connections are opened lazily - call prefill() to open min_size up front
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.closed:
+            if LOCAL_DB:
+                from database_connection_local import get_connection as factory
+            else:
+                factory = connect_to_database
+            _pool = ConnectionPool(
+                factory,
+                min_size=POOL_MIN_SIZE,
+                max_size=POOL_MAX_SIZE,
+                max_idle=POOL_MAX_IDLE
+            )
+        return _pool
+
+
+def close_pool():
+    """Close the shared pool and all its idle connections"""
+    global _pool
+    stop_token_refresher()
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
 # --------------------------------------------------------------------------------
 # USAGE EXAMPLE
 # --------------------------------------------------------------------------------
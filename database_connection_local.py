@@ -0,0 +1,397 @@
+"""
+Local stand-in for the DClab database (SQLite, no network)
+Holds a Market_Data table with the same columns and speaks enough of the
+pymssql and pyodbc interfaces (%s or ? parameters, cursor(as_dict=True), rows
+with attribute access, SELECT TOP) for every StockPriceFetcher to run unchanged
+against it. The stock_prices table the Entra ID fetcher reads is a view over
+Market_Data
+
+Generate a database, then point any of the servers at it:
+
+    python database_connection_local.py market_data.db --tickers 1600 --years 10
+    DC_LOCAL_DB=market_data.db python api_server_pymssql.py
+
+Like on the real server, whole-market ROW_NUMBER() queries scan every row -
+with ten years of data a snapshot load takes seconds, single tickers milliseconds
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+
+
+# --------------------------------------------------------------------------------
+# SCHEMA
+# --------------------------------------------------------------------------------
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS Market_Data (
+    TICKER TEXT NOT NULL,
+    TRADE_DATE TEXT NOT NULL,  -- YYYY-MM-DD
+    EXCHANGE TEXT NOT NULL,    -- HSX / HASTC / UPCOM as stored in DClab
+    PX_OPEN REAL,
+    PX_HIGH REAL,
+    PX_LOW REAL,
+    PX_LAST REAL,
+    VOLUME INTEGER,
+    PRIMARY KEY (TICKER, TRADE_DATE)
+) WITHOUT ROWID
+"""
+
+INDEXES = (
+    "CREATE INDEX IF NOT EXISTS IX_Market_Data_TRADE_DATE ON Market_Data (TRADE_DATE)",
+)
+
+# The stock_prices table of the Entra ID database (get_stock_prices.py), derived
+# from Market_Data - created per connection, the database itself is read-only
+STOCK_PRICES_VIEW = """
+CREATE TEMP VIEW IF NOT EXISTS stock_prices AS
+SELECT
+    TICKER AS ticker,
+    TRADE_DATE AS trade_date,
+    PX_OPEN AS open_price,
+    PX_HIGH AS high_price,
+    PX_LOW AS low_price,
+    PX_LAST AS close_price,
+    VOLUME AS volume,
+    PX_LAST - PX_OPEN AS change_amount,
+    CASE WHEN PX_OPEN > 0 THEN (PX_LAST - PX_OPEN) / PX_OPEN * 100 ELSE 0 END AS change_percent,
+    CASE EXCHANGE WHEN 'HSX' THEN 'HOSE' WHEN 'HASTC' THEN 'HNX' ELSE EXCHANGE END AS market
+FROM Market_Data
+"""
+
+
+# --------------------------------------------------------------------------------
+# CONNECTION
+# --------------------------------------------------------------------------------
+
+# SELECT TOP (%s) / TOP (?) / TOP (n) / TOP n at the start of a statement
+_TOP_RE = re.compile(r'^\s*SELECT\s+TOP\s*(?:\(\s*(%s|\?|\d+)\s*\)|(\d+))', re.IGNORECASE)
+
+
+@lru_cache(maxsize=256)
+def translate(query: str):
+    """
+    Rewrite a pymssql or pyodbc (T-SQL) statement for SQLite
+
+    Returns:
+        (sql, top_param) - top_param is True when the first parameter was the
+        TOP count and has to be moved to the end for LIMIT ?
+    """
+    top_param = False
+    match = _TOP_RE.match(query)
+    if match:
+        count = match.group(1) or match.group(2)
+        top_param = count in ('%s', '?')
+        limit = '?' if top_param else count
+        query = 'SELECT' + query[match.end():].rstrip().rstrip(';') + f'\nLIMIT {limit}'
+    return query.replace('%s', '?'), top_param
+
+
+def _to_param(value):
+    """Dates as ISO strings, the way TRADE_DATE is stored"""
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+@lru_cache(maxsize=256)
+def _row_type(names: tuple):
+    """Tuple rows that also read by column name, like pyodbc.Row (MIN(...) and the like are renamed)"""
+    return namedtuple('Row', names, rename=True)
+
+
+class Cursor:
+    """
+    pymssql- and pyodbc-style cursor over a sqlite3 cursor; *DATE* columns come back as dates
+
+    Rows are dicts with as_dict=True, otherwise tuples whose columns can also be
+    read as attributes (row.ticker)
+    """
+
+    def __init__(self, cursor: sqlite3.Cursor, as_dict: bool = False):
+        self._cursor = cursor
+        self.as_dict = as_dict
+        self._names = []
+        self._dates = []
+        self._make_row = tuple
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def execute(self, query: str, params=()):
+        sql, top_param = translate(query)
+        params = [_to_param(p) for p in (params or ())]
+        if top_param:
+            params.append(params.pop(0))
+        self._cursor.execute(sql, params)
+
+        description = self._cursor.description or ()
+        self._names = [d[0] for d in description]
+        self._dates = [i for i, name in enumerate(self._names) if 'DATE' in name.upper()]
+        self._make_row = _row_type(tuple(self._names))._make if self._names else tuple
+        return self
+
+    def _convert(self, row):
+        if self._dates:
+            row = list(row)
+            for i in self._dates:
+                if isinstance(row[i], str):
+                    row[i] = date.fromisoformat(row[i][:10])
+        if self.as_dict:
+            return dict(zip(self._names, row))
+        return self._make_row(row)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return None if row is None else self._convert(row)
+
+    def fetchmany(self, size: int = 1):
+        return [self._convert(row) for row in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._convert(row) for row in self._cursor.fetchall()]
+
+    def __iter__(self):
+        return map(self._convert, self._cursor)
+
+    def close(self):
+        self._cursor.close()
+
+
+class Connection:
+    """pymssql- and pyodbc-style connection to a local SQLite database"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+
+    def cursor(self, as_dict: bool = False) -> Cursor:
+        return Cursor(self._conn.cursor(), as_dict=as_dict)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+
+def get_connection(path: Optional[str] = None) -> Connection:
+    """
+    Open the local database read-only (DC_LOCAL_DB when path is not given)
+    Connections may be handed between threads, one thread at a time, as the pool does
+    """
+    path = path or os.getenv('DC_LOCAL_DB')
+    if not path:
+        raise ValueError("DC_LOCAL_DB environment variable not set")
+    if not Path(path).exists():
+        raise FileNotFoundError(f"Local database {path} not found - create it with "
+                                f"python database_connection_local.py {path}")
+
+    conn = sqlite3.connect(Path(path).resolve().as_uri() + '?mode=ro', uri=True,
+                           check_same_thread=False)
+    conn.execute("PRAGMA mmap_size = 1073741824")
+    conn.execute(STOCK_PRICES_VIEW)
+    return Connection(conn)
+
+
+# --------------------------------------------------------------------------------
+# DATA GENERATOR
+# --------------------------------------------------------------------------------
+
+# Share of listings, median price (thousand VND), daily volatility, price band
+# and median daily volume per exchange - roughly the shape of the real market
+EXCHANGES = {
+    'HSX': {'share': 0.25, 'price': 25.0, 'vol': 0.020, 'band': 0.07, 'volume': 1_000_000},
+    'HASTC': {'share': 0.20, 'price': 15.0, 'vol': 0.025, 'band': 0.10, 'volume': 200_000},
+    'UPCOM': {'share': 0.55, 'price': 10.0, 'vol': 0.035, 'band': 0.15, 'volume': 30_000},
+}
+
+# Well-known tickers kept at the front of the universe so examples and
+# warm-up lists resolve (the rest are random three-letter codes)
+KNOWN_TICKERS = {
+    'HSX': ['VNM', 'VCB', 'HPG', 'FPT', 'VIC', 'VHM', 'MWG', 'MSN', 'SSI', 'TCB',
+            'VPB', 'MBB', 'ACB', 'BID', 'CTG', 'GAS', 'PLX', 'SAB', 'VRE', 'POW',
+            'HDB', 'STB', 'VJC', 'GVR', 'BCM', 'PNJ', 'REE', 'DGC', 'KDH', 'NVL'],
+    'HASTC': ['SHS', 'PVS', 'IDC', 'CEO', 'MBS', 'VCS', 'NVB', 'PVI', 'DTD', 'TNG'],
+    'UPCOM': ['ACV', 'BSR', 'VEA', 'QNS', 'MCH', 'OIL', 'VGI', 'LTG', 'FOX', 'ABB'],
+}
+
+# Daily pull of the log price back to its level (half-life of about 140 sessions)
+MEAN_REVERSION = 0.005
+
+# Fixed-date market holidays (New Year, Reunification Day, Labour Day, National Day)
+HOLIDAYS = {(1, 1), (4, 30), (5, 1), (9, 2)}
+
+
+def trading_days(start: date, end: date) -> np.ndarray:
+    """Weekdays from start to end, less the fixed-date holidays"""
+    days = np.arange(np.datetime64(start, 'D'), np.datetime64(end, 'D') + 1)
+    days = days[np.is_busday(days)]
+    return np.array([d for d in days.tolist() if (d.month, d.day) not in HOLIDAYS],
+                    dtype='datetime64[D]')
+
+
+def tick_round(prices: np.ndarray, exchange: str) -> np.ndarray:
+    """Round to the exchange tick size (HOSE steps up with the price level)"""
+    if exchange == 'HSX':
+        tick = np.where(prices < 10, 0.01, np.where(prices < 50, 0.05, 0.1))
+    else:
+        tick = 0.1
+    return np.maximum(np.round(prices / tick) * tick, tick).round(2)
+
+
+def make_universe(count: int, rng: np.random.Generator) -> Dict[str, str]:
+    """{ticker: exchange} for count listings"""
+    universe = {}
+    for exchange, tickers in KNOWN_TICKERS.items():
+        for ticker in tickers[:count]:
+            universe[ticker] = exchange
+
+    names = list(EXCHANGES)
+    shares = np.array([EXCHANGES[e]['share'] for e in names])
+    while len(universe) < count:
+        ticker = ''.join(rng.choice(list('ABCDEFGHIJKLMNOPQRSTUVWXYZ'), 3))
+        if ticker not in universe:
+            universe[ticker] = names[rng.choice(len(names), p=shares)]
+    return dict(list(universe.items())[:count])
+
+
+def simulate(days: np.ndarray, exchange: str, rng: np.random.Generator) -> Dict[str, np.ndarray]:
+    """
+    Daily OHLCV bars for one ticker
+
+    Closes follow a mean-reverting random walk clipped to the daily price band; opens gap
+    from the previous close; some days trade nothing (common on UPCOM)
+    """
+    params = EXCHANGES[exchange]
+    n = len(days)
+    vol = params['vol'] * rng.uniform(0.6, 1.5)
+    band = params['band']
+
+    # Log price mean-reverts slowly towards the ticker's own level, so ten
+    # years of random walk do not drift to absurd prices
+    level = np.log(params['price'] * rng.lognormal(0, 0.8))
+    shocks = rng.normal(0.0002, vol, n)
+    lower, upper = np.log1p(-band), np.log1p(band)
+    log_close = np.empty(n)
+    x = level
+    for i in range(n):
+        x += min(max(shocks[i] - MEAN_REVERSION * (x - level), lower), upper)
+        log_close[i] = x
+    close = np.exp(log_close)
+    prev = np.concatenate(([close[0]], close[:-1]))
+    open_ = prev * (1 + np.clip(rng.normal(0, vol / 3, n), -band, band))
+    wick = np.abs(rng.normal(0, vol / 2, (2, n)))
+    high = np.minimum(np.maximum(open_, close) * (1 + wick[0]), prev * (1 + band))
+    low = np.maximum(np.minimum(open_, close) * (1 - wick[1]), prev * (1 - band))
+
+    volume = params['volume'] * rng.lognormal(0, 1) * rng.lognormal(0, 0.6, n)
+    volume = (volume // 100 * 100).astype(np.int64)
+    idle = rng.random(n) < (0.1 if exchange == 'UPCOM' else 0.01)
+    volume[idle] = 0
+
+    close, open_, high, low = (tick_round(p, exchange) for p in (close, open_, high, low))
+    # A day without trades repeats the previous close
+    flat = np.concatenate(([close[0]], close[:-1]))[idle]
+    close[idle] = open_[idle] = high[idle] = low[idle] = flat
+    high = np.maximum.reduce([high, open_, close])
+    low = np.minimum.reduce([low, open_, close])
+
+    return {'open': open_, 'high': high, 'low': low, 'close': close, 'volume': volume}
+
+
+def generate(path: str, tickers: int = 1600, years: int = 10, seed: int = 7,
+             end: Optional[date] = None) -> Dict:
+    """
+    Create (or replace) a local Market_Data database with synthetic bars
+
+    Args:
+        path: SQLite file to write
+        tickers: Listings in the universe
+        years: Years of daily history up to end
+        seed: Random seed - the same arguments give the same data
+        end: Last trading day (default today)
+
+    Returns:
+        Row, ticker and timing counts
+    """
+    started = time.monotonic()
+    rng = np.random.default_rng(seed)
+    end = end or date.today()
+    days = trading_days(end - timedelta(days=round(365.25 * years)), end)
+    universe = make_universe(tickers, rng)
+
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute(SCHEMA)
+
+    rows = 0
+    date_text = np.datetime_as_string(days, unit='D')
+    for ticker, exchange in universe.items():
+        # About one listing in six starts trading part way through the range
+        first = int(rng.integers(0, len(days) - 20)) if rng.random() < 0.15 else 0
+        bars = simulate(days[first:], exchange, rng)
+        conn.executemany(
+            "INSERT INTO Market_Data (TICKER, TRADE_DATE, EXCHANGE, PX_OPEN, PX_HIGH, "
+            "PX_LOW, PX_LAST, VOLUME) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            zip([ticker] * (len(days) - first), date_text[first:].tolist(), [exchange] * (len(days) - first),
+                bars['open'].tolist(), bars['high'].tolist(), bars['low'].tolist(),
+                bars['close'].tolist(), bars['volume'].tolist())
+        )
+        rows += len(days) - first
+
+    for statement in INDEXES:
+        conn.execute(statement)
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+
+    return {
+        'path': path,
+        'tickers': len(universe),
+        'trading_days': len(days),
+        'rows': rows,
+        'first_date': str(days[0]),
+        'last_date': str(days[-1]),
+        'seconds': round(time.monotonic() - started, 2),
+    }
+
+
+# --------------------------------------------------------------------------------
+# MAIN
+# --------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a local Market_Data database")
+    parser.add_argument('path', nargs='?', default=os.getenv('DC_LOCAL_DB', 'market_data.db'))
+    parser.add_argument('--tickers', type=int, default=1600)
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"Generating {args.tickers} tickers x {args.years} years into {args.path}...")
+    result = generate(args.path, tickers=args.tickers, years=args.years, seed=args.seed)
+    print(f"✅ {result['rows']:,} rows, {result['first_date']} to {result['last_date']} "
+          f"({result['seconds']}s)")
@@ -5,7 +5,21 @@ Simpler for cloud deployments like Railway
 
 import pymssql
 import os
+import threading
 from pathlib import Path
+from connection_pool import ConnectionPool
+
+
+# Pool settings (override with environment variables on Railway)
+POOL_MIN_SIZE = int(os.getenv('DC_POOL_MIN_SIZE', 1))
+POOL_MAX_SIZE = int(os.getenv('DC_POOL_MAX_SIZE', 10))
+POOL_MAX_IDLE = float(os.getenv('DC_POOL_MAX_IDLE', 300))  # Seconds
+
+# SQLite file made by database_connection_local.py - used instead of DC_DB_STRING when set
+LOCAL_DB = os.getenv('DC_LOCAL_DB')
+
+_pool = None
+_pool_lock = threading.Lock()
 
 
 def get_connection():
@@ -55,6 +69,36 @@ def get_connection():
     return conn
 
 
+def get_pool() -> ConnectionPool:
+    """
+    Get the shared connection pool (created on first use)
+    Connections are opened lazily - call prefill() to open min_size up front
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.closed:
+            if LOCAL_DB:
+                from database_connection_local import get_connection as factory
+            else:
+                factory = get_connection
+            _pool = ConnectionPool(
+                factory,
+                min_size=POOL_MIN_SIZE,
+                max_size=POOL_MAX_SIZE,
+                max_idle=POOL_MAX_IDLE
+            )
+        return _pool
+
+
+def close_pool():
+    """Close the shared pool and all its idle connections"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
 def test_connection():
     """Test database connection"""
     try:
@@ -0,0 +1,288 @@
+"""
+On-demand profiling for a running server (GET /api/debug/profile, /api/debug/memory)
+The profiler samples the stack of every thread at a fixed interval and returns
+collapsed stacks ("thread;outer;inner count" lines) that flamegraph.pl,
+speedscope or inferno render directly. The memory report lists tracemalloc's top
+allocators and the size of each in-process cache.
+
+Both endpoints are off unless DEBUG_TOKEN is set, and then need the token in an
+X-Debug-Token (or Authorization: Bearer) header
+"""
+
+import gc
+import hmac
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Callable, Dict, Mapping, Optional, Tuple
+
+
+# Shared secret for the debug endpoints - unset disables them (404)
+DEBUG_TOKEN = os.getenv('DEBUG_TOKEN')
+
+# Milliseconds between stack samples, and the longest allowed profile
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', 10))
+PROFILE_MAX_SECONDS = int(os.getenv('PROFILE_MAX_SECONDS', 60))
+
+# TRACEMALLOC=1 traces allocations from startup; otherwise the first
+# /api/debug/memory call starts tracing. Frames kept per allocation:
+TRACEMALLOC_FRAMES = int(os.getenv('TRACEMALLOC_FRAMES', 1))
+
+if os.getenv('TRACEMALLOC', '0').lower() in ('1', 'true', 'yes'):
+    tracemalloc.start(TRACEMALLOC_FRAMES)
+
+
+# --------------------------------------------------------------------------------
+# ACCESS
+# --------------------------------------------------------------------------------
+
+def check_access(headers: Mapping[str, str]) -> Optional[Tuple[int, str]]:
+    """
+    Authorize a debug request
+
+    Returns:
+        None if allowed, else (status, message) - 404 while DEBUG_TOKEN is unset
+        so the endpoints are not advertised, 403 for a missing or wrong token
+    """
+    if not DEBUG_TOKEN:
+        return 404, 'Not found'
+
+    token = headers.get('X-Debug-Token')
+    if token is None:
+        auth = headers.get('Authorization', '')
+        token = auth[7:] if auth.startswith('Bearer ') else ''
+    if not hmac.compare_digest(token.encode(), DEBUG_TOKEN.encode()):
+        return 403, 'Invalid debug token'
+    return None
+
+
+def parse_seconds(value: Optional[str], default: float = 10) -> float:
+    """?seconds= for the profiler, clamped to (0, PROFILE_MAX_SECONDS] (ValueError if not a number)"""
+    seconds = default if value in (None, '') else float(value)
+    if seconds <= 0:
+        raise ValueError('seconds must be positive')
+    return min(seconds, PROFILE_MAX_SECONDS)
+
+
+# --------------------------------------------------------------------------------
+# SAMPLING PROFILER
+# --------------------------------------------------------------------------------
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another one is running"""
+
+
+class SamplingProfiler:
+    """
+    Wall-clock sampler over all threads, using sys._current_frames()
+
+    Nothing is installed in the profiled threads - the sampling thread walks
+    their frames, so the cost is one stack walk per thread per interval while a
+    profile runs and nothing otherwise. Waiting threads (idle pool workers, the
+    accept loop) are sampled too: a wall-clock profile shows where requests wait
+    as well as where they compute
+    """
+
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self._lock = threading.Lock()  # One profile at a time
+        self._labels = {}  # code object -> frame label
+
+    def profile(self, seconds: float) -> Tuple[str, Dict]:
+        """
+        Sample every thread for `seconds`
+
+        Returns:
+            (collapsed stacks text, summary with samples, interval and duration)
+
+        Raises:
+            ProfilerBusy: Another profile is in progress
+        """
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy('A profile is already running')
+        try:
+            stacks, samples, elapsed = self._sample(seconds)
+        finally:
+            self._lock.release()
+
+        lines = [f'{stack} {count}' for stack, count in stacks.most_common()]
+        summary = {
+            'samples': samples,
+            'interval_ms': self.interval * 1000,
+            'seconds': round(elapsed, 3),
+            'stacks': len(stacks),
+        }
+        return '\n'.join(lines) + '\n', summary
+
+    def _sample(self, seconds: float):
+        me = threading.get_ident()
+        stacks = Counter()
+        names = {}
+        samples = 0
+        start = time.monotonic()
+        next_sample = start
+        deadline = start + seconds
+
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if samples % 100 == 0:
+                names = {t.ident: _thread_label(t.name) for t in threading.enumerate()}
+
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, 'thread'))
+                stacks[';'.join(reversed(stack))] += 1
+            samples += 1
+
+            # Fixed schedule - a slow walk shortens the next sleep instead of drifting
+            next_sample += self.interval
+            delay = next_sample - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_sample = time.monotonic()
+
+        return stacks, samples, time.monotonic() - start
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+            label = self._labels[code] = label.replace(';', ':')
+        return label
+
+
+def _thread_label(name: str) -> str:
+    # Numbered workers (db_3, Thread-12 (process_request_thread)) share one root
+    return re.sub(r'[-_]\d+', '', name).replace(';', ':')
+
+
+profiler = SamplingProfiler()
+
+
+# --------------------------------------------------------------------------------
+# MEMORY
+# --------------------------------------------------------------------------------
+
+_last_snapshot = None  # Previous tracemalloc snapshot, for growth between calls
+
+# tracemalloc's own bookkeeping and the import machinery are noise here
+_TRACE_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+
+def memory_report(top: int = 20, group: str = 'lineno', stop: bool = False,
+                  caches: Optional[Callable[[], Dict]] = None) -> Dict:
+    """
+    Top allocators by traced size, growth since the previous call, and cache sizes
+
+    Args:
+        top: Allocation sites to list
+        group: 'lineno', 'filename' or 'traceback' (needs TRACEMALLOC_FRAMES > 1)
+        stop: Stop tracing afterwards (tracemalloc slows allocation while on)
+        caches: Returns the server's cache sizes (see cache_sizes)
+    """
+    global _last_snapshot
+
+    if group not in ('lineno', 'filename', 'traceback'):
+        raise ValueError("group must be 'lineno', 'filename' or 'traceback'")
+
+    report = {
+        'rss_mb': _rss_mb(),
+        'gc_counts': gc.get_count(),
+        'threads': threading.active_count(),
+    }
+    if caches is not None:
+        try:
+            report['caches'] = caches()
+        except Exception as e:
+            report['caches'] = {'error': str(e)}
+
+    if not tracemalloc.is_tracing():
+        if stop:
+            report['tracemalloc'] = {'state': 'stopped'}
+            return report
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        _last_snapshot = None
+        report['tracemalloc'] = {
+            'state': 'started',
+            'note': 'Allocations are traced from now on - call again for the top allocators',
+        }
+        return report
+
+    snapshot = tracemalloc.take_snapshot().filter_traces(_TRACE_FILTERS)
+    current, peak = tracemalloc.get_traced_memory()
+    report['tracemalloc'] = {
+        'state': 'tracing',
+        'frames': tracemalloc.get_traceback_limit(),
+        'traced_mb': round(current / 1e6, 3),
+        'peak_mb': round(peak / 1e6, 3),
+        'overhead_mb': round(tracemalloc.get_tracemalloc_memory() / 1e6, 3),
+    }
+    report['top'] = [
+        {'location': _location(stat.traceback), 'size_kb': round(stat.size / 1024, 1),
+         'count': stat.count}
+        for stat in snapshot.statistics(group)[:top]
+    ]
+    if _last_snapshot is not None:
+        report['growth'] = [
+            {'location': _location(stat.traceback), 'size_diff_kb': round(stat.size_diff / 1024, 1),
+             'count_diff': stat.count_diff}
+            for stat in snapshot.compare_to(_last_snapshot, group)[:top]
+            if stat.size_diff
+        ]
+
+    if stop:
+        tracemalloc.stop()
+        _last_snapshot = None
+        report['tracemalloc']['state'] = 'stopped'
+    else:
+        _last_snapshot = snapshot
+    return report
+
+
+def cache_sizes(fetcher, snapshot=None) -> Dict:
+    """Entries (and bytes where cheap to measure) of a fetcher's caches and the snapshot"""
+    quote = fetcher.cache.stats()
+    sizes = {'quote': {'entries': quote['size'], 'max_size': quote['max_size']}}
+
+    history = fetcher.history_cache.stats()
+    if 'bars' in history:  # HistoryCache (pandas fetchers)
+        sizes['history'] = {key: history[key] for key in ('tickers', 'segments', 'bars', 'max_bars')}
+        sizes['history']['bytes'] = fetcher.history_cache.nbytes()
+        sizes['history_recent'] = {'entries': history['recent']['size']}
+    else:  # QuoteCache of history lists
+        sizes['history'] = {'entries': history['size'], 'max_size': history['max_size']}
+
+    if snapshot is not None:
+        sizes['snapshot'] = {'symbols': len(snapshot.columns), 'bytes': snapshot.columns.nbytes()}
+    return sizes
+
+
+def _location(traceback) -> str:
+    return ' <- '.join(f'{frame.filename}:{frame.lineno}' for frame in reversed(traceback))
+
+
+def _rss_mb() -> Optional[float]:
+    """Resident set size of this process (Linux), None elsewhere"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf('SC_PAGE_SIZE') / 1e6, 1)
+    except (OSError, ValueError, IndexError):
+        return None
@@ -0,0 +1,129 @@
+"""
+Fast JSON encoding for market and history responses
+Goes from column arrays (or a DataFrame) straight to JSON text: every column is
+encoded once in bulk, dates are formatted with one vectorized call, and rows are
+assembled from a per-row template - no per-row dicts and no strftime loop
+"""
+
+import json
+from json.encoder import encode_basestring_ascii
+from datetime import date
+from decimal import Decimal
+from typing import List, Mapping, Optional
+
+import numpy as np
+import pandas as pd
+
+from metrics import phased
+
+
+def _default(value):
+    """Fallback for values the json module cannot encode (matches Flask for Decimal)"""
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+@phased('jsonify')
+def dumps(value) -> str:
+    """json.dumps with the same fallbacks as the column encoder"""
+    return json.dumps(value, default=_default, separators=(',', ':'))
+
+
+def encode_column(values) -> List[str]:
+    """
+    JSON text for every value of one column
+
+    Args:
+        values: NumPy array, pandas Series or list
+
+    Returns:
+        One JSON fragment per value (NaN, infinity and NaT become null)
+    """
+    array = np.asarray(values)
+    kind = array.dtype.kind
+
+    if kind == 'M':
+        # One vectorized call formats every date
+        text = np.datetime_as_string(array, unit='D').tolist()
+        missing = np.isnat(array)
+        out = ['"' + s + '"' for s in text]
+    elif kind == 'f':
+        out = list(map(repr, array.tolist()))
+        missing = ~np.isfinite(array)
+    elif kind in 'iu':
+        return list(map(repr, array.tolist()))
+    elif kind == 'b':
+        return ['true' if v else 'false' for v in array.tolist()]
+    else:
+        values = array.tolist()
+        if all(type(v) is str for v in values):
+            return list(map(encode_basestring_ascii, values))
+        return [dumps(v) for v in values]
+
+    for i in np.flatnonzero(missing).tolist():
+        out[i] = 'null'
+    return out
+
+
+@phased('jsonify')
+def encode_columns(columns: Mapping[str, object],
+                   fields: Optional[Mapping[str, str]] = None) -> str:
+    """
+    JSON array of row objects built directly from columns
+
+    Args:
+        columns: {column name: values}, all the same length
+        fields: {output key: column name} in output order (default: every column
+            under its own name). A column used by several keys is encoded once.
+
+    Returns:
+        JSON text of the list of rows
+    """
+    if fields is None:
+        fields = {name: name for name in columns}
+
+    encoded = {}
+    for source in fields.values():
+        if source not in encoded:
+            encoded[source] = encode_column(columns[source])
+
+    template = '{' + ','.join(json.dumps(key).replace('%', '%%') + ':%s' for key in fields) + '}'
+    rows = zip(*(encoded[source] for source in fields.values()))
+    return '[' + ','.join(map(template.__mod__, rows)) + ']'
+
+
+def encode_frame(frame, date_columns=('trade_date',)) -> str:
+    """
+    JSON array of row objects for a DataFrame
+
+    Datetime columns, and the named date_columns whatever their dtype,
+    are written as YYYY-MM-DD
+    """
+    if frame.empty:
+        return '[]'
+
+    columns = {}
+    for name in frame.columns:
+        values = frame[name]
+        if name in date_columns and values.dtype.kind != 'M':
+            values = pd.to_datetime(values)
+        columns[name] = values.to_numpy()
+    return encode_columns(columns)
+
+
+@phased('jsonify')
+def envelope(data: str, **fields) -> bytes:
+    """
+    Response body {"success": true, ...fields, "data": <data>}
+
+    Args:
+        data: Already encoded JSON text (from encode_columns / encode_frame / dumps)
+        fields: Other top-level keys such as count and source
+    """
+    head = dumps({'success': True, **fields})
+    return (head[:-1] + ',"data":' + data + '}').encode()
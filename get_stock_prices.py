@@ -3,24 +3,96 @@ Get Vietnamese Stock Prices from DClab Database
 Uses the database connection to fetch real stock market data
 """
 
-from database_connection import connect_to_database
-from typing import List, Dict, Optional
+from database_connection import get_pool, close_pool
+from quote_cache import QuoteCache, Revalidator
+from single_flight import SingleFlight
+from micro_batch import MicroBatcher
+from history_cache import HistoryCache
+from history_pages import DEFAULT_PAGE_SIZE
+import metrics
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
 from datetime import datetime, timedelta
+import os
 import pandas as pd
 
 
+# Tickers per batched statement (SQL Server allows at most 2100 parameters)
+BATCH_SIZE = 500
+
+# Seconds a market summary is reused - each load scans the whole market
+MARKET_CACHE_TTL = float(os.getenv('MARKET_CACHE_TTL', 30))
+
+# Rows pulled per cursor.fetchmany() when streaming history
+STREAM_BATCH_SIZE = 500
+
+# Daily bars for one ticker between two dates, oldest first
+HISTORY_QUERY = """
+SELECT
+    ticker,
+    trade_date,
+    open_price,
+    high_price,
+    low_price,
+    close_price,
+    volume,
+    change_amount,
+    change_percent
+FROM stock_prices
+WHERE ticker = ?
+    AND trade_date >= ?
+    AND trade_date <= ?
+ORDER BY trade_date ASC
+"""
+
+# One keyset page of bars, oldest first - {op} is >= on the first page, > after a cursor
+HISTORY_PAGE_QUERY = """
+SELECT TOP (?)
+    ticker,
+    trade_date,
+    open_price,
+    high_price,
+    low_price,
+    close_price,
+    volume,
+    change_amount,
+    change_percent
+FROM stock_prices
+WHERE ticker = ?
+    AND trade_date {op} ?
+    AND trade_date <= ?
+ORDER BY trade_date ASC
+"""
+
+
 class StockPriceFetcher:
     """Fetch stock prices from DClab database"""
 
-    def __init__(self):
-        """Initialize with database connection"""
-        self.conn = None
+    def __init__(self, cache_size: Optional[int] = None, cache_ttl: Optional[float] = None):
+        """
+        Initialize - each call borrows its own connection from the shared pool
+
+        Args:
+            cache_size: Max quotes kept in the cache (default QUOTE_CACHE_SIZE)
+            cache_ttl: Seconds a cached quote stays valid (default QUOTE_CACHE_TTL)
+        """
+        self.cache = QuoteCache(max_size=cache_size, ttl=cache_ttl)
+        self.revalidator = Revalidator()  # Background refresh of stale cache entries
+        self.flight = SingleFlight()  # Identical concurrent queries run once
+        self.batcher = MicroBatcher(self._fetch_multiple_prices)  # Single quotes share IN queries
+        self.history_cache = HistoryCache(revalidator=self.revalidator)
+        self.market_cache = QuoteCache(max_size=8, ttl=MARKET_CACHE_TTL, stale=0)  # Summary frame per market
+
+    @contextmanager
+    def connection(self, operation: str = 'query'):
+        """
+        Borrow a pooled connection for a with-block (dead ones are replaced)
 
-    def connect(self):
-        """Connect to database"""
-        if not self.conn:
-            self.conn = connect_to_database()
-        return self.conn
+        Args:
+            operation: Fetcher method the queries are recorded under in /metrics
+        """
+        with get_pool().connection() as conn:
+            yield metrics.instrument(conn, operation)
 
     def get_latest_price(self, symbol: str) -> Optional[Dict]:
         """
@@ -32,9 +104,44 @@ class StockPriceFetcher:
         Returns:
             Dictionary with price information or None
         """
-        conn = self.connect()
-        cursor = conn.cursor()
+        return self.get_latest_price_status(symbol)[0]
 
+    def get_latest_price_status(self, symbol: str) -> Tuple[Optional[Dict], bool]:
+        """
+        Get the latest price and whether it was served stale
+
+        An expired cache entry still within QUOTE_CACHE_STALE is returned at once
+        while a background thread refreshes it, so callers never wait on expiry.
+
+        Args:
+            symbol: Stock ticker (e.g., 'VNM', 'VIC')
+
+        Returns:
+            (price dictionary or None, stale)
+        """
+        key = symbol.upper()
+        cached, stale = self.cache.get_stale(key)
+        if cached is not None:
+            if stale:
+                self.revalidator.submit(('latest', key), self.flight.do, ('latest', key), self._fetch_and_cache, key)
+            return cached, stale
+
+        # Concurrent misses for the same symbol share one query
+        return self.flight.do(('latest', key), self._fetch_and_cache, key), False
+
+    def _fetch_and_cache(self, key: str) -> Optional[Dict]:
+        """Query one quote and cache it - runs once per burst of identical calls"""
+        if self.batcher.enabled:
+            # Joins other symbols requested within the batching window
+            price = self.batcher.load(key)
+        else:
+            price = self._fetch_latest_price(key)
+        if price is not None:
+            self.cache.set(key, price)
+        return price
+
+    def _fetch_latest_price(self, symbol: str) -> Optional[Dict]:
+        """Query the latest price for one symbol, bypassing the cache"""
         # Query for latest price - adjust table/column names based on actual schema
         query = """
         SELECT TOP 1
@@ -53,29 +160,37 @@ class StockPriceFetcher:
         """
 
         try:
-            cursor.execute(query, (symbol.upper(),))
-            row = cursor.fetchone()
+            with self.connection('latest_price') as conn:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute(query, (symbol.upper(),))
+                    row = cursor.fetchone()
+                finally:
+                    cursor.close()
 
             if row:
-                return {
-                    'symbol': row.ticker,
-                    'price': row.close_price,
-                    'open': row.open_price,
-                    'high': row.high_price,
-                    'low': row.low_price,
-                    'volume': row.volume,
-                    'date': row.trade_date.strftime('%Y-%m-%d') if row.trade_date else None,
-                    'change': row.change_amount,
-                    'pct_change': row.change_percent
-                }
+                with metrics.phase('convert'):
+                    return self._format_price(row)
 
             return None
 
         except Exception as e:
             print(f"Error fetching {symbol}: {e}")
             return None
-        finally:
-            cursor.close()
+
+    def _format_price(self, row) -> Dict:
+        """Convert a stock_prices row into the quote dictionary"""
+        return {
+            'symbol': row.ticker,
+            'price': row.close_price,
+            'open': row.open_price,
+            'high': row.high_price,
+            'low': row.low_price,
+            'volume': row.volume,
+            'date': row.trade_date.strftime('%Y-%m-%d') if row.trade_date else None,
+            'change': row.change_amount,
+            'pct_change': row.change_percent
+        }
 
     def get_multiple_prices(self, symbols: List[str]) -> Dict[str, Optional[Dict]]:
         """
@@ -85,16 +200,91 @@ class StockPriceFetcher:
             symbols: List of stock tickers
 
         Returns:
-            Dictionary mapping symbols to price data
+            Dictionary mapping symbols to price data (None if not found)
         """
         results = {}
+        missing = []
         for symbol in symbols:
-            results[symbol] = self.get_latest_price(symbol)
+            results[symbol] = self.cache.get(symbol.upper())
+            if results[symbol] is None:
+                missing.append(symbol)
+
+        if missing:
+            fetched = self.flight.do(('multiple', tuple(missing)), self._fetch_multiple_prices, missing)
+            for symbol, price in fetched.items():
+                results[symbol] = price
+                if price is not None:
+                    self.cache.set(symbol.upper(), price)
+        return results
+
+    def _fetch_multiple_prices(self, symbols: List[str]) -> Dict[str, Optional[Dict]]:
+        """Query latest prices for several symbols, bypassing the cache"""
+        results = {symbol: None for symbol in symbols}
+        tickers = sorted({symbol.upper() for symbol in symbols})
+        if not tickers:
+            return results
+
+        # Latest row per ticker, one statement per BATCH_SIZE tickers
+        query = """
+        SELECT
+            ticker,
+            close_price,
+            open_price,
+            high_price,
+            low_price,
+            volume,
+            trade_date,
+            change_amount,
+            change_percent
+        FROM (
+            SELECT
+                ticker,
+                close_price,
+                open_price,
+                high_price,
+                low_price,
+                volume,
+                trade_date,
+                change_amount,
+                change_percent,
+                ROW_NUMBER() OVER (PARTITION BY ticker ORDER BY trade_date DESC) as rn
+            FROM stock_prices
+            WHERE ticker IN ({placeholders})
+        ) t
+        WHERE rn = 1
+        """
+
+        rows = {}
+        try:
+            with self.connection('multiple_prices') as conn:
+                cursor = conn.cursor()
+                try:
+                    for i in range(0, len(tickers), BATCH_SIZE):
+                        batch = tickers[i:i + BATCH_SIZE]
+                        placeholders = ', '.join(['?'] * len(batch))
+                        cursor.execute(query.format(placeholders=placeholders), batch)
+                        for row in cursor.fetchall():
+                            rows[row.ticker.upper()] = row
+                finally:
+                    cursor.close()
+        except Exception as e:
+            print(f"Error fetching prices for {len(tickers)} symbols: {e}")
+            return results
+
+        with metrics.phase('convert'):
+            for symbol in symbols:
+                row = rows.get(symbol.upper())
+                if row:
+                    try:
+                        results[symbol] = self._format_price(row)
+                    except Exception as e:
+                        print(f"Error fetching {symbol}: {e}")
         return results
 
     def get_price_history(self, symbol: str, days: int = 30) -> pd.DataFrame:
         """
         Get historical prices for a stock
+        Date ranges already held by the history cache are not queried again
 
         Args:
             symbol: Stock ticker
@@ -103,42 +293,128 @@ class StockPriceFetcher:
         Returns:
             Pandas DataFrame with price history
         """
-        conn = self.connect()
-
         # Calculate date range
         end_date = datetime.now()
         start_date = end_date - timedelta(days=days)
 
-        query = """
-        SELECT
-            ticker,
-            trade_date,
-            open_price,
-            high_price,
-            low_price,
-            close_price,
-            volume,
-            change_amount,
-            change_percent
-        FROM stock_prices
-        WHERE ticker = ?
-            AND trade_date >= ?
-            AND trade_date <= ?
-        ORDER BY trade_date ASC
-        """
-
         try:
-            df = pd.read_sql(
-                query,
-                conn,
-                params=(symbol.upper(), start_date, end_date)
+            return self.history_cache.get_range(
+                symbol.upper(), start_date.date(), end_date.date(), self._coalesced_loader(self._query_history)
             )
-            return df
 
         except Exception as e:
             print(f"Error fetching history for {symbol}: {e}")
             return pd.DataFrame()
 
+    def get_price_history_status(self, symbol: str, days: int = 30) -> Tuple[pd.DataFrame, bool]:
+        """
+        get_price_history plus whether today's bars were served stale
+
+        Returns:
+            (history DataFrame, stale)
+        """
+        history = self.get_price_history(symbol, days)
+        return history, bool(history.attrs.get('stale', False))
+
+    def _coalesced_loader(self, loader):
+        """Wrap a history loader so identical concurrent range loads run once"""
+        def load(ticker, start_date, end_date):
+            key = ('history', ticker, start_date, end_date)
+            return self.flight.do(key, loader, ticker, start_date, end_date)
+        return load
+
+    def iter_price_history(self, symbol: str, days: int = 30,
+                           batch_size: int = STREAM_BATCH_SIZE) -> Iterator[Dict]:
+        """
+        Stream historical prices straight from the database cursor
+
+        Rows are fetched batch_size at a time so memory stays flat whatever
+        the range. The pooled connection is held until the generator is
+        exhausted or closed.
+
+        Args:
+            symbol: Stock ticker
+            days: Number of days of history
+            batch_size: Rows per cursor.fetchmany() call
+
+        Yields:
+            One dictionary per trading day, oldest first, with the same
+            fields as the get_price_history DataFrame
+        """
+        end_date = datetime.now()
+        start_date = end_date - timedelta(days=days)
+
+        with self.connection('history_stream') as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(HISTORY_QUERY, (symbol.upper(), start_date.date(), end_date.date()))
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield self._format_history_row(row)
+            finally:
+                cursor.close()
+
+    def get_history_page(self, symbol: str, start, end, after=None,
+                         limit: int = DEFAULT_PAGE_SIZE):
+        """
+        One keyset page of bars with start <= trade_date <= end, oldest first
+
+        Continues strictly after `after` when given. Raises on database errors
+        so a failure is never mistaken for the end of the range.
+
+        Args:
+            symbol: Stock ticker
+            start, end: Inclusive date range
+            after: Last trade date of the previous page (None for the first page)
+            limit: Maximum rows in the page
+
+        Returns:
+            (rows, more) - rows as from iter_price_history, more is True if
+            bars remain after the last row
+        """
+        key = ('page', symbol.upper(), start, end, after, limit)
+        return self.flight.do(key, self._query_history_page, symbol.upper(), start, end, after, limit)
+
+    def _query_history_page(self, ticker: str, start, end, after, limit: int):
+        """get_history_page without coalescing (raises on error)"""
+        op, lower = ('>', after) if after is not None else ('>=', start)
+
+        with self.connection('history_page') as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(HISTORY_PAGE_QUERY.format(op=op), (limit + 1, ticker, lower, end))
+                rows = cursor.fetchall()
+            finally:
+                cursor.close()
+
+        with metrics.phase('convert'):
+            return [self._format_history_row(row) for row in rows[:limit]], len(rows) > limit
+
+    @staticmethod
+    def _format_history_row(row) -> Dict:
+        """Convert a HISTORY_QUERY row into a JSON-ready dictionary"""
+        return {
+            'ticker': row.ticker,
+            'trade_date': row.trade_date.strftime('%Y-%m-%d') if row.trade_date else None,
+            'open_price': float(row.open_price) if row.open_price is not None else None,
+            'high_price': float(row.high_price) if row.high_price is not None else None,
+            'low_price': float(row.low_price) if row.low_price is not None else None,
+            'close_price': float(row.close_price) if row.close_price is not None else None,
+            'volume': int(row.volume) if row.volume is not None else None,
+            'change_amount': float(row.change_amount) if row.change_amount is not None else None,
+            'change_percent': float(row.change_percent) if row.change_percent is not None else None
+        }
+
+    def _query_history(self, ticker: str, start_date, end_date) -> pd.DataFrame:
+        """Bars with start_date <= trade_date <= end_date (raises on error)"""
+        with self.connection('history') as conn:
+            # Only the DataFrame build is convert - the query inside is execute/fetch
+            with metrics.phase('convert'):
+                return pd.read_sql(HISTORY_QUERY, conn, params=(ticker, start_date, end_date))
+
     def get_market_summary(self, market: str = 'HOSE') -> pd.DataFrame:
         """
         Get summary of all stocks in a market
@@ -149,8 +425,6 @@ class StockPriceFetcher:
         Returns:
             DataFrame with all stocks' latest prices
         """
-        conn = self.connect()
-
         query = """
         SELECT
             ticker,
@@ -169,9 +443,22 @@ class StockPriceFetcher:
         ORDER BY ticker
         """
 
+        cached = self.market_cache.get(market)
+        if cached is not None:
+            return cached
+
+        def load():
+            with self.connection('market_summary') as conn:
+                with metrics.phase('convert'):
+                    summary = pd.read_sql(query, conn, params=(market,))
+            if not summary.empty:
+                self.market_cache.set(market, summary)
+            return summary
+
         try:
-            df = pd.read_sql(query, conn, params=(market,))
-            return df
+            # Every client polling the same market shares one scan, and polls
+            # within MARKET_CACHE_TTL reuse it
+            return self.flight.do(('market', market), load)
 
         except Exception as e:
             print(f"Error fetching market summary: {e}")
@@ -198,11 +485,21 @@ class StockPriceFetcher:
         print(f"Date:         {price_data['date']}")
         print(f"{'='*60}\n")
 
+    def invalidate(self, symbol: Optional[str] = None) -> int:
+        """
+        Drop cached quotes
+
+        Args:
+            symbol: Ticker to drop, or None to clear the whole cache
+
+        Returns:
+            Number of cache entries removed
+        """
+        return self.cache.invalidate(symbol.upper() if symbol else None)
+
     def close(self):
-        """Close database connection"""
-        if self.conn:
-            self.conn.close()
-            self.conn = None
+        """Close the shared connection pool"""
+        close_pool()
 
 
 def main():
@@ -2,30 +2,172 @@
 Fetch Vietnamese stock prices using pymssql (no ODBC required)
 """
 
-import pymssql
-from database_connection_pymssql import get_connection
-from datetime import datetime, timedelta
+import os
+from contextlib import contextmanager
+from database_connection_pymssql import get_pool, close_pool
+from quote_cache import QuoteCache, Revalidator
+from single_flight import SingleFlight
+from micro_batch import MicroBatcher
+from history_store import HistoryStore
+from history_pages import DEFAULT_PAGE_SIZE
+import metrics
+
+
+# Tickers per batched statement (SQL Server allows at most 2100 parameters)
+BATCH_SIZE = 500
+
+# Rows pulled per cursor.fetchmany() when streaming history
+STREAM_BATCH_SIZE = 500
+
+# History results cached per (ticker, days): entries, seconds fresh, further seconds served stale
+HISTORY_CACHE_SIZE = int(os.getenv('HISTORY_CACHE_SIZE', 200))
+HISTORY_TTL = float(os.getenv('HISTORY_TTL', 30))
+HISTORY_STALE = float(os.getenv('HISTORY_STALE', 120))
+
+# Market_Data column holding the listing exchange (HOSE/HNX/UPCOM)
+EXCHANGE_COLUMN = os.getenv('DC_EXCHANGE_COLUMN', 'EXCHANGE')
+
+# Latest row per ticker - {where} narrows the tickers, empty for the whole market
+LATEST_PRICES_QUERY = """
+SELECT
+    TICKER,
+    close_price,
+    open_price,
+    high_price,
+    low_price,
+    VOLUME,
+    TRADE_DATE
+FROM (
+    SELECT
+        TICKER,
+        PX_LAST as close_price,
+        PX_OPEN as open_price,
+        PX_HIGH as high_price,
+        PX_LOW as low_price,
+        VOLUME,
+        TRADE_DATE,
+        ROW_NUMBER() OVER (PARTITION BY TICKER ORDER BY TRADE_DATE DESC) as rn
+    FROM Market_Data
+    {where}
+) t
+WHERE rn = 1
+"""
+
+# Most recent bars for one ticker - {where} holds the ticker/date conditions
+HISTORY_QUERY = """
+SELECT TOP (%s)
+    TICKER,
+    PX_LAST as close_price,
+    PX_OPEN as open_price,
+    PX_HIGH as high_price,
+    PX_LOW as low_price,
+    VOLUME,
+    TRADE_DATE
+FROM Market_Data
+WHERE {where}
+ORDER BY TRADE_DATE DESC
+"""
+
+# One keyset page of bars, oldest first - {op} is >= on the first page, > after a cursor
+HISTORY_PAGE_QUERY = """
+SELECT TOP (%s)
+    TICKER,
+    PX_LAST as close_price,
+    PX_OPEN as open_price,
+    PX_HIGH as high_price,
+    PX_LOW as low_price,
+    VOLUME,
+    TRADE_DATE
+FROM Market_Data
+WHERE TICKER = %s
+    AND TRADE_DATE {op} %s
+    AND TRADE_DATE <= %s
+ORDER BY TRADE_DATE ASC
+"""
+
+# Latest row per ticker for the whole market, with its exchange
+MARKET_PRICES_QUERY = """
+SELECT
+    TICKER,
+    exchange,
+    close_price,
+    open_price,
+    high_price,
+    low_price,
+    VOLUME,
+    TRADE_DATE
+FROM (
+    SELECT
+        TICKER,
+        {exchange_column} as exchange,
+        PX_LAST as close_price,
+        PX_OPEN as open_price,
+        PX_HIGH as high_price,
+        PX_LOW as low_price,
+        VOLUME,
+        TRADE_DATE,
+        ROW_NUMBER() OVER (PARTITION BY TICKER ORDER BY TRADE_DATE DESC) as rn
+    FROM Market_Data
+) t
+WHERE rn = 1
+"""
 
 
 class StockPriceFetcher:
     """Fetch stock prices from DClab database using pymssql"""
 
-    def __init__(self):
-        """Initialize - connection created per request"""
-        self.conn = None
+    def __init__(self, cache_size=None, cache_ttl=None, history_store=None):
+        """
+        Initialize - connections are borrowed from the shared pool per request
+        Latest quotes are cached in memory (size/TTL default to QUOTE_CACHE_SIZE/QUOTE_CACHE_TTL)
+        History is read from the local store at HISTORY_STORE_DIR when set
+        """
+        self.cache = QuoteCache(max_size=cache_size, ttl=cache_ttl)
+        self.history_cache = QuoteCache(max_size=HISTORY_CACHE_SIZE, ttl=HISTORY_TTL, stale=HISTORY_STALE)
+        self.revalidator = Revalidator()  # Background refresh of stale cache entries
+        self.flight = SingleFlight()  # Identical concurrent queries run once
+        self.batcher = MicroBatcher(self._fetch_multiple_prices)  # Single quotes share IN queries
+        self.history_store = history_store if history_store is not None else HistoryStore.from_env()
 
-    def _get_connection(self):
-        """Get or create database connection"""
-        if self.conn is None:
-            self.conn = get_connection()
-        return self.conn
+    @contextmanager
+    def connection(self, operation='query'):
+        """Borrow a pooled connection, its queries recorded under operation in /metrics"""
+        with get_pool().connection() as conn:
+            yield metrics.instrument(conn, operation)
 
     def get_latest_price(self, symbol):
         """Get the most recent price for a stock"""
-        try:
-            conn = get_connection()  # Fresh connection for each request
-            cursor = conn.cursor(as_dict=True)
+        return self.get_latest_price_status(symbol)[0]
+
+    def get_latest_price_status(self, symbol):
+        """
+        Get the most recent price and whether it was served stale, as (price, stale)
+        An expired cache entry still within QUOTE_CACHE_STALE is returned at once
+        while a background thread refreshes it
+        """
+        key = symbol.upper()
+        cached, stale = self.cache.get_stale(key)
+        if cached is not None:
+            if stale:
+                self.revalidator.submit(('latest', key), self.flight.do, ('latest', key), self._fetch_and_cache, key)
+            return cached, stale
+
+        # Concurrent misses for the same symbol share one query
+        return self.flight.do(('latest', key), self._fetch_and_cache, key), False
+
+    def _fetch_and_cache(self, key):
+        """Query one quote and cache it - runs once per burst of identical calls"""
+        if self.batcher.enabled:
+            # Joins other symbols requested within the batching window
+            price = self.batcher.load(key)
+        else:
+            price = self._fetch_latest_price(key)
+        if price is not None:
+            self.cache.set(key, price)
+        return price
 
+    def _fetch_latest_price(self, symbol):
+        """Query the latest price for one symbol, bypassing the cache"""
         query = """
         SELECT TOP 1
             TICKER,
@@ -40,35 +182,16 @@ class StockPriceFetcher:
         ORDER BY TRADE_DATE DESC
         """
 
-            cursor.execute(query, (symbol,))
-            row = cursor.fetchone()
-            cursor.close()
-            conn.close()
+        try:
+            with self.connection('latest_price') as conn:
+                cursor = conn.cursor(as_dict=True)
+                cursor.execute(query, (symbol,))
+                row = cursor.fetchone()
+                cursor.close()
 
             if row:
-            # Calculate change (compared to open)
-            change = row['close_price'] - row['open_price']
-            pct_change = (change / row['open_price'] * 100) if row['open_price'] else 0
-
-            return {
-                'symbol': row['TICKER'],
-                'ticker': row['TICKER'],
-                'price': float(row['close_price']),
-                'open': float(row['open_price']),
-                'high': float(row['high_price']),
-                'low': float(row['low_price']),
-                'volume': int(row['VOLUME']),
-                'date': row['TRADE_DATE'].strftime('%Y-%m-%d'),
-                'trade_date': row['TRADE_DATE'].strftime('%Y-%m-%d'),
-                'close_price': float(row['close_price']),
-                'open_price': float(row['open_price']),
-                'high_price': float(row['high_price']),
-                'low_price': float(row['low_price']),
-                'change': float(change),
-                'change_amount': float(change),
-                'pct_change': round(pct_change, 2),
-                'change_percent': round(pct_change, 2)
-                }
+                with metrics.phase('convert'):
+                    return self._format_price(row)
 
             return None
         except Exception as e:
@@ -76,66 +199,300 @@ class StockPriceFetcher:
             print(f"Error fetching price for {symbol}: {e}")
             return None
 
+    def _format_price(self, row):
+        """Convert a Market_Data row into the quote dictionary"""
+        # Calculate change (compared to open)
+        change = row['close_price'] - row['open_price']
+        pct_change = (change / row['open_price'] * 100) if row['open_price'] else 0
+
+        return {
+            'symbol': row['TICKER'],
+            'ticker': row['TICKER'],
+            'price': float(row['close_price']),
+            'open': float(row['open_price']),
+            'high': float(row['high_price']),
+            'low': float(row['low_price']),
+            'volume': int(row['VOLUME']),
+            'date': row['TRADE_DATE'].strftime('%Y-%m-%d'),
+            'trade_date': row['TRADE_DATE'].strftime('%Y-%m-%d'),
+            'close_price': float(row['close_price']),
+            'open_price': float(row['open_price']),
+            'high_price': float(row['high_price']),
+            'low_price': float(row['low_price']),
+            'change': float(change),
+            'change_amount': float(change),
+            'pct_change': round(pct_change, 2),
+            'change_percent': round(pct_change, 2)
+        }
+
     def get_multiple_prices(self, symbols):
-        """Get prices for multiple stocks"""
+        """
+        Get prices for multiple stocks
+        One query per BATCH_SIZE tickers; symbols without data map to None
+        """
         results = {}
+        missing = []
         for symbol in symbols:
-            results[symbol] = self.get_latest_price(symbol)
+            results[symbol] = self.cache.get(symbol.upper())
+            if results[symbol] is None:
+                missing.append(symbol)
+
+        if missing:
+            fetched = self.flight.do(('multiple', tuple(missing)), self._fetch_multiple_prices, missing)
+            for symbol, price in fetched.items():
+                results[symbol] = price
+                if price is not None:
+                    self.cache.set(symbol.upper(), price)
+        return results
+
+    def _fetch_multiple_prices(self, symbols):
+        """Query latest prices for several symbols, bypassing the cache"""
+        results = {symbol: None for symbol in symbols}
+        tickers = sorted({symbol.upper() for symbol in symbols})
+        if not tickers:
+            return results
+
+        rows = {}
+        try:
+            with self.connection('multiple_prices') as conn:
+                cursor = conn.cursor(as_dict=True)
+                for i in range(0, len(tickers), BATCH_SIZE):
+                    batch = tickers[i:i + BATCH_SIZE]
+                    where = f"WHERE TICKER IN ({', '.join(['%s'] * len(batch))})"
+                    cursor.execute(LATEST_PRICES_QUERY.format(where=where), tuple(batch))
+                    for row in cursor.fetchall():
+                        rows[row['TICKER'].upper()] = row
+                cursor.close()
+        except Exception as e:
+            print(f"Error fetching prices for {len(tickers)} symbols: {e}")
+            return results
+
+        with metrics.phase('convert'):
+            for symbol in symbols:
+                row = rows.get(symbol.upper())
+                if row:
+                    try:
+                        results[symbol] = self._format_price(row)
+                    except Exception as e:
+                        print(f"Error fetching price for {symbol}: {e}")
+        return results
+
+    def get_all_latest_prices(self):
+        """
+        Get the latest price and exchange for every ticker in Market_Data
+        Used to build the in-memory market snapshot; returns {} on error
+        """
+        try:
+            with self.connection('all_latest_prices') as conn:
+                cursor = conn.cursor(as_dict=True)
+                cursor.execute(MARKET_PRICES_QUERY.format(exchange_column=EXCHANGE_COLUMN))
+                rows = cursor.fetchall()
+                cursor.close()
+        except Exception as e:
+            print(f"Error fetching market-wide prices: {e}")
+            return {}
+
+        results = {}
+        with metrics.phase('convert'):
+            for row in rows:
+                try:
+                    price = self._format_price(row)
+                    price['exchange'] = row['exchange']
+                    results[row['TICKER'].upper()] = price
+                except Exception as e:
+                    print(f"Error converting price for {row['TICKER']}: {e}")
         return results
 
     def get_price_history(self, symbol, days=30):
-        """Get historical prices for a stock"""
+        """
+        Get the last `days` bars for a stock, newest first
+        Served from the local history store when one is configured - only bars
+        newer than its high-water mark (or older than its start) hit the database
+        """
+        return self.get_price_history_status(symbol, days)[0]
+
+    def get_price_history_status(self, symbol, days=30):
+        """
+        get_price_history plus whether the rows were served stale, as (rows, stale)
+        Results are cached for HISTORY_TTL seconds, then served stale for up to
+        HISTORY_STALE more while a background thread reloads them
+        """
+        key = (symbol.upper(), days)
+        cached, stale = self.history_cache.get_stale(key)
+        if cached is not None:
+            if stale:
+                self.revalidator.submit(('history',) + key, self._refresh_history, key)
+            return cached, stale
+
         try:
-            conn = get_connection()  # Fresh connection
+            return self._refresh_history(key), False
+        except Exception as e:
+            print(f"Error fetching history for {symbol}: {e}")
+            return [], False
+
+    def _refresh_history(self, key):
+        """Load history for (ticker, days) once per burst of identical calls and cache it"""
+        history = self.flight.do(('history',) + key, self._load_history, *key)
+        if history:
+            self.history_cache.set(key, history)
+        return history
+
+    def _load_history(self, ticker, days):
+        """History from the store or the database (raises on error)"""
+        if self.history_store is not None and self.history_store.high_water_mark:
+            return self._history_from_store(ticker, days)
+        return self._query_history(ticker, days)
+
+    def iter_price_history(self, symbol, days=30, batch_size=STREAM_BATCH_SIZE):
+        """
+        Yield the last `days` bars for a stock, newest first, straight from the cursor
+        Rows are fetched batch_size at a time so memory stays flat whatever the range;
+        the pooled connection is held until the generator is exhausted or closed
+        """
+        with self.connection('history_stream') as conn:
             cursor = conn.cursor(as_dict=True)
+            try:
+                cursor.execute(HISTORY_QUERY.format(where='TICKER = %s'), (days, symbol))
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield self._format_history_row(row)
+            finally:
+                cursor.close()
+
+    def get_history_page(self, symbol, start, end, after=None, limit=DEFAULT_PAGE_SIZE):
+        """
+        One keyset page of bars with start <= TRADE_DATE <= end, oldest first
+        Continues strictly after `after` when given. Raises on database errors so
+        a failure is never mistaken for the end of the range.
+
+        Returns:
+            (rows, more) - more is True if bars remain after the last row
+        """
+        key = ('page', symbol.upper(), start, end, after, limit)
+        return self.flight.do(key, self._query_history_page, symbol.upper(), start, end, after, limit)
+
+    def _query_history_page(self, ticker, start, end, after, limit):
+        """get_history_page without coalescing"""
+        op, lower = ('>', after) if after is not None else ('>=', start)
+
+        with self.connection('history_page') as conn:
+            cursor = conn.cursor(as_dict=True)
+            cursor.execute(HISTORY_PAGE_QUERY.format(op=op), (limit + 1, ticker, lower, end))
+            rows = cursor.fetchall()
+            cursor.close()
+
+        with metrics.phase('convert'):
+            return [self._format_history_row(row) for row in rows[:limit]], len(rows) > limit
+
+    def _query_history(self, symbol, days, after=None, before=None):
+        """Last `days` bars from Market_Data, optionally only after/before a date"""
+        conditions = ['TICKER = %s']
+        params = [days, symbol]
+        if after is not None:
+            conditions.append('TRADE_DATE > %s')
+            params.append(after)
+        if before is not None:
+            conditions.append('TRADE_DATE < %s')
+            params.append(before)
+
+        with self.connection('history') as conn:
+            cursor = conn.cursor(as_dict=True)
+            cursor.execute(HISTORY_QUERY.format(where=' AND '.join(conditions)), tuple(params))
+            rows = cursor.fetchall()
+            cursor.close()
+
+        with metrics.phase('convert'):
+            return [self._format_history_row(row) for row in rows]
 
+    def _history_from_store(self, ticker, days):
+        """Combine unsynced recent bars from the database with stored bars"""
+        store = self.history_store
+        results = self._query_history(ticker, days, after=store.high_water_mark)
+
+        with metrics.phase('convert'):
+            for bar in store.tail(ticker, days - len(results))[::-1]:
+                results.append(self._format_history_row({
+                    'TICKER': ticker,
+                    'close_price': bar['close'],
+                    'open_price': bar['open'],
+                    'high_price': bar['high'],
+                    'low_price': bar['low'],
+                    'VOLUME': bar['volume'],
+                    'TRADE_DATE': bar['trade_date'].item(),
+                }))
+
+        missing = days - len(results)
+        if missing > 0 and not store.complete:
+            results.extend(self._query_history(ticker, missing, before=store.low_water_mark))
+
+        return results
+
+    def _format_history_row(self, row):
+        """Convert a Market_Data row into a history entry"""
+        change = row['close_price'] - row['open_price']
+        pct_change = (change / row['open_price'] * 100) if row['open_price'] else 0
+
+        return {
+            'symbol': row['TICKER'],
+            'ticker': row['TICKER'],
+            'price': float(row['close_price']),
+            'open': float(row['open_price']),
+            'high': float(row['high_price']),
+            'low': float(row['low_price']),
+            'volume': int(row['VOLUME']),
+            'date': row['TRADE_DATE'].strftime('%Y-%m-%d'),
+            'trade_date': row['TRADE_DATE'].strftime('%Y-%m-%d'),
+            'change': float(change),
+            'pct_change': round(pct_change, 2)
+        }
+
+    # --------------------------------------------------------------------------------
+    # HISTORY STORE SYNC SOURCE
+    # --------------------------------------------------------------------------------
+
+    def get_trade_date_range(self):
+        """First and last TRADE_DATE in Market_Data"""
+        with self.connection('trade_date_range') as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT MIN(TRADE_DATE), MAX(TRADE_DATE) FROM Market_Data")
+            first, last = cursor.fetchone()
+            cursor.close()
+        return first, last
+
+    def get_history_rows(self, after, until):
+        """
+        Bars for every ticker with after < TRADE_DATE <= until
+        Returned as (ticker, trade_date, open, high, low, close, volume) tuples
+        """
         query = """
-        SELECT TOP (%s)
-            TICKER,
-            PX_LAST as close_price,
-            PX_OPEN as open_price,
-            PX_HIGH as high_price,
-            PX_LOW as low_price,
-            VOLUME,
-            TRADE_DATE
+        SELECT TICKER, TRADE_DATE, PX_OPEN, PX_HIGH, PX_LOW, PX_LAST, VOLUME
         FROM Market_Data
-        WHERE TICKER = %s
-        ORDER BY TRADE_DATE DESC
+        WHERE TRADE_DATE > %s AND TRADE_DATE <= %s
         """
 
-            cursor.execute(query, (days, symbol))
+        with self.connection('history_rows') as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, (after, until))
             rows = cursor.fetchall()
             cursor.close()
-            conn.close()
-
-            results = []
-        for row in rows:
-            change = row['close_price'] - row['open_price']
-            pct_change = (change / row['open_price'] * 100) if row['open_price'] else 0
-
-            results.append({
-                'symbol': row['TICKER'],
-                'ticker': row['TICKER'],
-                'price': float(row['close_price']),
-                'open': float(row['open_price']),
-                'high': float(row['high_price']),
-                'low': float(row['low_price']),
-                'volume': int(row['VOLUME']),
-                'date': row['TRADE_DATE'].strftime('%Y-%m-%d'),
-                'trade_date': row['TRADE_DATE'].strftime('%Y-%m-%d'),
-                'change': float(change),
-                'pct_change': round(pct_change, 2)
-                })
+        return rows
 
-            return results
-        except Exception as e:
-            print(f"Error fetching history for {symbol}: {e}")
-            return []
+    def pool_stats(self):
+        """Connection pool size and usage counters"""
+        return get_pool().stats()
+
+    def invalidate(self, symbol=None):
+        """Drop the cached quote for symbol, or all cached quotes and history if None"""
+        if symbol is None:
+            self.history_cache.invalidate()
+        return self.cache.invalidate(symbol.upper() if symbol else None)
 
     def close(self):
-        """Close database connection"""
-        if self.conn:
-            self.conn.close()
+        """Close the shared connection pool"""
+        close_pool()
 
     def __enter__(self):
         return self
@@ -3,24 +3,148 @@ Get Vietnamese Stock Prices from DClab Database - Simple Version
 Direct connection without Entra ID authentication
 """
 
-from database_connection_simple import connect_to_database
-from typing import List, Dict, Optional
+import os
+from database_connection_simple import get_pool, close_pool
+from quote_cache import QuoteCache, Revalidator
+from single_flight import SingleFlight
+from micro_batch import MicroBatcher
+from history_store import HistoryStore
+from history_cache import HistoryCache
+from history_pages import DEFAULT_PAGE_SIZE
+import metrics
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
 from datetime import datetime, timedelta
 import pandas as pd
 
 
+# Tickers per batched statement (SQL Server allows at most 2100 parameters)
+BATCH_SIZE = 500
+
+# Rows pulled per cursor.fetchmany() when streaming history
+STREAM_BATCH_SIZE = 500
+
+# Market_Data column holding the listing exchange (HOSE/HNX/UPCOM)
+EXCHANGE_COLUMN = os.getenv('DC_EXCHANGE_COLUMN', 'EXCHANGE')
+
+# Latest row per ticker - {where} narrows the tickers, empty for the whole market
+LATEST_PRICES_QUERY = """
+SELECT
+    TICKER,
+    close_price,
+    open_price,
+    high_price,
+    low_price,
+    VOLUME,
+    TRADE_DATE
+FROM (
+    SELECT
+        TICKER,
+        PX_LAST as close_price,
+        PX_OPEN as open_price,
+        PX_HIGH as high_price,
+        PX_LOW as low_price,
+        VOLUME,
+        TRADE_DATE,
+        ROW_NUMBER() OVER (PARTITION BY TICKER ORDER BY TRADE_DATE DESC) as rn
+    FROM Market_Data
+    {where}
+) t
+WHERE rn = 1
+"""
+
+# Daily bars for one ticker between two dates, oldest first
+HISTORY_QUERY = """
+SELECT
+    TICKER as ticker,
+    TRADE_DATE as trade_date,
+    PX_OPEN as open_price,
+    PX_HIGH as high_price,
+    PX_LOW as low_price,
+    PX_LAST as close_price,
+    VOLUME as volume
+FROM Market_Data
+WHERE TICKER = ?
+    AND TRADE_DATE >= ?
+    AND TRADE_DATE <= ?
+ORDER BY TRADE_DATE ASC
+"""
+
+# One keyset page of bars, oldest first - {op} is >= on the first page, > after a cursor
+HISTORY_PAGE_QUERY = """
+SELECT TOP (?)
+    TICKER as ticker,
+    TRADE_DATE as trade_date,
+    PX_OPEN as open_price,
+    PX_HIGH as high_price,
+    PX_LOW as low_price,
+    PX_LAST as close_price,
+    VOLUME as volume
+FROM Market_Data
+WHERE TICKER = ?
+    AND TRADE_DATE {op} ?
+    AND TRADE_DATE <= ?
+ORDER BY TRADE_DATE ASC
+"""
+
+# Latest row per ticker for the whole market, with its exchange
+MARKET_PRICES_QUERY = """
+SELECT
+    TICKER,
+    exchange,
+    close_price,
+    open_price,
+    high_price,
+    low_price,
+    VOLUME,
+    TRADE_DATE
+FROM (
+    SELECT
+        TICKER,
+        {exchange_column} as exchange,
+        PX_LAST as close_price,
+        PX_OPEN as open_price,
+        PX_HIGH as high_price,
+        PX_LOW as low_price,
+        VOLUME,
+        TRADE_DATE,
+        ROW_NUMBER() OVER (PARTITION BY TICKER ORDER BY TRADE_DATE DESC) as rn
+    FROM Market_Data
+) t
+WHERE rn = 1
+"""
+
+
 class StockPriceFetcher:
     """Fetch stock prices from DClab database"""
 
-    def __init__(self):
-        """Initialize with database connection"""
-        self.conn = None
+    def __init__(self, cache_size: Optional[int] = None, cache_ttl: Optional[float] = None,
+                 history_store: Optional[HistoryStore] = None):
+        """
+        Initialize - each call borrows its own connection from the shared pool
+
+        Args:
+            cache_size: Max quotes kept in the cache (default QUOTE_CACHE_SIZE)
+            cache_ttl: Seconds a cached quote stays valid (default QUOTE_CACHE_TTL)
+            history_store: Local history store (default: HISTORY_STORE_DIR if set)
+        """
+        self.cache = QuoteCache(max_size=cache_size, ttl=cache_ttl)
+        self.revalidator = Revalidator()  # Background refresh of stale cache entries
+        self.flight = SingleFlight()  # Identical concurrent queries run once
+        self.batcher = MicroBatcher(self._fetch_multiple_prices)  # Single quotes share IN queries
+        self.history_store = history_store if history_store is not None else HistoryStore.from_env()
+        self.history_cache = HistoryCache(revalidator=self.revalidator)
+
+    @contextmanager
+    def connection(self, operation: str = 'query'):
+        """
+        Borrow a pooled connection for a with-block (dead ones are replaced)
 
-    def connect(self):
-        """Connect to database"""
-        if not self.conn:
-            self.conn = connect_to_database()
-        return self.conn
+        Args:
+            operation: Fetcher method the queries are recorded under in /metrics
+        """
+        with get_pool().connection() as conn:
+            yield metrics.instrument(conn, operation)
 
     def get_latest_price(self, symbol: str) -> Optional[Dict]:
         """
@@ -32,9 +156,44 @@ class StockPriceFetcher:
         Returns:
             Dictionary with price information or None
         """
-        conn = self.connect()
-        cursor = conn.cursor()
+        return self.get_latest_price_status(symbol)[0]
+
+    def get_latest_price_status(self, symbol: str) -> Tuple[Optional[Dict], bool]:
+        """
+        Get the latest price and whether it was served stale
+
+        An expired cache entry still within QUOTE_CACHE_STALE is returned at once
+        while a background thread refreshes it, so callers never wait on expiry.
+
+        Args:
+            symbol: Stock ticker (e.g., 'VNM', 'VIC')
 
+        Returns:
+            (price dictionary or None, stale)
+        """
+        key = symbol.upper()
+        cached, stale = self.cache.get_stale(key)
+        if cached is not None:
+            if stale:
+                self.revalidator.submit(('latest', key), self.flight.do, ('latest', key), self._fetch_and_cache, key)
+            return cached, stale
+
+        # Concurrent misses for the same symbol share one query
+        return self.flight.do(('latest', key), self._fetch_and_cache, key), False
+
+    def _fetch_and_cache(self, key: str) -> Optional[Dict]:
+        """Query one quote and cache it - runs once per burst of identical calls"""
+        if self.batcher.enabled:
+            # Joins other symbols requested within the batching window
+            price = self.batcher.load(key)
+        else:
+            price = self._fetch_latest_price(key)
+        if price is not None:
+            self.cache.set(key, price)
+        return price
+
+    def _fetch_latest_price(self, symbol: str) -> Optional[Dict]:
+        """Query the latest price for one symbol, bypassing the cache"""
         # Query for latest price from Market_Data table
         query = """
         SELECT TOP 1
@@ -51,41 +210,49 @@ class StockPriceFetcher:
         """
 
         try:
-            cursor.execute(query, (symbol.upper(),))
-            row = cursor.fetchone()
+            with self.connection('latest_price') as conn:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute(query, (symbol.upper(),))
+                    row = cursor.fetchone()
+                finally:
+                    cursor.close()
 
             if row:
-                # Calculate change from open to close
-                change = row.close_price - row.open_price if row.close_price and row.open_price else 0
-                pct_change = (change / row.open_price * 100) if row.open_price and row.open_price > 0 else 0
-
-                return {
-                    'symbol': row.TICKER,
-                    'ticker': row.TICKER,
-                    'price': round(row.close_price, 2) if row.close_price else 0,
-                    'close_price': round(row.close_price, 2) if row.close_price else 0,
-                    'open': round(row.open_price, 2) if row.open_price else 0,
-                    'open_price': round(row.open_price, 2) if row.open_price else 0,
-                    'high': round(row.high_price, 2) if row.high_price else 0,
-                    'high_price': round(row.high_price, 2) if row.high_price else 0,
-                    'low': round(row.low_price, 2) if row.low_price else 0,
-                    'low_price': round(row.low_price, 2) if row.low_price else 0,
-                    'volume': int(row.VOLUME) if row.VOLUME else 0,
-                    'date': row.TRADE_DATE.strftime('%Y-%m-%d') if row.TRADE_DATE else None,
-                    'trade_date': row.TRADE_DATE.strftime('%Y-%m-%d') if row.TRADE_DATE else None,
-                    'change': round(change, 2),
-                    'change_amount': round(change, 2),
-                    'pct_change': round(pct_change, 2),
-                    'change_percent': round(pct_change, 2)
-                }
+                with metrics.phase('convert'):
+                    return self._format_price(row)
 
             return None
 
         except Exception as e:
             print(f"Error fetching {symbol}: {e}")
             return None
-        finally:
-            cursor.close()
+
+    def _format_price(self, row) -> Dict:
+        """Convert a Market_Data row into the quote dictionary"""
+        # Calculate change from open to close
+        change = row.close_price - row.open_price if row.close_price and row.open_price else 0
+        pct_change = (change / row.open_price * 100) if row.open_price and row.open_price > 0 else 0
+
+        return {
+            'symbol': row.TICKER,
+            'ticker': row.TICKER,
+            'price': round(row.close_price, 2) if row.close_price else 0,
+            'close_price': round(row.close_price, 2) if row.close_price else 0,
+            'open': round(row.open_price, 2) if row.open_price else 0,
+            'open_price': round(row.open_price, 2) if row.open_price else 0,
+            'high': round(row.high_price, 2) if row.high_price else 0,
+            'high_price': round(row.high_price, 2) if row.high_price else 0,
+            'low': round(row.low_price, 2) if row.low_price else 0,
+            'low_price': round(row.low_price, 2) if row.low_price else 0,
+            'volume': int(row.VOLUME) if row.VOLUME else 0,
+            'date': row.TRADE_DATE.strftime('%Y-%m-%d') if row.TRADE_DATE else None,
+            'trade_date': row.TRADE_DATE.strftime('%Y-%m-%d') if row.TRADE_DATE else None,
+            'change': round(change, 2),
+            'change_amount': round(change, 2),
+            'pct_change': round(pct_change, 2),
+            'change_percent': round(pct_change, 2)
+        }
 
     def get_multiple_prices(self, symbols: List[str]) -> Dict[str, Optional[Dict]]:
         """
@@ -95,17 +262,96 @@ class StockPriceFetcher:
             symbols: List of stock tickers
 
         Returns:
-            Dictionary mapping symbols to price data
+            Dictionary mapping symbols to price data (None if not found)
         """
         results = {}
+        missing = []
         for symbol in symbols:
-            results[symbol] = self.get_latest_price(symbol)
+            results[symbol] = self.cache.get(symbol.upper())
+            if results[symbol] is None:
+                missing.append(symbol)
+
+        if missing:
+            fetched = self.flight.do(('multiple', tuple(missing)), self._fetch_multiple_prices, missing)
+            for symbol, price in fetched.items():
+                results[symbol] = price
+                if price is not None:
+                    self.cache.set(symbol.upper(), price)
+        return results
+
+    def _fetch_multiple_prices(self, symbols: List[str]) -> Dict[str, Optional[Dict]]:
+        """Query latest prices for several symbols, bypassing the cache"""
+        results = {symbol: None for symbol in symbols}
+        tickers = sorted({symbol.upper() for symbol in symbols})
+        if not tickers:
+            return results
+
+        rows = {}
+        try:
+            with self.connection('multiple_prices') as conn:
+                cursor = conn.cursor()
+                try:
+                    for i in range(0, len(tickers), BATCH_SIZE):
+                        batch = tickers[i:i + BATCH_SIZE]
+                        where = f"WHERE TICKER IN ({', '.join(['?'] * len(batch))})"
+                        cursor.execute(LATEST_PRICES_QUERY.format(where=where), batch)
+                        for row in cursor.fetchall():
+                            rows[row.TICKER.upper()] = row
+                finally:
+                    cursor.close()
+        except Exception as e:
+            print(f"Error fetching prices for {len(tickers)} symbols: {e}")
+            return results
+
+        with metrics.phase('convert'):
+            for symbol in symbols:
+                row = rows.get(symbol.upper())
+                if row:
+                    try:
+                        results[symbol] = self._format_price(row)
+                    except Exception as e:
+                        print(f"Error fetching {symbol}: {e}")
+        return results
+
+    def get_all_latest_prices(self) -> Dict[str, Dict]:
+        """
+        Get the latest price and exchange for every ticker in Market_Data
+        Used to build the in-memory market snapshot
+
+        Returns:
+            Dictionary mapping tickers to price data ({} on error)
+        """
+        try:
+            with self.connection('all_latest_prices') as conn:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute(MARKET_PRICES_QUERY.format(exchange_column=EXCHANGE_COLUMN))
+                    rows = cursor.fetchall()
+                finally:
+                    cursor.close()
+        except Exception as e:
+            print(f"Error fetching market-wide prices: {e}")
+            return {}
+
+        results = {}
+        with metrics.phase('convert'):
+            for row in rows:
+                try:
+                    price = self._format_price(row)
+                    price['exchange'] = row.exchange
+                    results[row.TICKER.upper()] = price
+                except Exception as e:
+                    print(f"Error converting price for {row.TICKER}: {e}")
         return results
 
     def get_price_history(self, symbol: str, days: int = 30) -> pd.DataFrame:
         """
         Get historical prices for a stock
 
+        Date ranges already held by the history cache are not fetched again.
+        Gaps are read from the local history store when one is configured -
+        only dates after its high-water mark (or before its start) hit the database
+
         Args:
             symbol: Stock ticker
             days: Number of days of history
@@ -113,42 +359,216 @@ class StockPriceFetcher:
         Returns:
             Pandas DataFrame with price history
         """
-        conn = self.connect()
-
         # Calculate date range
         end_date = datetime.now()
         start_date = end_date - timedelta(days=days)
 
-        query = """
-        SELECT
-            ticker,
-            trade_date,
-            open_price,
-            high_price,
-            low_price,
-            close_price,
-            volume,
-            change_amount,
-            change_percent
-        FROM stock_prices
-        WHERE ticker = ?
-            AND trade_date >= ?
-            AND trade_date <= ?
-        ORDER BY trade_date ASC
-        """
-
         try:
-            df = pd.read_sql(
-                query,
-                conn,
-                params=(symbol.upper(), start_date, end_date)
+            return self.history_cache.get_range(
+                symbol.upper(), start_date.date(), end_date.date(), self._coalesced_loader(self._load_history)
             )
-            return df
 
         except Exception as e:
             print(f"Error fetching history for {symbol}: {e}")
             return pd.DataFrame()
 
+    def _load_history(self, ticker: str, start_date, end_date) -> pd.DataFrame:
+        """Bars for a date range from the history store or the database (raises on error)"""
+        if self.history_store is not None and self.history_store.high_water_mark:
+            df = self._history_from_store(ticker, start_date, end_date)
+        else:
+            df = self._query_history(ticker, start_date, end_date)
+        return self._add_change_columns(df)
+
+    def get_price_history_status(self, symbol: str, days: int = 30) -> Tuple[pd.DataFrame, bool]:
+        """
+        get_price_history plus whether today's bars were served stale
+
+        Returns:
+            (history DataFrame, stale)
+        """
+        history = self.get_price_history(symbol, days)
+        return history, bool(history.attrs.get('stale', False))
+
+    def _coalesced_loader(self, loader):
+        """Wrap a history loader so identical concurrent range loads run once"""
+        def load(ticker, start_date, end_date):
+            key = ('history', ticker, start_date, end_date)
+            return self.flight.do(key, loader, ticker, start_date, end_date)
+        return load
+
+    def iter_price_history(self, symbol: str, days: int = 30,
+                           batch_size: int = STREAM_BATCH_SIZE) -> Iterator[Dict]:
+        """
+        Stream historical prices straight from the database cursor
+
+        Rows are fetched batch_size at a time so memory stays flat whatever
+        the range. The pooled connection is held until the generator is
+        exhausted or closed.
+
+        Args:
+            symbol: Stock ticker
+            days: Number of days of history
+            batch_size: Rows per cursor.fetchmany() call
+
+        Yields:
+            One dictionary per trading day, oldest first, with the same
+            fields as the get_price_history DataFrame
+        """
+        end_date = datetime.now()
+        start_date = end_date - timedelta(days=days)
+
+        with self.connection('history_stream') as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(HISTORY_QUERY, (symbol.upper(), start_date.date(), end_date.date()))
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield self._format_history_row(row)
+            finally:
+                cursor.close()
+
+    def get_history_page(self, symbol: str, start, end, after=None,
+                         limit: int = DEFAULT_PAGE_SIZE):
+        """
+        One keyset page of bars with start <= trade_date <= end, oldest first
+
+        Continues strictly after `after` when given. Raises on database errors
+        so a failure is never mistaken for the end of the range.
+
+        Args:
+            symbol: Stock ticker
+            start, end: Inclusive date range
+            after: Last trade date of the previous page (None for the first page)
+            limit: Maximum rows in the page
+
+        Returns:
+            (rows, more) - rows as from iter_price_history, more is True if
+            bars remain after the last row
+        """
+        key = ('page', symbol.upper(), start, end, after, limit)
+        return self.flight.do(key, self._query_history_page, symbol.upper(), start, end, after, limit)
+
+    def _query_history_page(self, ticker: str, start, end, after, limit: int):
+        """get_history_page without coalescing (raises on error)"""
+        op, lower = ('>', after) if after is not None else ('>=', start)
+
+        with self.connection('history_page') as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(HISTORY_PAGE_QUERY.format(op=op), (limit + 1, ticker, lower, end))
+                rows = cursor.fetchall()
+            finally:
+                cursor.close()
+
+        with metrics.phase('convert'):
+            return [self._format_history_row(row) for row in rows[:limit]], len(rows) > limit
+
+    @staticmethod
+    def _format_history_row(row) -> Dict:
+        """Convert a HISTORY_QUERY row into a JSON-ready dictionary"""
+        open_price = float(row.open_price or 0)
+        close_price = float(row.close_price or 0)
+        change = close_price - open_price if close_price and open_price else 0
+
+        return {
+            'ticker': row.ticker,
+            'trade_date': row.trade_date.strftime('%Y-%m-%d') if row.trade_date else None,
+            'open_price': open_price,
+            'high_price': float(row.high_price or 0),
+            'low_price': float(row.low_price or 0),
+            'close_price': close_price,
+            'volume': int(row.volume or 0),
+            'change_amount': round(change, 2),
+            'change_percent': round(change / open_price * 100, 2) if open_price > 0 else 0
+        }
+
+    def _query_history(self, ticker: str, start_date, end_date) -> pd.DataFrame:
+        """Bars from Market_Data with start_date <= trade_date <= end_date"""
+        with self.connection('history') as conn:
+            # Only the DataFrame build is convert - the query inside is execute/fetch
+            with metrics.phase('convert'):
+                return pd.read_sql(HISTORY_QUERY, conn, params=(ticker, start_date, end_date))
+
+    def _history_from_store(self, ticker: str, start_date, end_date) -> pd.DataFrame:
+        """Stored bars plus whatever falls outside the store's date range"""
+        store = self.history_store
+        low, high = store.low_water_mark, store.high_water_mark
+        one_day = timedelta(days=1)
+        frames = []
+
+        if not store.complete and start_date < low:
+            frames.append(self._query_history(ticker, start_date, min(end_date, low - one_day)))
+
+        bars = store.read(ticker, max(start_date, low), min(end_date, high))
+        frames.append(pd.DataFrame({
+            'ticker': ticker,
+            'trade_date': bars['trade_date'].astype('datetime64[ns]'),
+            'open_price': bars['open'],
+            'high_price': bars['high'],
+            'low_price': bars['low'],
+            'close_price': bars['close'],
+            'volume': bars['volume'],
+        }))
+
+        if end_date > high:
+            frames.append(self._query_history(ticker, high + one_day, end_date))
+
+        frames = [f for f in frames if not f.empty]
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True)
+
+    @staticmethod
+    @metrics.phased('convert')
+    def _add_change_columns(df: pd.DataFrame) -> pd.DataFrame:
+        """Add change_amount/change_percent (close vs open, same as quotes)"""
+        if df.empty:
+            return df
+
+        df['trade_date'] = pd.to_datetime(df['trade_date'])
+        change = df['close_price'] - df['open_price']
+        df['change_amount'] = change.round(2)
+        df['change_percent'] = (change / df['open_price'].where(df['open_price'] > 0) * 100).fillna(0).round(2)
+        return df
+
+    # --------------------------------------------------------------------------------
+    # HISTORY STORE SYNC SOURCE
+    # --------------------------------------------------------------------------------
+
+    def get_trade_date_range(self):
+        """First and last TRADE_DATE in Market_Data"""
+        with self.connection('trade_date_range') as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT MIN(TRADE_DATE), MAX(TRADE_DATE) FROM Market_Data")
+                first, last = cursor.fetchone()
+            finally:
+                cursor.close()
+        return first, last
+
+    def get_history_rows(self, after, until) -> List:
+        """
+        Bars for every ticker with after < TRADE_DATE <= until
+        Returned as (ticker, trade_date, open, high, low, close, volume) rows
+        """
+        query = """
+        SELECT TICKER, TRADE_DATE, PX_OPEN, PX_HIGH, PX_LOW, PX_LAST, VOLUME
+        FROM Market_Data
+        WHERE TRADE_DATE > ? AND TRADE_DATE <= ?
+        """
+
+        with self.connection('history_rows') as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(query, (after, until))
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+
     def display_price(self, price_data: Dict):
         """Display price information"""
         if not price_data:
@@ -170,11 +590,21 @@ class StockPriceFetcher:
         print(f"Date:         {price_data['date']}")
         print(f"{'='*60}\n")
 
+    def invalidate(self, symbol: Optional[str] = None) -> int:
+        """
+        Drop cached quotes
+
+        Args:
+            symbol: Ticker to drop, or None to clear the whole cache
+
+        Returns:
+            Number of cache entries removed
+        """
+        return self.cache.invalidate(symbol.upper() if symbol else None)
+
     def close(self):
-        """Close database connection"""
-        if self.conn:
-            self.conn.close()
-            self.conn = None
+        """Close the shared connection pool"""
+        close_pool()
 
 
 def main():
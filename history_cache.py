@@ -0,0 +1,294 @@
+"""
+Range-aware price history cache
+Remembers which date intervals are already held per ticker, so an overlapping
+request only queries the missing gaps and merges them into one series.
+The last few days (today's still-changing bar, late or corrected bars) are
+cached briefly and served stale while they refresh
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from quote_cache import QuoteCache, Revalidator
+
+
+# Total bars kept across all tickers before least recently used tickers are dropped
+DEFAULT_MAX_BARS = int(os.getenv('HISTORY_CACHE_BARS', 500000))
+
+# Recent (unsettled) history: seconds it stays fresh, then further seconds it may be served stale
+DEFAULT_RECENT_TTL = float(os.getenv('HISTORY_TTL', 30))
+DEFAULT_RECENT_STALE = float(os.getenv('HISTORY_STALE', 120))
+
+# Days before today that still count as recent (late and corrected bars land there)
+DEFAULT_SETTLE_DAYS = int(os.getenv('HISTORY_SETTLE_DAYS', 2))
+
+# Seconds a settled segment is kept before it is read again (0 keeps it until evicted)
+DEFAULT_SETTLED_TTL = float(os.getenv('HISTORY_SETTLED_TTL', 21600))
+
+ONE_DAY = timedelta(days=1)
+
+
+class HistoryCache:
+    """
+    Per-ticker segment cache of daily bars
+
+    Each segment records a closed date interval [start, end] that is fully known
+    (including days with no bars) together with the bars inside it. Adjacent or
+    overlapping segments are merged, so a ticker usually holds one segment.
+    Only dates older than settle_days are cached this way, and a segment is
+    read again settled_ttl seconds after its oldest part was loaded.
+    """
+
+    def __init__(self, max_bars: Optional[int] = None, revalidator: Optional[Revalidator] = None,
+                 settle_days: Optional[int] = None, settled_ttl: Optional[float] = None):
+        """
+        Args:
+            max_bars: Total cached bars before eviction (default HISTORY_CACHE_BARS)
+            revalidator: Runs background refreshes of stale recent bars
+            settle_days: Days before today served from the short-lived cache (default HISTORY_SETTLE_DAYS)
+            settled_ttl: Seconds settled segments are kept (default HISTORY_SETTLED_TTL, 0 = until evicted)
+        """
+        self.max_bars = DEFAULT_MAX_BARS if max_bars is None else max_bars
+        self.revalidator = revalidator if revalidator is not None else Revalidator()
+        self.settle_days = DEFAULT_SETTLE_DAYS if settle_days is None else settle_days
+        self.settled_ttl = DEFAULT_SETTLED_TTL if settled_ttl is None else settled_ttl
+
+        # Recent bars keyed by (ticker, start, end) - short TTL, served stale while refreshing
+        self.recent = QuoteCache(ttl=DEFAULT_RECENT_TTL, stale=DEFAULT_RECENT_STALE)
+
+        self._lock = threading.Lock()
+        self._segments = OrderedDict()  # ticker -> [(start, end, frame, loaded_at)], least recent first
+        self._bars = 0
+
+        self._hits = 0
+        self._partial_hits = 0
+        self._misses = 0
+        self._ranges_fetched = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._reloads = 0
+
+    def get_range(self, ticker: str, start: date, end: date,
+                  loader: Callable[[str, date, date], pd.DataFrame]) -> pd.DataFrame:
+        """
+        Bars for ticker with start <= trade_date <= end, oldest first
+
+        Args:
+            ticker: Stock ticker
+            start, end: Inclusive date range
+            loader: Called as loader(ticker, start, end) for each missing gap;
+                must raise on failure so errors are never cached as "no data"
+
+        Returns:
+            DataFrame whose attrs['stale'] is True if the recent bars came from
+            an expired entry that is being refreshed in the background
+        """
+        stale = False
+        settled_end = min(end, date.today() - (self.settle_days + 1) * ONE_DAY)
+        frames = []
+
+        if self.max_bars > 0 and start <= settled_end:
+            gaps = self.missing(ticker, start, settled_end)
+            for gap_start, gap_end in gaps:
+                self._add(ticker, gap_start, gap_end, loader(ticker, gap_start, gap_end))
+
+            with self._lock:
+                if not gaps:
+                    self._hits += 1
+                elif gaps != [(start, settled_end)]:
+                    self._partial_hits += 1
+                else:
+                    self._misses += 1
+                self._ranges_fetched += len(gaps)
+
+            cached = self._slice(ticker, start, settled_end)
+            if cached is None:
+                # Other tickers evicted this one between loading and slicing -
+                # load the whole range again (the ticker just added is never evicted)
+                cached = self._add(ticker, start, settled_end, loader(ticker, start, settled_end))
+                with self._lock:
+                    self._reloads += 1
+            frames.append(cached)
+            start = settled_end + ONE_DAY
+
+        if start <= end:
+            # Recent days (or the whole range when caching is disabled) are only cached briefly
+            recent, stale = self._recent(ticker, start, end, loader)
+            frames.append(recent)
+
+        frames = [f for f in frames if not f.empty]
+        result = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        result.attrs['stale'] = stale
+        return result
+
+    def _recent(self, ticker: str, start: date, end: date, loader) -> Tuple[pd.DataFrame, bool]:
+        """Unsettled bars from the short-lived cache, refreshing expired ones in the background"""
+        key = (ticker, start, end)
+        frame, stale = self.recent.get_stale(key)
+        if frame is None:
+            frame = loader(ticker, start, end)
+            self.recent.set(key, frame)
+        elif stale:
+            self.revalidator.submit(('history', key), self._refresh_recent, key, loader)
+        return frame, stale
+
+    def _refresh_recent(self, key: Tuple, loader):
+        ticker, start, end = key
+        self.recent.set(key, loader(ticker, start, end))
+
+    def missing(self, ticker: str, start: date, end: date) -> List[Tuple[date, date]]:
+        """Date intervals within [start, end] that are not cached yet (or have expired)"""
+        gaps = []
+        cursor = start
+        with self._lock:
+            self._expire(ticker)
+            for seg_start, seg_end, _, _ in self._segments.get(ticker, []):
+                if seg_end < cursor:
+                    continue
+                if seg_start > end:
+                    break
+                if seg_start > cursor:
+                    gaps.append((cursor, seg_start - ONE_DAY))
+                cursor = seg_end + ONE_DAY
+                if cursor > end:
+                    break
+        if cursor <= end:
+            gaps.append((cursor, end))
+        return gaps
+
+    def invalidate(self, ticker: Optional[str] = None) -> int:
+        """Drop one ticker's segments, or everything when ticker is None"""
+        with self._lock:
+            if ticker is None:
+                removed = self._bars
+                self._segments.clear()
+                self._bars = 0
+            else:
+                segments = self._segments.pop(ticker, [])
+                removed = sum(len(frame) for _, _, frame, _ in segments)
+                self._bars -= removed
+
+        # Recent bars expire within seconds anyway - drop them all
+        self.recent.invalidate()
+        return removed
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'tickers': len(self._segments),
+                'segments': sum(len(s) for s in self._segments.values()),
+                'bars': self._bars,
+                'max_bars': self.max_bars,
+                'hits': self._hits,
+                'partial_hits': self._partial_hits,
+                'misses': self._misses,
+                'ranges_fetched': self._ranges_fetched,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+                'reloads': self._reloads,
+                'settle_days': self.settle_days,
+                'settled_ttl': self.settled_ttl,
+                'recent': self.recent.stats(),
+            }
+
+    def nbytes(self) -> int:
+        """Approximate memory held by the cached frames (object columns counted shallow)"""
+        with self._lock:
+            frames = [frame for segments in self._segments.values() for _, _, frame, _ in segments]
+        return int(sum(frame.memory_usage(index=True).sum() for frame in frames))
+
+    # --------------------------------------------------------------------------------
+    # INTERNALS
+    # --------------------------------------------------------------------------------
+
+    def _add(self, ticker: str, start: date, end: date, frame: pd.DataFrame) -> pd.DataFrame:
+        """
+        Record [start, end] as known, merging with touching segments
+
+        Returns:
+            The cached bars within [start, end], sliced under the same lock so
+            a concurrent eviction cannot leave the caller without them
+        """
+        if not frame.empty:
+            frame = frame.copy()
+            frame['trade_date'] = pd.to_datetime(frame['trade_date'])
+
+        with self._lock:
+            slice_start, slice_end = start, end
+            loaded_at = time.monotonic()
+            kept = []
+            merged = [frame] if not frame.empty else []
+            for seg_start, seg_end, seg_frame, seg_loaded in self._segments.get(ticker, []):
+                if seg_end + ONE_DAY < start or seg_start > end + ONE_DAY:
+                    kept.append((seg_start, seg_end, seg_frame, seg_loaded))
+                    continue
+                # The merged segment expires with its oldest part
+                start, end = min(start, seg_start), max(end, seg_end)
+                loaded_at = min(loaded_at, seg_loaded)
+                self._bars -= len(seg_frame)
+                if not seg_frame.empty:
+                    merged.insert(0, seg_frame)
+
+            if merged:
+                combined = pd.concat(merged, ignore_index=True)
+                combined = (combined.drop_duplicates('trade_date', keep='last')
+                            .sort_values('trade_date')
+                            .reset_index(drop=True))
+            else:
+                combined = pd.DataFrame()
+
+            kept.append((start, end, combined, loaded_at))
+            kept.sort(key=lambda seg: seg[0])
+            self._segments[ticker] = kept
+            self._segments.move_to_end(ticker)
+            self._bars += len(combined)
+
+            # Evict least recently used tickers, never the one just added
+            while self._bars > self.max_bars and len(self._segments) > 1:
+                _, segments = self._segments.popitem(last=False)
+                self._bars -= sum(len(f) for _, _, f, _ in segments)
+                self._evictions += 1
+
+            return self._slice_locked(ticker, slice_start, slice_end)
+
+    def _slice(self, ticker: str, start: date, end: date) -> Optional[pd.DataFrame]:
+        """Cached bars within [start, end] (a copy callers may modify), None if not covered"""
+        with self._lock:
+            return self._slice_locked(ticker, start, end)
+
+    def _slice_locked(self, ticker: str, start: date, end: date) -> Optional[pd.DataFrame]:
+        segments = self._segments.get(ticker, [])
+        if ticker in self._segments:
+            self._segments.move_to_end(ticker)
+
+        for seg_start, seg_end, frame, _ in segments:
+            if seg_start <= start and end <= seg_end:
+                if frame.empty:
+                    return frame.copy()
+                dates = frame['trade_date']
+                mask = (dates >= pd.Timestamp(start)) & (dates <= pd.Timestamp(end))
+                return frame.loc[mask].reset_index(drop=True)
+
+        return None
+
+    def _expire(self, ticker: str):
+        """Drop ticker's segments older than settled_ttl (lock held)"""
+        segments = self._segments.get(ticker)
+        if not segments or self.settled_ttl <= 0:
+            return
+        cutoff = time.monotonic() - self.settled_ttl
+        kept = [seg for seg in segments if seg[3] > cutoff]
+        if len(kept) == len(segments):
+            return
+        self._bars -= sum(len(seg[2]) for seg in segments if seg[3] <= cutoff)
+        self._expirations += len(segments) - len(kept)
+        if kept:
+            self._segments[ticker] = kept
+        else:
+            del self._segments[ticker]
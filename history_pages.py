@@ -0,0 +1,100 @@
+"""
+Keyset pagination for long-range price history
+Pages are ordered by (TICKER, TRADE_DATE); the continuation cursor is an opaque
+token holding the ticker, the requested range and the last TRADE_DATE returned,
+so the next page is "TRADE_DATE > last" - an index seek, never an OFFSET scan
+"""
+
+import base64
+import json
+import os
+from datetime import date
+from typing import Dict, Optional, Tuple
+
+from history_store import to_date
+
+
+# Rows per page when ?limit= is not given, and the most a client may ask for
+DEFAULT_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', 1000))
+MAX_PAGE_SIZE = int(os.getenv('HISTORY_MAX_PAGE_SIZE', 5000))
+
+
+class PageError(ValueError):
+    """Bad start/end/limit/cursor parameters (reported to clients as a 400)"""
+
+
+def wants_page(args) -> bool:
+    """True if the request asks for a keyset page rather than ?days="""
+    return any(args.get(name) for name in ('start', 'end', 'cursor'))
+
+
+def encode_cursor(ticker: str, start: date, end: date, after: date) -> str:
+    """Opaque token for the page following `after`"""
+    payload = json.dumps({
+        't': ticker,
+        's': start.isoformat(),
+        'e': end.isoformat(),
+        'a': after.isoformat(),
+    }, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token: str) -> Dict:
+    """Inverse of encode_cursor (raises PageError on a malformed token)"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return {
+            'ticker': str(payload['t']),
+            'start': to_date(payload['s']),
+            'end': to_date(payload['e']),
+            'after': to_date(payload['a']),
+        }
+    except Exception:
+        raise PageError('invalid cursor')
+
+
+def parse_page_args(symbol: str, args) -> Tuple[str, date, date, Optional[date], int]:
+    """
+    Read start/end/cursor/limit from the query string
+
+    Args:
+        symbol: Ticker from the URL
+        args: Request query arguments (anything with .get)
+
+    Returns:
+        (ticker, start, end, after, limit) - after is None on the first page
+    """
+    ticker = symbol.upper()
+
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise PageError('limit must be an integer')
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise PageError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+
+    token = args.get('cursor')
+    if token:
+        # The cursor carries the range - start/end on later pages are ignored
+        page = decode_cursor(token)
+        if page['ticker'] != ticker:
+            raise PageError('cursor belongs to a different symbol')
+        return ticker, page['start'], page['end'], page['after'], limit
+
+    try:
+        start = to_date(args['start']) if args.get('start') else date(1900, 1, 1)
+        end = to_date(args['end']) if args.get('end') else date.today()
+    except ValueError:
+        raise PageError('start and end must be dates (YYYY-MM-DD)')
+    if start > end:
+        raise PageError('start must not be after end')
+
+    return ticker, start, end, None, limit
+
+
+def next_cursor(ticker: str, start: date, end: date, last) -> Optional[str]:
+    """Cursor for the page after `last` (a date or YYYY-MM-DD), None when there are no more rows"""
+    if last is None:
+        return None
+    return encode_cursor(ticker, start, end, to_date(last))
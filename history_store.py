@@ -0,0 +1,347 @@
+"""
+Local columnar store of daily OHLCV bars
+One NumPy file per ticker and year (<root>/<TICKER>/<YEAR>.npy), read memory-mapped.
+A sync job pulls only rows newer than the stored high-water mark of TRADE_DATE.
+The newest days are never stored - they can still change, so readers get them
+from the database
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+# --------------------------------------------------------------------------------
+# CONFIGURATION
+# --------------------------------------------------------------------------------
+
+STORE_DIR = os.getenv('HISTORY_STORE_DIR')  # Unset disables the local store
+SYNC_INTERVAL = float(os.getenv('HISTORY_SYNC_INTERVAL', 3600))  # Seconds between syncs
+SYNC_WINDOW_DAYS = int(os.getenv('HISTORY_SYNC_WINDOW', 90))  # Days pulled per query
+SYNC_START = os.getenv('HISTORY_SYNC_START')  # Optional YYYY-MM-DD, default first TRADE_DATE
+SYNC_SETTLE_DAYS = int(os.getenv('HISTORY_SYNC_SETTLE_DAYS', 1))  # Newest days left to the database
+SYNC_OVERLAP_DAYS = int(os.getenv('HISTORY_SYNC_OVERLAP', 3))  # Stored days re-read per sync
+
+BAR_DTYPE = np.dtype([
+    ('trade_date', 'datetime64[D]'),
+    ('open', 'f8'),
+    ('high', 'f8'),
+    ('low', 'f8'),
+    ('close', 'f8'),
+    ('volume', 'i8'),
+])
+
+_TICKER_RE = re.compile(r'[A-Z0-9][A-Z0-9_-]*')
+
+
+def to_date(value) -> date:
+    """Normalize a date, datetime or ISO string to a date"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+# --------------------------------------------------------------------------------
+# STORE
+# --------------------------------------------------------------------------------
+
+class HistoryStore:
+    """
+    Daily bars on local disk, partitioned by ticker and year
+
+    Holds every bar from low_water_mark to high_water_mark; anything outside
+    that range has to come from the database
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+        self._write_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._partitions = {}  # (ticker, year) -> memory-mapped array
+        self._meta = self._load_meta()
+        self._thread = None
+        self._stop = threading.Event()
+
+        self.syncs = 0
+        self.sync_errors = 0
+        self.last_sync_rows = 0
+        self.last_error = None
+
+    @classmethod
+    def from_env(cls) -> Optional['HistoryStore']:
+        """Store at HISTORY_STORE_DIR, or None when it is not configured"""
+        if not STORE_DIR:
+            return None
+        return cls(STORE_DIR)
+
+    @property
+    def high_water_mark(self) -> Optional[date]:
+        """Latest TRADE_DATE synced"""
+        value = self._meta.get('high_water_mark')
+        return to_date(value) if value else None
+
+    @property
+    def low_water_mark(self) -> Optional[date]:
+        """Earliest TRADE_DATE the store is complete from"""
+        value = self._meta.get('low_water_mark')
+        return to_date(value) if value else None
+
+    @property
+    def complete(self) -> bool:
+        """True if the store starts at the first TRADE_DATE in the database"""
+        return bool(self._meta.get('complete'))
+
+    # --------------------------------------------------------------------------------
+    # READING
+    # --------------------------------------------------------------------------------
+
+    def read(self, ticker: str, start, end) -> np.ndarray:
+        """Bars for ticker with start <= trade_date <= end, oldest first"""
+        ticker = ticker.upper()
+        start, end = to_date(start), to_date(end)
+        if start > end or not self._valid(ticker):
+            return np.empty(0, dtype=BAR_DTYPE)
+
+        parts = [self._partition(ticker, year) for year in range(start.year, end.year + 1)]
+        bars = np.concatenate([p for p in parts if p is not None] or [np.empty(0, dtype=BAR_DTYPE)])
+
+        dates = bars['trade_date']
+        lo = np.searchsorted(dates, np.datetime64(start, 'D'), side='left')
+        hi = np.searchsorted(dates, np.datetime64(end, 'D'), side='right')
+        return bars[lo:hi]
+
+    def tail(self, ticker: str, count: int) -> np.ndarray:
+        """Most recent count bars for ticker, oldest first"""
+        ticker = ticker.upper()
+        if count <= 0 or not self._valid(ticker):
+            return np.empty(0, dtype=BAR_DTYPE)
+
+        parts = []
+        have = 0
+        for year in reversed(self.years(ticker)):
+            part = self._partition(ticker, year)
+            if part is None:
+                continue
+            parts.insert(0, part)
+            have += len(part)
+            if have >= count:
+                break
+
+        if not parts:
+            return np.empty(0, dtype=BAR_DTYPE)
+        return np.concatenate(parts)[-count:]
+
+    def years(self, ticker: str) -> List[int]:
+        """Years with a partition file for ticker"""
+        folder = self.root / ticker.upper()
+        if not self._valid(ticker.upper()) or not folder.is_dir():
+            return []
+        return sorted(int(p.stem) for p in folder.glob('*.npy') if p.stem.isdigit())
+
+    def tickers(self) -> List[str]:
+        return sorted(p.name for p in self.root.iterdir() if p.is_dir() and self._valid(p.name))
+
+    # --------------------------------------------------------------------------------
+    # WRITING
+    # --------------------------------------------------------------------------------
+
+    def write(self, rows: Iterable[Tuple]) -> int:
+        """
+        Merge bars into the store
+
+        Args:
+            rows: (ticker, trade_date, open, high, low, close, volume) tuples
+
+        Returns:
+            Number of rows written
+        """
+        grouped = {}
+        count = 0
+        for ticker, trade_date, open_, high, low, close, volume in rows:
+            ticker = str(ticker).strip().upper()
+            if not self._valid(ticker):
+                continue
+            day = to_date(trade_date)
+            grouped.setdefault((ticker, day.year), []).append(
+                (np.datetime64(day, 'D'), open_ or 0.0, high or 0.0, low or 0.0, close or 0.0, volume or 0)
+            )
+            count += 1
+
+        with self._write_lock:
+            for (ticker, year), bars in grouped.items():
+                self._merge_partition(ticker, year, np.array(bars, dtype=BAR_DTYPE))
+
+        return count
+
+    def _merge_partition(self, ticker: str, year: int, new: np.ndarray):
+        """Combine new bars with the partition on disk (new rows win on the same date)"""
+        path = self._path(ticker, year)
+        if path.exists():
+            new = np.concatenate([np.load(path), new])
+
+        # Keep the last occurrence of every date, sorted by date
+        reversed_dates = new['trade_date'][::-1]
+        _, first = np.unique(reversed_dates, return_index=True)
+        merged = new[::-1][first]
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix('.tmp.npy')
+        np.save(tmp, merged)
+        os.replace(tmp, path)
+        self._partitions.pop((ticker, year), None)
+
+    # --------------------------------------------------------------------------------
+    # SYNC
+    # --------------------------------------------------------------------------------
+
+    def sync(self, source, until=None) -> int:
+        """
+        Pull rows newer than the high-water mark from the database
+
+        Today's bar changes until the close and late bars can still arrive, so
+        the sync stops SYNC_SETTLE_DAYS before today and re-reads the last
+        SYNC_OVERLAP_DAYS stored days (corrected rows replace the stored ones)
+
+        Args:
+            source: Fetcher with get_trade_date_range() and get_history_rows(after, until)
+            until: Last date to pull (default: latest TRADE_DATE in the database),
+                capped at today - SYNC_SETTLE_DAYS
+
+        Returns:
+            Number of rows written
+        """
+        with self._sync_lock:
+            first, last = source.get_trade_date_range()
+            if first is None:
+                return 0
+            first, last = to_date(first), to_date(until or last)
+            last = min(last, date.today() - timedelta(days=SYNC_SETTLE_DAYS))
+
+            after = self.high_water_mark
+            if after is None:
+                start = to_date(SYNC_START) if SYNC_START else first
+                self._meta['low_water_mark'] = start.isoformat()
+                self._meta['complete'] = start <= first
+                after = start - timedelta(days=1)
+            else:
+                # Also pulls a mark left past `last` (by an older sync) back down
+                after = max(min(after, last) - timedelta(days=SYNC_OVERLAP_DAYS),
+                            self.low_water_mark - timedelta(days=1))
+
+            written = 0
+            # Walk forward in windows so memory stays bounded and progress is kept
+            while after < last:
+                window_end = min(after + timedelta(days=SYNC_WINDOW_DAYS), last)
+                written += self.write(source.get_history_rows(after, window_end))
+                after = window_end
+                self._meta['high_water_mark'] = after.isoformat()
+                self._meta['synced_at'] = datetime.now().isoformat()
+                self._save_meta()
+
+            self.syncs += 1
+            self.last_sync_rows = written
+            return written
+
+    def start_sync(self, source, interval: Optional[float] = None):
+        """Run sync(source) now and then every interval seconds in the background"""
+        interval = SYNC_INTERVAL if interval is None else interval
+        if interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+
+        def run():
+            while not self._stop.is_set():
+                try:
+                    rows = self.sync(source)
+                    self.last_error = None
+                    if rows:
+                        print(f"History store synced {rows} rows up to {self.high_water_mark}")
+                except Exception as e:
+                    self.sync_errors += 1
+                    self.last_error = str(e)
+                    print(f"Error syncing history store: {e}")
+                self._stop.wait(interval)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=run, name='history-sync', daemon=True)
+        self._thread.start()
+
+    def stop_sync(self):
+        self._stop.set()
+
+    def stats(self) -> Dict:
+        return {
+            'root': str(self.root),
+            'low_water_mark': self._meta.get('low_water_mark'),
+            'high_water_mark': self._meta.get('high_water_mark'),
+            'complete': self.complete,
+            'synced_at': self._meta.get('synced_at'),
+            'syncs': self.syncs,
+            'sync_errors': self.sync_errors,
+            'last_sync_rows': self.last_sync_rows,
+            'last_error': self.last_error,
+            'open_partitions': len(self._partitions),
+        }
+
+    # --------------------------------------------------------------------------------
+    # INTERNALS
+    # --------------------------------------------------------------------------------
+
+    @staticmethod
+    def _valid(ticker: str) -> bool:
+        # Tickers become directory names - never let one escape the store root
+        return bool(_TICKER_RE.fullmatch(ticker))
+
+    def _path(self, ticker: str, year: int) -> Path:
+        return self.root / ticker / f'{year}.npy'
+
+    def _partition(self, ticker: str, year: int) -> Optional[np.ndarray]:
+        """Memory-mapped partition, or None if it does not exist"""
+        key = (ticker, year)
+        part = self._partitions.get(key)
+        if part is None:
+            path = self._path(ticker, year)
+            if not path.exists():
+                return None
+            part = np.load(path, mmap_mode='r')
+            self._partitions[key] = part
+        return part
+
+    def _load_meta(self) -> Dict:
+        path = self.root / '_meta.json'
+        if path.exists():
+            try:
+                return json.loads(path.read_text())
+            except Exception as e:
+                print(f"Error reading history store metadata: {e}")
+        return {}
+
+    def _save_meta(self):
+        path = self.root / '_meta.json'
+        tmp = path.with_suffix('.tmp')
+        tmp.write_text(json.dumps(self._meta, indent=2))
+        os.replace(tmp, path)
+
+
+if __name__ == '__main__':
+    # Run one sync against the database (uses the pymssql fetcher)
+    from get_stock_prices_pymssql import StockPriceFetcher
+
+    store = HistoryStore.from_env()
+    if store is None:
+        print("❌ HISTORY_STORE_DIR is not set")
+    else:
+        started = time.monotonic()
+        rows = store.sync(StockPriceFetcher())
+        print(f"✅ Synced {rows} rows in {time.monotonic() - started:.1f}s")
+        print(json.dumps(store.stats(), indent=2))
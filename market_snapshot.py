@@ -0,0 +1,384 @@
+"""
+Market-wide latest-price snapshot
+A background thread reloads the latest row per ticker every few seconds,
+so quote endpoints are answered from memory instead of Market_Data
+"""
+
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+import arrow_format
+from conditional import make_etag
+from fast_json import encode_columns
+
+
+# Seconds between reloads (0 disables the snapshot)
+DEFAULT_INTERVAL = float(os.getenv('SNAPSHOT_INTERVAL', 60))
+
+# With the snapshot disabled, a load made on the request path is reused this many seconds
+ON_DEMAND_TTL = float(os.getenv('SNAPSHOT_ON_DEMAND_TTL', 30))
+
+# Exchange codes as stored in the database -> market names used by the API
+EXCHANGE_ALIASES = {
+    'HSX': 'HOSE',
+    'HASTC': 'HNX',
+}
+
+
+# --------------------------------------------------------------------------------
+# COLUMN STORE
+# --------------------------------------------------------------------------------
+
+class MarketColumns:
+    """
+    Column-oriented copy of the snapshot, sorted by ticker
+    Built once per reload so market summaries are a cheap index slice
+    """
+
+    FLOAT_FIELDS = ('price', 'open', 'high', 'low', 'change', 'pct_change')
+
+    # Output key -> column for records(), in output order
+    RECORD_FIELDS = {
+        'symbol': 'ticker',
+        'ticker': 'ticker',
+        'exchange': 'exchange',
+        'price': 'price',
+        'close_price': 'price',
+        'open': 'open',
+        'high': 'high',
+        'low': 'low',
+        'volume': 'volume',
+        'change': 'change',
+        'change_amount': 'change',
+        'pct_change': 'pct_change',
+        'change_percent': 'pct_change',
+        'trade_date': 'trade_date',
+    }
+
+    # Column order for Arrow / Parquet bodies
+    BINARY_FIELDS = ('ticker', 'exchange', 'price', 'open', 'high', 'low', 'volume',
+                     'change', 'pct_change', 'trade_date')
+
+    def __init__(self, quotes: Dict[str, Dict]):
+        """
+        Args:
+            quotes: {ticker: quote dict} as returned by get_all_latest_prices
+        """
+        tickers = sorted(quotes)
+        rows = [quotes[t] for t in tickers]
+
+        self.columns = {
+            'ticker': np.array(tickers, dtype=object),
+            'exchange': np.array([normalize_market(r.get('exchange')) for r in rows], dtype=object),
+            'volume': np.array([r.get('volume') or 0 for r in rows], dtype=np.int64),
+            'trade_date': np.array([r.get('trade_date') or r.get('date') for r in rows], dtype=object),
+        }
+        for field in self.FLOAT_FIELDS:
+            self.columns[field] = np.array([r.get(field) or 0.0 for r in rows], dtype=np.float64)
+
+        # Row positions per exchange, computed once per reload
+        exchanges = self.columns['exchange']
+        self._positions = {
+            name: np.flatnonzero(exchanges == name)
+            for name in set(exchanges.tolist()) if name
+        }
+
+        # Encoded bodies per (exchange, format) - the columns never change, so encode once
+        self._encoded = {}
+
+    def markets(self) -> Dict[str, int]:
+        """Number of tickers per exchange"""
+        return {name: len(pos) for name, pos in self._positions.items()}
+
+    def slice(self, market: str) -> Dict[str, np.ndarray]:
+        """Columns for the tickers listed on one exchange"""
+        positions = self._positions.get(normalize_market(market))
+        if positions is None:
+            positions = np.empty(0, dtype=np.intp)
+        return {name: column[positions] for name, column in self.columns.items()}
+
+    def records(self, market: str) -> List[Dict]:
+        """Rows for one exchange in the same shape as the quote endpoints"""
+        cols = {name: column.tolist() for name, column in self.slice(market).items()}
+
+        return [
+            {
+                'symbol': ticker,
+                'ticker': ticker,
+                'exchange': exchange,
+                'price': price,
+                'close_price': price,
+                'open': open_,
+                'high': high,
+                'low': low,
+                'volume': volume,
+                'change': change,
+                'change_amount': change,
+                'pct_change': pct,
+                'change_percent': pct,
+                'trade_date': trade_date,
+            }
+            for ticker, exchange, price, open_, high, low, volume, change, pct, trade_date in zip(
+                cols['ticker'], cols['exchange'], cols['price'], cols['open'], cols['high'],
+                cols['low'], cols['volume'], cols['change'], cols['pct_change'], cols['trade_date']
+            )
+        ]
+
+    def to_json(self, market: str) -> Tuple[str, int]:
+        """records(market) as JSON text, encoded straight from the columns, and its length"""
+        return self._encode(market, 'json')
+
+    def to_binary(self, market: str, mimetype: str) -> Tuple[bytes, int]:
+        """One exchange as an Arrow stream or Parquet file (one column per field, no aliases)"""
+        return self._encode(market, mimetype)
+
+    def _encode(self, market: str, fmt: str):
+        market = normalize_market(market)
+        encoded = self._encoded.get((market, fmt))
+        if encoded is None:
+            columns = self.slice(market)
+            if fmt == 'json':
+                body = encode_columns(columns, self.RECORD_FIELDS)
+            else:
+                body = arrow_format.encode_columns({f: columns[f] for f in self.BINARY_FIELDS}, fmt)
+            encoded = (body, len(columns['ticker']))
+            self._encoded[(market, fmt)] = encoded
+        return encoded
+
+    def nbytes(self) -> int:
+        """Memory held by the column arrays and the encoded bodies"""
+        arrays = sum(column.nbytes for column in self.columns.values())
+        bodies = sum(len(body) for body, _ in list(self._encoded.values()))
+        return int(arrays + bodies)
+
+    def __len__(self):
+        return len(self.columns['ticker'])
+
+
+def normalize_market(name: Optional[str]) -> Optional[str]:
+    """Map a database exchange code to the API market name"""
+    if not name:
+        return None
+    name = str(name).strip().upper()
+    return EXCHANGE_ALIASES.get(name, name)
+
+
+# --------------------------------------------------------------------------------
+# SNAPSHOT
+# --------------------------------------------------------------------------------
+
+class MarketSnapshot:
+    """In-memory copy of the latest quote for every ticker"""
+
+    def __init__(self, loader: Callable[[], Dict[str, Dict]],
+                 interval: Optional[float] = None, on_demand_ttl: Optional[float] = None):
+        """
+        Args:
+            loader: Callable returning {ticker: quote dict} for the whole market
+            interval: Seconds between reloads (default SNAPSHOT_INTERVAL)
+            on_demand_ttl: Seconds a request-path load is reused while the
+                snapshot is disabled (default SNAPSHOT_ON_DEMAND_TTL)
+        """
+        self.loader = loader
+        self.interval = DEFAULT_INTERVAL if interval is None else interval
+        self.on_demand_ttl = ON_DEMAND_TTL if on_demand_ttl is None else on_demand_ttl
+
+        self._data = {}  # Replaced as a whole on every reload, never mutated
+        self._columns = MarketColumns({})
+        self._loaded_at = None  # time.time() of the last successful reload
+        self._modified_at = None  # time.time() of the last reload that changed any quote
+        self._changed_at = {}  # ticker -> time.time() its quote last changed
+        self._refresh_lock = threading.RLock()  # Re-entered by ensure_loaded()
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self._attempts = 0  # Reloads finished, successful or not
+
+        self.version = 0
+        self.digest = None  # Hash of the whole snapshot - equal across replicas with the same data
+        self.errors = 0
+        self.last_error = None
+        self.last_duration = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    @property
+    def ready(self) -> bool:
+        """True once the first reload has succeeded"""
+        return self._loaded_at is not None
+
+    # --------------------------------------------------------------------------------
+    # LOADING
+    # --------------------------------------------------------------------------------
+
+    def refresh(self) -> bool:
+        """Reload the snapshot now, keeping the previous data on failure"""
+        with self._refresh_lock:
+            start = time.monotonic()
+            self.last_error = None
+            try:
+                data = self.loader()
+                columns = MarketColumns(data) if data else None
+            except Exception as e:
+                data = None
+                self.last_error = str(e)
+
+            if not data:
+                self.errors += 1
+                self.last_error = self.last_error or 'no rows returned'
+                print(f"Error refreshing market snapshot: {self.last_error}")
+                self._attempts += 1
+                return False
+
+            # Remember when each quote last changed, for Last-Modified
+            now = time.time()
+            previous, changed_at = self._data, self._changed_at
+            self._changed_at = {
+                ticker: changed_at[ticker] if ticker in changed_at and previous.get(ticker) == quote else now
+                for ticker, quote in data.items()
+            }
+            if data != previous:
+                self._modified_at = now
+                self.digest = make_etag(sorted(data.items()))
+
+            self._columns = columns
+            self._data = data
+            self._loaded_at = now
+            self.version += 1
+            self.last_error = None
+            self.last_duration = time.monotonic() - start
+            self._attempts += 1
+            return True
+
+    def ensure_loaded(self) -> bool:
+        """
+        Load the snapshot on the request path if nothing else keeps it current
+
+        With the background thread running this only loads before the first
+        reload has finished; with the snapshot disabled a load is reused for
+        on_demand_ttl seconds. Concurrent callers share one load either way
+
+        Returns:
+            True if there is data to serve
+        """
+        # Read before deciding, so a load that finishes while we wait for the lock counts
+        attempts = self._attempts
+        if self.enabled:
+            due = not self.ready
+        else:
+            age = self.age()
+            due = age is None or age > self.on_demand_ttl
+
+        if due:
+            with self._refresh_lock:
+                # Callers that queued behind another load (even a failed one) take its result
+                if self._attempts == attempts:
+                    self.refresh()
+        return self.ready
+
+    def start(self):
+        """Start the background reload thread (no-op if disabled or running)"""
+        if not self.enabled:
+            return
+
+        with self._start_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='market-snapshot', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the background reload thread"""
+        self._stop.set()
+
+    def _run(self):
+        # A snapshot loaded just before start() (e.g. by the warm-up) is not reloaded at once
+        if self.ready:
+            self._stop.wait(self.interval)
+        while not self._stop.is_set():
+            self.refresh()
+            self._stop.wait(self.interval)
+
+    # --------------------------------------------------------------------------------
+    # READING
+    # --------------------------------------------------------------------------------
+
+    def get(self, symbol: str) -> Optional[Dict]:
+        """Latest quote for one symbol, or None if not in the snapshot"""
+        return self._data.get(symbol.upper())
+
+    def get_many(self, symbols: Iterable[str]) -> Dict[str, Optional[Dict]]:
+        """Latest quotes keyed by the symbols as given"""
+        data = self._data
+        return {symbol: data.get(symbol.upper()) for symbol in symbols}
+
+    def market(self, market: str) -> List[Dict]:
+        """Latest quotes for every ticker on one exchange, sorted by ticker"""
+        return self._columns.records(market)
+
+    def market_json(self, market: str) -> Tuple[str, int]:
+        """Same rows as market() as JSON text, plus the row count"""
+        return self._columns.to_json(market)
+
+    def market_binary(self, market: str, mimetype: str) -> Tuple[bytes, int]:
+        """One exchange as an Arrow stream or Parquet file, plus the row count"""
+        return self._columns.to_binary(market, mimetype)
+
+    @property
+    def columns(self) -> MarketColumns:
+        """Column store built from the current snapshot"""
+        return self._columns
+
+    @property
+    def stale(self) -> bool:
+        """True if reloads have been failing for more than two intervals"""
+        age = self.age()
+        return age is not None and self.enabled and age > 2 * self.interval
+
+    def age(self) -> Optional[float]:
+        """Seconds since the last successful reload"""
+        if self._loaded_at is None:
+            return None
+        return round(time.time() - self._loaded_at, 3)
+
+    def modified(self, symbol: Optional[str] = None) -> Optional[float]:
+        """time.time() when one symbol's quote (or any quote) last changed"""
+        if symbol is None:
+            return self._modified_at
+        return self._changed_at.get(symbol.upper())
+
+    def as_of(self) -> Optional[str]:
+        """Timestamp of the last successful reload"""
+        if self._loaded_at is None:
+            return None
+        return datetime.fromtimestamp(self._loaded_at).isoformat()
+
+    def stats(self) -> Dict:
+        return {
+            'enabled': self.enabled,
+            'ready': self.ready,
+            'symbols': len(self._data),
+            'markets': self._columns.markets(),
+            'version': self.version,
+            'digest': self.digest,
+            'age': self.age(),
+            'stale': self.stale,
+            'as_of': self.as_of(),
+            'interval': self.interval,
+            'on_demand_ttl': self.on_demand_ttl,
+            'errors': self.errors,
+            'last_error': self.last_error,
+            'last_duration': round(self.last_duration, 3) if self.last_duration is not None else None,
+        }
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,561 @@
+"""
+Prometheus metrics (text exposition format, served at /metrics)
+Request latency and database timings are recorded as they happen - a lock and
+a few additions each, cheap enough to leave on. Pool, cache, snapshot and token
+numbers already counted by those components are read from their stats() at
+scrape time instead of being counted twice
+
+Each request also gets a breakdown of where its time went (token, connect,
+execute, fetch, convert, jsonify), returned in a Server-Timing header and
+optionally written as a JSON access-log line
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Mapping, Optional, Sequence, Tuple, Union
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# SERVER_TIMING=0 drops the Server-Timing header (phases are then not tracked
+# unless the access log is on)
+SERVER_TIMING = os.getenv('SERVER_TIMING', '1').lower() not in ('0', 'false', 'no')
+
+# ACCESS_LOG=1 prints one JSON line per request with its phase breakdown
+ACCESS_LOG = os.getenv('ACCESS_LOG', '0').lower() in ('1', 'true', 'yes')
+
+# Seconds - from a cache hit (sub-millisecond) to a full market scan
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+# --------------------------------------------------------------------------------
+# METRIC TYPES
+# --------------------------------------------------------------------------------
+
+class Counter:
+    """Monotonic count per label combination"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.family = name + '_total'
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}  # label values -> count
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *values: str, amount: float = 1):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for values, count in items:
+            yield self.family, dict(zip(self.labels, values)), count
+
+
+class Histogram:
+    """Bucketed observations per label combination (cumulative on output)"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.family = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # label values -> [per-bucket counts + overflow, sum]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, *values: str):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(values)
+            if state is None:
+                state = self._values[values] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, *values: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *values)
+
+    def samples(self):
+        with self._lock:
+            items = [(values, list(state[0]), state[1]) for values, state in self._values.items()]
+        for values, counts, total in items:
+            labels = dict(zip(self.labels, values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield self.name + '_bucket', dict(labels, le=_format_value(bound)), cumulative
+            yield self.name + '_sum', labels, total
+            yield self.name + '_count', labels, cumulative
+
+
+_registry = []  # Counter / Histogram instances
+_collectors = []  # Callables yielding (name, kind, help, labels, value) at scrape time
+
+
+# --------------------------------------------------------------------------------
+# STANDARD METRICS
+# --------------------------------------------------------------------------------
+
+HTTP_REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'Time from request start to response, per route',
+    ('route', 'method', 'status'))
+
+DB_EXECUTE_SECONDS = Histogram(
+    'db_execute_seconds', 'cursor.execute() time per fetcher method', ('method',))
+
+DB_FETCH_SECONDS = Histogram(
+    'db_fetch_seconds', 'Time spent fetching rows per query, per fetcher method', ('method',))
+
+DB_ROWS = Counter('db_rows', 'Rows fetched per fetcher method', ('method',))
+
+DB_ERRORS = Counter('db_errors', 'Statements that raised, per fetcher method', ('method',))
+
+
+# --------------------------------------------------------------------------------
+# DATABASE INSTRUMENTATION
+# --------------------------------------------------------------------------------
+
+class InstrumentedCursor:
+    """
+    DB-API cursor proxy recording execute and fetch time and row counts
+
+    Fetch time and rows of a statement are accumulated over fetchone/
+    fetchmany/fetchall calls and recorded once, at the next execute or close
+    """
+
+    def __init__(self, cursor, method: str):
+        self._cursor = cursor
+        self._method = method
+        self._fetch_time = 0.0
+        self._rows = 0
+        self._fetching = False
+
+    def execute(self, *args, **kwargs):
+        self._flush()
+        start = time.perf_counter()
+        try:
+            result = self._cursor.execute(*args, **kwargs)
+        except Exception:
+            DB_ERRORS.inc(self._method)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            DB_EXECUTE_SECONDS.observe(elapsed, self._method)
+            add_phase('execute', elapsed)
+        self._fetching = True
+        return result
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._fetched(time.perf_counter() - start, row is not None)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        start = time.perf_counter()
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        self._fetched(time.perf_counter() - start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = self._cursor.fetchall()
+        self._fetched(time.perf_counter() - start, len(rows))
+        return rows
+
+    def close(self):
+        self._flush()
+        self._cursor.close()
+
+    def _fetched(self, elapsed: float, rows: int):
+        self._fetch_time += elapsed
+        self._rows += rows
+        add_phase('fetch', elapsed)
+
+    def _flush(self):
+        if self._fetching:
+            DB_FETCH_SECONDS.observe(self._fetch_time, self._method)
+            DB_ROWS.inc(self._method, amount=self._rows)
+            self._fetch_time = 0.0
+            self._rows = 0
+            self._fetching = False
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedConnection:
+    """Connection proxy whose cursors are instrumented (works with pd.read_sql too)"""
+
+    def __init__(self, conn, method: str):
+        self._conn = conn
+        self._method = method
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._conn.cursor(*args, **kwargs), self._method)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def instrument(conn, method: str) -> InstrumentedConnection:
+    """Wrap a borrowed connection so its queries are recorded under method"""
+    return InstrumentedConnection(conn, method)
+
+
+# --------------------------------------------------------------------------------
+# PER-REQUEST PHASES
+# --------------------------------------------------------------------------------
+
+class RequestPhases:
+    """Seconds spent per phase by one request (summed when a phase repeats)"""
+
+    def __init__(self):
+        self.totals = OrderedDict()  # phase -> seconds, in first-seen order
+        self._lock = threading.Lock()  # Phases of one request may run on several threads
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            self.totals[name] = self.totals.get(name, 0.0) + seconds
+
+    def milliseconds(self) -> Dict[str, float]:
+        with self._lock:
+            return {name: round(seconds * 1000, 3) for name, seconds in self.totals.items()}
+
+
+_request_phases = ContextVar('request_phases', default=None)
+_enclosing = ContextVar('enclosing_phase', default=None)  # [seconds of nested phases]
+
+
+def start_phases() -> Optional[RequestPhases]:
+    """Begin tracking phases for the request running in this context"""
+    phases = RequestPhases() if SERVER_TIMING or ACCESS_LOG else None
+    _request_phases.set(phases)
+    return phases
+
+
+def end_phases():
+    _request_phases.set(None)
+
+
+@contextmanager
+def phase(name: str):
+    """
+    Time a block as one phase of the current request (no-op outside a request)
+
+    Phases nest: the enclosing phase is charged only its own time, so connect
+    excludes the token fetch inside it and convert excludes the queries
+    pandas runs for it
+    """
+    phases = _request_phases.get()
+    if phases is None:
+        yield
+        return
+
+    nested = [0.0]
+    token = _enclosing.set(nested)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _enclosing.reset(token)
+        _record_phase(phases, name, elapsed, nested[0])
+
+
+def add_phase(name: str, seconds: float):
+    """Record an already measured duration as a phase of the current request"""
+    phases = _request_phases.get()
+    if phases is not None:
+        _record_phase(phases, name, seconds)
+
+
+def phased(name: str):
+    """Decorator recording every call of the function as phase name"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _record_phase(phases: RequestPhases, name: str, elapsed: float, nested: float = 0.0):
+    phases.add(name, elapsed - nested)
+    enclosing = _enclosing.get()
+    if enclosing is not None:
+        enclosing[0] += elapsed
+
+
+def server_timing(phases: Dict[str, float], total: float) -> str:
+    """Server-Timing header value from phase milliseconds and the total"""
+    entries = [f'{name};dur={ms:.3f}' for name, ms in phases.items()]
+    entries.append(f'total;dur={total:.3f}')
+    return ', '.join(entries)
+
+
+# --------------------------------------------------------------------------------
+# HTTP INSTRUMENTATION
+# --------------------------------------------------------------------------------
+
+def _route(request) -> str:
+    # The URL rule, not the path, so /api/stock/<symbol> is one series
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def _finish_request(request, response, elapsed: float, phases: Optional[RequestPhases]):
+    """Shared after_request work of the Flask and Quart hooks"""
+    route = _route(request)
+    HTTP_REQUEST_SECONDS.observe(elapsed, route, request.method, str(response.status_code))
+    if phases is None:
+        return
+
+    # Streaming bodies are produced after this point - only their first row counts
+    breakdown = phases.milliseconds()
+    total = round(elapsed * 1000, 3)
+    if SERVER_TIMING:
+        response.headers['Server-Timing'] = server_timing(breakdown, total)
+    if ACCESS_LOG:
+        print(json.dumps({
+            'time': datetime.now().isoformat(timespec='milliseconds'),
+            'method': request.method,
+            'path': request.path,
+            'query': request.query_string.decode('latin-1') or None,
+            'route': route,
+            'status': response.status_code,
+            'bytes': response.content_length,
+            'duration_ms': total,
+            'phases': breakdown,
+            'remote': request.remote_addr,
+        }), flush=True)
+
+
+def init_flask(app):
+    """Record every Flask request in http_request_duration_seconds and Server-Timing"""
+    from flask import g, request
+    from flask.json.provider import DefaultJSONProvider
+
+    class PhasedJSONProvider(DefaultJSONProvider):
+        """jsonify() timed as the jsonify phase"""
+
+        def response(self, *args, **kwargs):
+            with phase('jsonify'):
+                return super().response(*args, **kwargs)
+
+    app.json = PhasedJSONProvider(app)
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+        g.request_phases = start_phases()
+
+    @app.after_request
+    def record_request(response):
+        start = g.get('request_start')
+        if start is not None:
+            _finish_request(request, response, time.perf_counter() - start, g.get('request_phases'))
+        return response
+
+    @app.teardown_request
+    def stop_request_phases(exc):
+        # Worker threads are reused - nothing after this request is charged to it
+        end_phases()
+
+
+def init_quart(app):
+    """Record every Quart request in http_request_duration_seconds and Server-Timing"""
+    from quart import g, request
+    from quart.json.provider import DefaultJSONProvider
+
+    class PhasedJSONProvider(DefaultJSONProvider):
+        """jsonify() timed as the jsonify phase"""
+
+        def response(self, *args, **kwargs):
+            with phase('jsonify'):
+                return super().response(*args, **kwargs)
+
+    app.json = PhasedJSONProvider(app)
+
+    @app.before_request
+    async def start_request_timer():
+        g.request_start = time.perf_counter()
+        g.request_phases = start_phases()
+
+    @app.after_request
+    async def record_request(response):
+        start = g.get('request_start')
+        if start is not None:
+            _finish_request(request, response, time.perf_counter() - start, g.get('request_phases'))
+        return response
+
+
+# --------------------------------------------------------------------------------
+# SCRAPE-TIME COLLECTORS
+# --------------------------------------------------------------------------------
+
+StatKeys = Union[Iterable[str], Mapping[str, str]]
+
+
+def register_stats(prefix: str, stats: Callable[[], Optional[Dict]], counters: StatKeys = (),
+                   gauges: StatKeys = (), labels: Optional[Dict[str, str]] = None):
+    """
+    Expose numbers from a component's stats() dict at every scrape
+
+    Args:
+        prefix: Metric name prefix, e.g. 'pool' -> pool_waits_total
+        stats: Returns the stats dict (None or an exception skips the component)
+        counters: Stats keys that only grow, or {stats key: metric suffix}
+        gauges: Stats keys that go up and down, or {stats key: metric suffix}
+        labels: Constant labels, e.g. {'cache': 'quote'}
+    """
+    counters = _key_map(counters)
+    gauges = _key_map(gauges)
+    labels = labels or {}
+
+    def collect():
+        try:
+            values = stats()
+        except Exception:
+            return
+        if not values:
+            return
+        for key, suffix in counters.items():
+            if isinstance(values.get(key), (int, float)):
+                yield f'{prefix}_{suffix}_total', 'counter', f'{prefix} {key}', labels, values[key]
+        for key, suffix in gauges.items():
+            if isinstance(values.get(key), (int, float)):
+                yield f'{prefix}_{suffix}', 'gauge', f'{prefix} {key}', labels, values[key]
+
+    _collectors.append(collect)
+
+
+def register_collector(collect: Callable[[], Iterable[Tuple[str, str, str, Dict, float]]]):
+    """Add a callable yielding (name, kind, help, labels, value) at every scrape"""
+    _collectors.append(collect)
+
+
+def register_pool(pool_getter: Callable[[], object]):
+    """Connection pool size, utilization and wait counters"""
+    register_stats(
+        'pool', lambda: pool_getter().stats(),
+        counters={'created': 'connections_created', 'closed': 'connections_closed',
+                  'borrowed': 'borrows', 'waits': 'waits', 'wait_time': 'wait_seconds',
+                  'timeouts': 'timeouts', 'failed_checks': 'failed_checks',
+                  'evicted': 'evictions', 'rotations': 'rotations'},
+        gauges={'size': 'connections', 'idle': 'idle_connections',
+                'in_use': 'in_use_connections', 'max_size': 'max_connections'})
+
+
+def register_cache(name: str, stats_getter: Callable[[], Optional[Dict]]):
+    """Hit/miss/eviction counters of a QuoteCache or HistoryCache, labelled cache=name"""
+    register_stats(
+        'cache', stats_getter,
+        counters=('hits', 'stale_hits', 'partial_hits', 'misses', 'evictions', 'expirations'),
+        gauges={'size': 'entries', 'tickers': 'tickers', 'bars': 'bars'},
+        labels={'cache': name})
+
+
+def register_fetcher(fetcher_getter: Callable[[], object]):
+    """Caches, single-flight, micro-batching and revalidation of a StockPriceFetcher"""
+    register_cache('quote', lambda: fetcher_getter().cache.stats())
+    register_cache('history', lambda: fetcher_getter().history_cache.stats())
+    # HistoryCache keeps the last few days in a QuoteCache of its own
+    register_cache('history_recent', lambda: fetcher_getter().history_cache.stats().get('recent'))
+    register_stats('single_flight', lambda: fetcher_getter().flight.stats(),
+                   counters=('executions', 'shared', 'errors'), gauges=('in_flight',))
+    register_stats('micro_batch', lambda: fetcher_getter().batcher.stats(),
+                   counters=('calls', 'batches', 'keys', 'errors'))
+    register_stats('revalidate', lambda: fetcher_getter().revalidator.stats(),
+                   counters=('refreshes', 'skipped', 'errors'), gauges=('pending',))
+
+
+def register_snapshot(snapshot):
+    """Age, version and reload errors of a MarketSnapshot"""
+    register_stats('snapshot', snapshot.stats, counters=('errors',),
+                   gauges={'ready': 'ready', 'stale': 'stale', 'symbols': 'symbols',
+                           'version': 'version', 'age': 'age_seconds',
+                           'last_duration': 'load_seconds'})
+
+
+# --------------------------------------------------------------------------------
+# RENDERING
+# --------------------------------------------------------------------------------
+
+def render() -> str:
+    """Every metric in the Prometheus text format"""
+    families = OrderedDict()  # base name -> (kind, help, [(name, labels, value)])
+
+    for metric in _registry:
+        family = families.setdefault(metric.family, (metric.kind, metric.help, []))
+        family[2].extend(metric.samples())
+
+    for collect in _collectors:
+        try:
+            collected = list(collect())
+        except Exception as e:
+            # One broken component must not take the whole scrape down
+            print(f"Error collecting metrics: {e}")
+            continue
+        for name, kind, help, labels, value in collected:
+            family = families.setdefault(name, (kind, help, []))
+            family[2].append((name, labels, value))
+
+    lines = []
+    for base, (kind, help, samples) in families.items():
+        lines.append(f'# HELP {base} {help}')
+        lines.append(f'# TYPE {base} {kind}')
+        for name, labels, value in samples:
+            lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def _key_map(keys: StatKeys) -> Dict[str, str]:
+    return dict(keys) if isinstance(keys, Mapping) else {key: key for key in keys}
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + '}'
+
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
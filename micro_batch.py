@@ -0,0 +1,125 @@
+"""
+Micro-batching of single-key lookups
+Calls arriving within a short window are collected and answered by one batched
+load (one IN query for quotes), then the results are fanned back out to the
+waiting callers - a few milliseconds of latency for far fewer round trips
+"""
+
+import os
+import threading
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+
+# Seconds the first caller waits for others to join its batch (0 disables batching)
+DEFAULT_WINDOW = float(os.getenv('MICRO_BATCH_WINDOW_MS', 2)) / 1000
+
+# Keys per batch - a full batch is sent at once without waiting out the window
+DEFAULT_MAX_BATCH = int(os.getenv('MICRO_BATCH_MAX', 500))
+
+
+class _Batch:
+    """Keys collected during one window and the outcome of loading them"""
+
+    __slots__ = ('keys', 'full', 'done', 'results', 'error')
+
+    def __init__(self):
+        self.keys = {}  # Insertion-ordered set of keys
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.results = {}
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    Collects concurrent load(key) calls into batched loader(keys) calls
+
+    The first caller of a window becomes its leader: it waits up to `window`
+    seconds (less if the batch fills up), runs the loader once for every key
+    gathered, and wakes the other callers. No background thread is needed.
+    """
+
+    def __init__(self, loader: Callable[[List[Hashable]], Dict[Hashable, Any]],
+                 window: Optional[float] = None, max_batch: Optional[int] = None):
+        """
+        Args:
+            loader: Called with a list of distinct keys, returns {key: value};
+                keys missing from the result map to None
+            window: Seconds to collect a batch (default MICRO_BATCH_WINDOW_MS / 1000)
+            max_batch: Keys per batch (default MICRO_BATCH_MAX)
+        """
+        self.loader = loader
+        self.window = DEFAULT_WINDOW if window is None else window
+        self.max_batch = DEFAULT_MAX_BATCH if max_batch is None else max_batch
+
+        self._lock = threading.Lock()
+        self._pending = None  # Batch still accepting keys
+
+        self._calls = 0
+        self._batches = 0
+        self._keys = 0
+        self._largest = 0
+        self._errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0 and self.max_batch > 1
+
+    def load(self, key: Hashable) -> Any:
+        """Value for key, loaded together with any other keys requested meanwhile"""
+        if not self.enabled:
+            return self.loader([key]).get(key)
+
+        with self._lock:
+            self._calls += 1
+            batch = self._pending
+            leader = batch is None
+            if leader:
+                batch = self._pending = _Batch()
+            batch.keys[key] = None
+            if len(batch.keys) >= self.max_batch:
+                # Close the batch now - the next caller starts a new one
+                self._pending = None
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._pending is batch:
+                    self._pending = None
+            self._run(batch)
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.results.get(key)
+
+    def _run(self, batch: _Batch):
+        keys = list(batch.keys)
+        try:
+            batch.results = self.loader(keys) or {}
+        except Exception as e:
+            batch.error = e
+        finally:
+            with self._lock:
+                self._batches += 1
+                self._keys += len(keys)
+                self._largest = max(self._largest, len(keys))
+                if batch.error is not None:
+                    self._errors += 1
+            batch.done.set()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'window_ms': round(self.window * 1000, 3),
+                'max_batch': self.max_batch,
+                'calls': self._calls,
+                'batches': self._batches,
+                'keys': self._keys,
+                'avg_batch': round(self._keys / self._batches, 2) if self._batches else 0.0,
+                'largest_batch': self._largest,
+                'errors': self._errors,
+            }
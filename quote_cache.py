@@ -0,0 +1,199 @@
+"""
+In-process quote cache - bounded LRU with a per-entry TTL
+Sits in front of StockPriceFetcher.get_latest_price so repeat lookups skip the database.
+Expired entries can still be served for a bounded time while a background
+refresh replaces them (stale-while-revalidate)
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+# Defaults (override with environment variables)
+DEFAULT_MAX_SIZE = int(os.getenv('QUOTE_CACHE_SIZE', 2000))  # Entries
+DEFAULT_TTL = float(os.getenv('QUOTE_CACHE_TTL', 30))  # Seconds
+DEFAULT_STALE = float(os.getenv('QUOTE_CACHE_STALE', 30))  # Seconds past the TTL an entry may be served stale
+REVALIDATE_WORKERS = int(os.getenv('REVALIDATE_WORKERS', 2))  # Background refresh threads
+
+
+class QuoteCache:
+    """Thread-safe LRU cache whose entries expire ttl seconds after being set"""
+
+    def __init__(self, max_size: Optional[int] = None, ttl: Optional[float] = None,
+                 stale: Optional[float] = None):
+        """
+        Args:
+            max_size: Maximum number of entries before least recently used are evicted
+            ttl: Seconds an entry stays valid (0 disables caching)
+            stale: Further seconds an expired entry may be returned by get_stale (0 disables)
+        """
+        self.max_size = DEFAULT_MAX_SIZE if max_size is None else max_size
+        self.ttl = DEFAULT_TTL if ttl is None else ttl
+        self.stale = DEFAULT_STALE if stale is None else stale
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, expires_at), most recent last
+
+        self._hits = 0
+        self._stale_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 and self.ttl > 0
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value, or None if missing or expired"""
+        return self.get_stale(key, allow_stale=False)[0]
+
+    def get_stale(self, key: str, allow_stale: bool = True) -> Tuple[Optional[Any], bool]:
+        """
+        Look up a value that may have expired
+
+        Returns:
+            (value, False) if fresh, (value, True) if expired but within the
+            stale bound, (None, False) otherwise
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self._misses += 1
+                return None, False
+
+            value, expires_at = entry
+            now = time.monotonic()
+            if now >= expires_at:
+                if now >= expires_at + self.stale:
+                    del self._entries[key]
+                    self._expirations += 1
+                    self._misses += 1
+                    return None, False
+                if not allow_stale:
+                    # Kept so a get_stale caller can still use it until refreshed
+                    self._misses += 1
+                    return None, False
+                self._entries.move_to_end(key)
+                self._stale_hits += 1
+                return value, True
+
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return value, False
+
+    def set(self, key: str, value: Any):
+        """Store a value, evicting the least recently used entries if full"""
+        if not self.enabled:
+            return
+
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, key: Optional[str] = None) -> int:
+        """
+        Drop one entry, or every entry when key is None
+
+        Returns:
+            Number of entries removed
+        """
+        with self._lock:
+            if key is None:
+                removed = len(self._entries)
+                self._entries.clear()
+                return removed
+
+            return 1 if self._entries.pop(key, None) is not None else 0
+
+    def stats(self) -> Dict:
+        """Hit/miss/eviction counters and current size"""
+        with self._lock:
+            lookups = self._hits + self._stale_hits + self._misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'stale': self.stale,
+                'hits': self._hits,
+                'stale_hits': self._stale_hits,
+                'misses': self._misses,
+                'hit_rate': round(self._hits / lookups, 4) if lookups else 0.0,
+                'evictions': self._evictions,
+                'expirations': self._expirations,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class Revalidator:
+    """Runs cache refreshes on background threads, at most one per key at a time"""
+
+    def __init__(self, workers: Optional[int] = None):
+        """
+        Args:
+            workers: Refresh threads (default REVALIDATE_WORKERS)
+        """
+        self.workers = REVALIDATE_WORKERS if workers is None else workers
+        self._executor = ThreadPoolExecutor(max_workers=max(self.workers, 1), thread_name_prefix='revalidate')
+        self._lock = threading.Lock()
+        self._pending = set()
+
+        self._refreshes = 0
+        self._skipped = 0
+        self._errors = 0
+
+    def submit(self, key: Hashable, func: Callable, *args) -> bool:
+        """
+        Schedule func(*args) to refresh key
+
+        Returns:
+            False if a refresh for key is already queued or running
+        """
+        with self._lock:
+            if key in self._pending:
+                self._skipped += 1
+                return False
+            self._pending.add(key)
+
+        try:
+            self._executor.submit(self._run, key, func, args)
+        except RuntimeError:
+            # Executor shut down (interpreter exiting) - serve stale, skip the refresh
+            with self._lock:
+                self._pending.discard(key)
+            return False
+        return True
+
+    def _run(self, key: Hashable, func: Callable, args: tuple):
+        try:
+            func(*args)
+            with self._lock:
+                self._refreshes += 1
+        except Exception as e:
+            with self._lock:
+                self._errors += 1
+            print(f"Error refreshing {key}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'pending': len(self._pending),
+                'refreshes': self._refreshes,
+                'skipped': self._skipped,
+                'errors': self._errors,
+            }
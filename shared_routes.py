@@ -0,0 +1,254 @@
+"""
+Routes and response builders shared by every API server
+Readiness, /metrics and the debug endpoints come from one blueprint that the
+Flask servers and the Quart server both register; the history helpers build
+the same responses for either framework from its Response class
+"""
+
+import json
+from itertools import islice
+from typing import Callable, Dict
+
+import arrow_format
+import diagnostics
+import metrics
+from conditional import frame_digest, is_not_modified, make_etag, not_modified, set_validators
+from fast_json import dumps, encode_frame, envelope
+from history_pages import PageError, next_cursor, parse_page_args
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+# --------------------------------------------------------------------------------
+# RESPONSES
+# --------------------------------------------------------------------------------
+
+def json_response(response_class, payload: Dict, status: int = 200):
+    """JSON response for a Flask or Quart Response class"""
+    return response_class(dumps(payload), status=status, mimetype=arrow_format.JSON_MIMETYPE)
+
+
+def error_response(response_class, message: str, status: int):
+    return json_response(response_class, {'success': False, 'error': message}, status)
+
+
+def vary_on_accept(request, response):
+    """History and market bodies depend on Accept (JSON, Arrow or Parquet)"""
+    if request.path.startswith('/api/market/') or request.path.endswith('/history'):
+        response.vary.add('Accept')
+    return response
+
+
+# --------------------------------------------------------------------------------
+# HISTORY
+# --------------------------------------------------------------------------------
+
+def history_etag(request, history, *parts) -> str:
+    """
+    ETag for a history body, computed from the rows actually returned
+
+    Rows may come from a TTL cache, a stale entry being refreshed or the
+    store, none of which move with the snapshot - so the validator is a hash
+    of the rows themselves (plus anything else that shapes the body)
+    """
+    mimetype = arrow_format.negotiate(request.accept_mimetypes)
+    # A DataFrame's repr is truncated - hash its values; make_etag hashes the repr of row lists
+    rows = history if isinstance(history, list) else frame_digest(history)
+    return make_etag('history', request.full_path, mimetype, *parts, rows)
+
+
+def history_response(response_class, request, history, stale: bool, **fields):
+    """
+    JSON, Arrow or Parquet body for ?days= history, or a 304 if the client has it
+
+    Args:
+        history: Rows as a list of dicts (pymssql fetchers) or a DataFrame
+        stale: Rows came from an expired cache entry being refreshed
+        fields: Extra envelope keys such as source
+    """
+    etag = history_etag(request, history, stale)
+    if is_not_modified(request, etag):
+        # Still saves encoding and sending the body
+        return not_modified(response_class, etag)
+
+    frame = not isinstance(history, list)
+    mimetype = arrow_format.negotiate(request.accept_mimetypes)
+    if mimetype != arrow_format.JSON_MIMETYPE:
+        # Binary bodies have no envelope - staleness is reported in a header
+        data = (arrow_format.encode_frame(history, mimetype) if frame
+                else arrow_format.encode_records(history, mimetype))
+        response = response_class(data, mimetype=mimetype, headers={'X-Stale': 'true' if stale else 'false'})
+        return set_validators(response, etag)
+
+    data = encode_frame(history) if frame else dumps(history)
+    body = envelope(data, count=len(history), **fields, stale=stale)
+    return set_validators(response_class(body, mimetype=arrow_format.JSON_MIMETYPE), etag)
+
+
+def history_page(response_class, request, symbol: str, fetch_page: Callable):
+    """
+    One keyset page of history for ?start=&end=&limit=, continued with ?cursor=
+    (or a 304 if the client has it)
+
+    Args:
+        fetch_page: The fetcher's get_history_page
+    """
+    try:
+        ticker, start, end, after, limit = parse_page_args(symbol, request.args)
+    except PageError as e:
+        return error_response(response_class, str(e), 400)
+
+    rows, more = fetch_page(ticker, start, end, after=after, limit=limit)
+
+    if not rows and after is None:
+        return error_response(response_class, f'No historical data found for {symbol} between {start} and {end}', 404)
+
+    cursor = next_cursor(ticker, start, end, rows[-1]['trade_date'] if more else None)
+
+    etag = history_etag(request, rows, cursor)
+    if is_not_modified(request, etag):
+        return not_modified(response_class, etag)
+
+    mimetype = arrow_format.negotiate(request.accept_mimetypes)
+    if mimetype != arrow_format.JSON_MIMETYPE:
+        # Binary bodies carry only the rows - the cursor travels in a header
+        headers = {'X-Next-Cursor': cursor} if cursor else None
+        response = response_class(arrow_format.encode_records(rows, mimetype), mimetype=mimetype, headers=headers)
+        return set_validators(response, etag)
+
+    body = envelope(dumps(rows), count=len(rows), next_cursor=cursor, source='real')
+    return set_validators(response_class(body, mimetype=arrow_format.JSON_MIMETYPE), etag)
+
+
+def _ndjson(rows) -> str:
+    return ''.join(json.dumps(row) + '\n' for row in rows)
+
+
+def stream_history(response_class, symbol: str, rows):
+    """NDJSON response fed row by row from a history generator (404 if it is empty)"""
+    first = next(rows, None)
+    if first is None:
+        rows.close()
+        return error_response(response_class, f'No historical data found for {symbol}', 404)
+
+    def generate():
+        try:
+            yield _ndjson([first])
+            for row in rows:
+                yield _ndjson([row])
+        finally:
+            # Hands the connection back if the client disconnects mid-stream
+            rows.close()
+
+    return response_class(generate(), mimetype=NDJSON_MIMETYPE)
+
+
+async def stream_history_async(response_class, symbol: str, rows, run_db: Callable, batch_size: int):
+    """NDJSON response fed from a history generator, one batch per executor hop (Quart)"""
+    def next_batch():
+        return list(islice(rows, batch_size))
+
+    batch = await run_db(next_batch)
+    if not batch:
+        await run_db(rows.close)
+        return error_response(response_class, f'No historical data found for {symbol}', 404)
+
+    async def generate():
+        nonlocal batch
+        try:
+            while batch:
+                yield _ndjson(batch).encode()
+                batch = await run_db(next_batch)
+        finally:
+            # Hands the connection back if the client disconnects mid-stream
+            await run_db(rows.close)
+
+    return response_class(generate(), mimetype=NDJSON_MIMETYPE)
+
+
+# --------------------------------------------------------------------------------
+# OPERATIONS BLUEPRINT
+# --------------------------------------------------------------------------------
+
+def blueprint(web, warmup, caches: Callable[[], Dict]):
+    """
+    /api/ready, /metrics and /api/debug/* for one server
+
+    The views are plain functions: Flask calls them directly, Quart runs them
+    on its default executor, so the blocking profiler never holds the event loop
+
+    Args:
+        web: The flask or quart module (Blueprint, Response and request come from it)
+        warmup: The server's WarmUp
+        caches: Returns the server's cache sizes (see diagnostics.cache_sizes)
+    """
+    request, Response = web.request, web.Response
+    bp = web.Blueprint('operations', __name__)
+
+    @bp.route('/api/ready', methods=['GET'])
+    def readiness_check():
+        """200 once the warm-up's required steps have passed, 503 until then (for health checks)"""
+        return json_response(Response, warmup.stats(), 200 if warmup.ready else 503)
+
+    @bp.route('/metrics', methods=['GET'])
+    def prometheus_metrics():
+        """Prometheus scrape endpoint (text exposition format)"""
+        return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+    @bp.route('/api/debug/profile', methods=['GET'])
+    def debug_profile():
+        """
+        Sample every thread for ?seconds=N (default 10) and return collapsed stacks
+
+        Example: curl -H "X-Debug-Token: $DEBUG_TOKEN" ".../api/debug/profile?seconds=30" | flamegraph.pl > profile.svg
+        """
+        denied = diagnostics.check_access(request.headers)
+        if denied:
+            return error_response(Response, denied[1], denied[0])
+
+        try:
+            seconds = diagnostics.parse_seconds(request.args.get('seconds'))
+            stacks, summary = diagnostics.profiler.profile(seconds)
+        except ValueError as e:
+            return error_response(Response, str(e), 400)
+        except diagnostics.ProfilerBusy as e:
+            return error_response(Response, str(e), 409)
+
+        return Response(stacks, mimetype='text/plain', headers={
+            'X-Profile-Samples': str(summary['samples']),
+            'X-Profile-Seconds': str(summary['seconds'])
+        })
+
+    @bp.route('/api/debug/memory', methods=['GET'])
+    def debug_memory():
+        """
+        Top allocators from tracemalloc, growth since the last call, and cache sizes
+        The first call starts tracing. Options: ?top=20&group=lineno|filename|traceback&stop=1
+        """
+        denied = diagnostics.check_access(request.headers)
+        if denied:
+            return error_response(Response, denied[1], denied[0])
+
+        try:
+            report = diagnostics.memory_report(
+                top=int(request.args.get('top', 20)),
+                group=request.args.get('group', 'lineno'),
+                stop=request.args.get('stop') == '1',
+                caches=caches
+            )
+        except ValueError as e:
+            return error_response(Response, str(e), 400)
+
+        return json_response(Response, {'success': True, **report})
+
+    if web.__name__ == 'quart':
+        # Runs on every response - not worth an executor hop
+        @bp.after_app_request
+        async def vary(response):
+            return vary_on_accept(request, response)
+    else:
+        @bp.after_app_request
+        def vary(response):
+            return vary_on_accept(request, response)
+
+    return bp
@@ -0,0 +1,133 @@
+"""
+Single-flight call coalescing
+Concurrent calls with the same key wait for one in-flight execution and share
+its result (or exception), so a burst of identical requests costs one query
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+# Keys with their own statistics before the least recently used are dropped
+DEFAULT_STATS_KEYS = int(os.getenv('SINGLE_FLIGHT_STATS_KEYS', 500))
+
+
+class _Call:
+    """One in-flight execution that followers wait on"""
+
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Thread-safe call coalescer
+
+    Results are shared between all callers of one flight, so callers must
+    treat them as read-only (the quote cache already hands out shared dicts).
+    """
+
+    def __init__(self, stats_keys: Optional[int] = None):
+        """
+        Args:
+            stats_keys: Keys tracked individually in key_stats() (default SINGLE_FLIGHT_STATS_KEYS)
+        """
+        self.stats_keys = DEFAULT_STATS_KEYS if stats_keys is None else stats_keys
+
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> _Call in flight
+        self._keys = OrderedDict()  # key -> counters, least recently used first
+
+        self._executions = 0
+        self._shared = 0
+        self._errors = 0
+
+    def do(self, key: Hashable, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Run func(*args, **kwargs) unless a call with the same key is in flight,
+        in which case wait for it and return its result (or raise its exception)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+            counters = self._counters(key)
+            counters['calls'] += 1
+
+        if not leader:
+            call.done.wait()
+            with self._lock:
+                self._shared += 1
+                counters['shared'] += 1
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        start = time.monotonic()
+        try:
+            call.result = func(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            elapsed = time.monotonic() - start
+            with self._lock:
+                del self._calls[key]
+                self._executions += 1
+                counters['executions'] += 1
+                counters['max_waiters'] = max(counters['max_waiters'], call.waiters)
+                counters['time'] += elapsed
+                if call.error is not None:
+                    self._errors += 1
+                    counters['errors'] += 1
+            call.done.set()
+
+        return call.result
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self) -> Dict:
+        """Totals across all keys"""
+        with self._lock:
+            calls = self._executions + self._shared
+            return {
+                'in_flight': len(self._calls),
+                'executions': self._executions,
+                'shared': self._shared,
+                'errors': self._errors,
+                'coalesce_rate': round(self._shared / calls, 4) if calls else 0.0,
+            }
+
+    def key_stats(self, top: int = 20) -> Dict[str, Dict]:
+        """Per-key counters for the keys with the most shared calls"""
+        with self._lock:
+            items = sorted(self._keys.items(), key=lambda kv: kv[1]['shared'], reverse=True)[:top]
+            return {
+                repr(key): dict(counters, time=round(counters['time'], 3))
+                for key, counters in items
+            }
+
+    def _counters(self, key: Hashable) -> Dict:
+        """Counters for key, creating them (and evicting old keys) as needed - lock held"""
+        counters = self._keys.get(key)
+        if counters is None:
+            counters = {'calls': 0, 'executions': 0, 'shared': 0, 'errors': 0, 'max_waiters': 0, 'time': 0.0}
+            self._keys[key] = counters
+            while len(self._keys) > self.stats_keys:
+                self._keys.popitem(last=False)
+        else:
+            self._keys.move_to_end(key)
+        return counters
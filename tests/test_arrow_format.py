@@ -0,0 +1,130 @@
+"""Accept negotiation and Arrow / Parquet round trips against the JSON body"""
+
+import io
+import json
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+import arrow_format
+from arrow_format import ARROW_MIMETYPE, JSON_MIMETYPE, PARQUET_MIMETYPE
+from fast_json import dumps, encode_frame
+
+BINARY = [ARROW_MIMETYPE, PARQUET_MIMETYPE]
+
+
+def accept(header):
+    return parse_accept_header(header, MIMEAccept)
+
+
+def decode(body, mimetype) -> pd.DataFrame:
+    if mimetype == ARROW_MIMETYPE:
+        return pa.ipc.open_stream(body).read_pandas()
+    return pd.read_parquet(io.BytesIO(body))
+
+
+# --------------------------------------------------------------------------------
+# NEGOTIATION
+# --------------------------------------------------------------------------------
+
+@pytest.mark.parametrize('header, expected', [
+    (None, JSON_MIMETYPE),
+    ('*/*', JSON_MIMETYPE),  # Browsers and curl keep getting JSON
+    ('text/html,application/xhtml+xml,*/*;q=0.8', JSON_MIMETYPE),
+    (ARROW_MIMETYPE, ARROW_MIMETYPE),
+    (PARQUET_MIMETYPE, PARQUET_MIMETYPE),
+    (f'{JSON_MIMETYPE};q=0.5, {ARROW_MIMETYPE}', ARROW_MIMETYPE),
+    (f'{JSON_MIMETYPE}, {ARROW_MIMETYPE};q=0.5', JSON_MIMETYPE),
+    (f'{JSON_MIMETYPE}, {PARQUET_MIMETYPE}', PARQUET_MIMETYPE),  # A tie goes to the binary format
+    (f'{ARROW_MIMETYPE};q=0.4, {PARQUET_MIMETYPE};q=0.9', PARQUET_MIMETYPE),
+    (f'{ARROW_MIMETYPE};q=0', JSON_MIMETYPE),
+])
+def test_negotiate(header, expected):
+    assert arrow_format.negotiate(accept(header)) == expected
+
+
+def test_negotiate_falls_back_to_json_without_pyarrow(monkeypatch):
+    monkeypatch.setattr(arrow_format, 'pa', None)
+    assert not arrow_format.available()
+    assert arrow_format.negotiate(accept(ARROW_MIMETYPE)) == JSON_MIMETYPE
+
+
+# --------------------------------------------------------------------------------
+# ROUND TRIPS
+# --------------------------------------------------------------------------------
+
+@pytest.fixture
+def history():
+    return pd.DataFrame({
+        'ticker': ['VNM', 'VNM', 'VNM'],
+        'trade_date': [date(2024, 6, 26), date(2024, 6, 27), date(2024, 6, 28)],
+        'close_price': [60.5, np.nan, 60.2],
+        'volume': np.array([1_200_000, 0, 900], dtype=np.int64),
+    })
+
+
+@pytest.mark.parametrize('mimetype', BINARY)
+def test_frame_round_trip_matches_the_json_body(history, mimetype):
+    binary = decode(arrow_format.encode_frame(history, mimetype), mimetype)
+    from_json = pd.DataFrame(json.loads(encode_frame(history)))
+
+    assert list(binary.columns) == list(from_json.columns) == list(history.columns)
+    numbers = ['close_price', 'volume']
+    assert list(binary[numbers].dtypes) == list(from_json[numbers].dtypes) == [np.float64, np.int64]
+    assert binary['ticker'].dtype == from_json['ticker'].dtype
+
+    # Dates arrive as dates (JSON has them as YYYY-MM-DD text), missing prices as NaN
+    assert [d.isoformat() for d in binary['trade_date']] == from_json['trade_date'].tolist()
+    pd.testing.assert_frame_equal(binary.drop(columns='trade_date'), from_json.drop(columns='trade_date'))
+
+
+@pytest.mark.parametrize('mimetype', BINARY)
+def test_date_column_is_date32(history, mimetype):
+    body = arrow_format.encode_frame(history, mimetype)
+    if mimetype == ARROW_MIMETYPE:
+        table = pa.ipc.open_stream(body).read_all()
+    else:
+        table = pq.read_table(io.BytesIO(body))
+    assert table.schema.field('trade_date').type == pa.date32()
+
+
+@pytest.mark.parametrize('mimetype', BINARY)
+def test_records_round_trip_matches_the_json_body(mimetype):
+    # Row dicts as the pymssql fetcher returns them - dates already as text, a missing volume
+    records = [
+        {'ticker': 'VNM', 'trade_date': '2024-06-27', 'close_price': 61.0, 'volume': 2000},
+        {'ticker': 'VNM', 'trade_date': '2024-06-28', 'close_price': 60.2, 'volume': None},
+    ]
+    binary = decode(arrow_format.encode_records(records, mimetype), mimetype)
+    from_json = pd.DataFrame(json.loads(dumps(records)))
+
+    assert list(binary.columns) == list(from_json.columns)
+    assert [d.isoformat() for d in binary['trade_date']] == from_json['trade_date'].tolist()
+    pd.testing.assert_frame_equal(binary.drop(columns='trade_date'), from_json.drop(columns='trade_date'))
+
+
+def test_empty_records():
+    body = arrow_format.encode_records([], ARROW_MIMETYPE)
+    assert pa.ipc.open_stream(body).read_all().num_rows == 0
+
+
+@pytest.mark.parametrize('mimetype', BINARY)
+def test_columns_round_trip(mimetype):
+    columns = {
+        'ticker': np.array(['ACB', 'VNM'], dtype=object),
+        'price': np.array([25.0, 60.5]),
+        'volume': np.array([10, 20], dtype=np.int64),
+        'trade_date': np.array(['2024-06-28', None], dtype=object),
+    }
+    frame = decode(arrow_format.encode_columns(columns, mimetype), mimetype)
+
+    assert frame['ticker'].tolist() == ['ACB', 'VNM']
+    assert frame['price'].tolist() == [25.0, 60.5]
+    assert frame['volume'].dtype == np.int64
+    assert frame['trade_date'].iloc[0] == date(2024, 6, 28) and frame['trade_date'].iloc[1] is None
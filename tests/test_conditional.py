@@ -0,0 +1,118 @@
+"""Conditional GET helpers: If-None-Match, If-Modified-Since, 304 headers and frame digests"""
+
+import pandas as pd
+import pytest
+from flask import Flask, Response, request
+
+from conditional import frame_digest, is_not_modified, make_etag, not_modified, set_validators
+
+app = Flask(__name__)
+
+ETAG = make_etag('quote', {'ticker': 'VNM', 'price': 60.5})
+MODIFIED = 1719561600.7  # 2024-06-28 08:00:00.7 UTC
+MODIFIED_HTTP = 'Fri, 28 Jun 2024 08:00:00 GMT'
+
+
+def check(headers, etag=ETAG, modified=MODIFIED):
+    with app.test_request_context(headers=headers):
+        return is_not_modified(request, etag, modified)
+
+
+# --------------------------------------------------------------------------------
+# IF-NONE-MATCH
+# --------------------------------------------------------------------------------
+
+def test_make_etag_is_stable_and_part_sensitive():
+    assert make_etag('quote', 1) == make_etag('quote', 1)
+    assert make_etag('quote', 1) != make_etag('quote', 2)
+    assert len(ETAG) == 24
+
+
+@pytest.mark.parametrize('header, expected', [
+    (f'"{ETAG}"', True),
+    (f'"other", "{ETAG}"', True),  # Any tag in the list
+    ('"other", "another"', False),
+    ('*', True),
+    (f'W/"{ETAG}"', True),  # Weak comparison
+    ('', False),
+])
+def test_if_none_match(header, expected):
+    assert check({'If-None-Match': header} if header else {}) is expected
+
+
+def test_if_none_match_wins_over_if_modified_since():
+    # A mismatching tag means modified even if the date says otherwise
+    assert not check({'If-None-Match': '"other"', 'If-Modified-Since': MODIFIED_HTTP})
+    assert check({'If-None-Match': f'"{ETAG}"', 'If-Modified-Since': 'Mon, 01 Jan 2001 00:00:00 GMT'})
+
+
+# --------------------------------------------------------------------------------
+# IF-MODIFIED-SINCE
+# --------------------------------------------------------------------------------
+
+@pytest.mark.parametrize('header, expected', [
+    (MODIFIED_HTTP, True),  # Sub-second part of MODIFIED is ignored
+    ('Fri, 28 Jun 2024 09:00:00 GMT', True),
+    ('Fri, 28 Jun 2024 07:59:59 GMT', False),
+    ('not a date', False),
+])
+def test_if_modified_since(header, expected):
+    assert check({'If-Modified-Since': header}) is expected
+
+
+def test_if_modified_since_needs_a_known_modified_time():
+    assert not check({'If-Modified-Since': MODIFIED_HTTP}, modified=None)
+
+
+# --------------------------------------------------------------------------------
+# RESPONSES
+# --------------------------------------------------------------------------------
+
+def test_not_modified_carries_the_validators():
+    response = not_modified(Response, ETAG, MODIFIED)
+
+    assert response.status_code == 304
+    assert response.get_data() == b''
+    assert response.headers['ETag'] == f'"{ETAG}"'
+    assert response.headers['Last-Modified'] == MODIFIED_HTTP
+    assert response.headers['Cache-Control'] == 'no-cache'
+
+
+def test_set_validators_without_modified_or_etag():
+    response = set_validators(Response('body'), ETAG)
+    assert response.headers['ETag'] == f'"{ETAG}"'
+    assert 'Last-Modified' not in response.headers
+
+    untouched = set_validators(Response('body'), None, MODIFIED)
+    assert 'ETag' not in untouched.headers and 'Cache-Control' not in untouched.headers
+
+
+# --------------------------------------------------------------------------------
+# FRAME DIGEST
+# --------------------------------------------------------------------------------
+
+@pytest.fixture
+def frame():
+    return pd.DataFrame({
+        'ticker': ['ACB', 'VNM', 'FPT'],
+        'close_price': [25.0, 60.5, 100.0],
+        'volume': [1000, 2000, 3000],
+    })
+
+
+def test_frame_digest_follows_the_values(frame):
+    assert frame_digest(frame) == frame_digest(frame.copy())
+
+    changed = frame.copy()
+    changed.loc[1, 'close_price'] = 60.6
+    assert frame_digest(changed) != frame_digest(frame)
+
+
+def test_frame_digest_is_order_sensitive(frame):
+    reordered = frame.iloc[[1, 0, 2]].reset_index(drop=True)
+    assert frame_digest(reordered) != frame_digest(frame)
+
+
+def test_frame_digest_ignores_the_index_but_not_column_names(frame):
+    assert frame_digest(frame.set_axis([10, 11, 12])) == frame_digest(frame)
+    assert frame_digest(frame.rename(columns={'volume': 'qty'})) != frame_digest(frame)
@@ -0,0 +1,131 @@
+"""ConnectionPool: borrowing, limits and rotate()"""
+
+import threading
+
+import pytest
+
+from connection_pool import ConnectionPool, PoolTimeout
+
+
+class FakeConnection:
+    def __init__(self, number):
+        self.number = number
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class Factory:
+    def __init__(self):
+        self.opened = []
+
+    def __call__(self):
+        conn = FakeConnection(len(self.opened))
+        self.opened.append(conn)
+        return conn
+
+
+def make_pool(factory, **kwargs):
+    kwargs.setdefault('validate', lambda conn: not conn.closed)
+    return ConnectionPool(factory, **kwargs)
+
+
+def test_connections_are_reused():
+    factory = Factory()
+    pool = make_pool(factory, min_size=0, max_size=2)
+
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+
+    assert first is second
+    assert len(factory.opened) == 1
+
+
+def test_max_size_is_enforced():
+    pool = make_pool(Factory(), min_size=0, max_size=1, timeout=0.05)
+    conn = pool.acquire()
+
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+
+    pool.release(conn)
+    assert pool.acquire() is conn
+    assert pool.stats()['timeouts'] == 1
+
+
+def test_failed_factory_frees_the_slot():
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError('login failed')
+        return FakeConnection(len(calls))
+
+    pool = make_pool(flaky, min_size=0, max_size=1, timeout=0.05)
+    with pytest.raises(RuntimeError):
+        pool.acquire()
+    assert pool.acquire() is not None
+    assert pool.stats()['size'] == 1
+
+
+def test_rotate_closes_idle_connections_and_prefills():
+    factory = Factory()
+    pool = make_pool(factory, min_size=2, max_size=4)
+    pool.prefill()
+    old = list(factory.opened)
+
+    closed = pool.rotate()
+
+    assert closed == 2
+    assert all(conn.closed for conn in old)
+    stats = pool.stats()
+    assert (stats['size'], stats['idle'], stats['generation'], stats['rotations']) == (2, 2, 1, 1)
+    assert {id(conn) for conn in factory.opened[2:]} == {id(pool.acquire()), id(pool.acquire())}
+
+
+def test_rotate_retires_borrowed_connections_when_returned():
+    factory = Factory()
+    pool = make_pool(factory, min_size=0, max_size=2)
+    borrowed = pool.acquire()
+
+    pool.rotate()
+    assert not borrowed.closed  # In-flight queries are not interrupted
+
+    pool.release(borrowed)
+    assert borrowed.closed
+    assert pool.stats()['retired'] == 1
+    assert pool.stats()['size'] == 0
+    assert pool.acquire() is not borrowed
+
+
+def test_connection_opened_during_rotate_is_retired():
+    rotated = threading.Event()
+    pool = None
+
+    def slow_factory():
+        # The credentials change while this connection is being opened
+        if not rotated.is_set():
+            rotated.set()
+            pool.rotate()
+        return FakeConnection(0)
+
+    pool = make_pool(slow_factory, min_size=0, max_size=2)
+    conn = pool.acquire()
+    pool.release(conn)
+
+    assert conn.closed
+    assert pool.stats()['idle'] == 0
+
+
+def test_closed_pool_refuses_and_rotate_is_a_no_op():
+    pool = make_pool(Factory(), min_size=1, max_size=1)
+    pool.prefill()
+    pool.close()
+
+    assert pool.rotate() == 0
+    with pytest.raises(RuntimeError):
+        pool.acquire()
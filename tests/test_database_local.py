@@ -0,0 +1,62 @@
+"""Local SQLite stand-in: pymssql and pyodbc query styles, rows and the stock_prices view"""
+
+from datetime import date
+
+import pytest
+
+import database_connection_local as local
+
+
+@pytest.fixture(scope='module')
+def conn(tmp_path_factory):
+    path = tmp_path_factory.mktemp('db') / 'market_data.db'
+    local.generate(str(path), tickers=5, years=1, end=date(2024, 6, 28))
+    conn = local.get_connection(str(path))
+    yield conn
+    conn.close()
+
+
+def test_translate_moves_top_parameter_to_limit():
+    for placeholder in ('%s', '?'):
+        sql, top_param = local.translate(f"SELECT TOP ({placeholder}) a FROM t WHERE b = {placeholder}")
+        assert top_param
+        assert sql.endswith('LIMIT ?')
+        assert '%s' not in sql
+
+    sql, top_param = local.translate("SELECT TOP 1 a FROM t")
+    assert not top_param
+    assert sql.endswith('LIMIT 1')
+
+
+def test_pymssql_dict_rows(conn):
+    cursor = conn.cursor(as_dict=True)
+    cursor.execute("SELECT TOP (%s) TICKER, TRADE_DATE FROM Market_Data WHERE TICKER = %s "
+                   "ORDER BY TRADE_DATE DESC", (2, 'VNM'))
+    rows = cursor.fetchall()
+    assert [row['TRADE_DATE'] for row in rows] == [date(2024, 6, 28), date(2024, 6, 27)]
+
+
+def test_pyodbc_rows_read_by_attribute_and_position(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT TOP (?) ticker, trade_date, close_price FROM stock_prices "
+                   "WHERE ticker = ? AND trade_date <= ? ORDER BY trade_date DESC", (1, 'VNM', date(2024, 6, 28)))
+    row = cursor.fetchone()
+    assert row.ticker == row[0] == 'VNM'
+    assert row.trade_date == date(2024, 6, 28)
+
+    # Unnamed columns still unpack like pyodbc rows
+    cursor.execute("SELECT MIN(TRADE_DATE), MAX(TRADE_DATE) FROM Market_Data")
+    first, last = cursor.fetchone()
+    assert first < last == date(2024, 6, 28)
+
+
+def test_stock_prices_view_maps_markets_and_changes(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT ticker, market, open_price, close_price, change_amount FROM stock_prices "
+                   "WHERE ticker = ? AND trade_date = ?", ('VNM', date(2024, 6, 28)))
+    row = cursor.fetchone()
+    assert row.market == 'HOSE'
+    assert row.change_amount == pytest.approx(row.close_price - row.open_price)
+
+    cursor.execute("SELECT DISTINCT market FROM stock_prices")
+    assert {market for market, in cursor.fetchall()} <= {'HOSE', 'HNX', 'UPCOM'}
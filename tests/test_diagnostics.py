@@ -0,0 +1,121 @@
+"""Debug endpoint access gate, ?seconds= parsing and the profiler"""
+
+import threading
+
+import flask
+import pytest
+
+import diagnostics
+import shared_routes
+from warmup import WarmUp
+
+TOKEN = 's3cret-token'
+
+
+@pytest.fixture
+def client():
+    app = flask.Flask(__name__)
+    app.register_blueprint(shared_routes.blueprint(flask, WarmUp(enabled=False), lambda: {'quote': {'entries': 0}}))
+    return app.test_client()
+
+
+@pytest.fixture
+def token(monkeypatch):
+    monkeypatch.setattr(diagnostics, 'DEBUG_TOKEN', TOKEN)
+    return TOKEN
+
+
+# --------------------------------------------------------------------------------
+# ACCESS
+# --------------------------------------------------------------------------------
+
+def test_endpoints_are_hidden_without_a_token(client, monkeypatch):
+    monkeypatch.setattr(diagnostics, 'DEBUG_TOKEN', None)
+    for path in ('/api/debug/profile', '/api/debug/memory'):
+        response = client.get(path, headers={'X-Debug-Token': 'anything'})
+        assert response.status_code == 404
+
+
+@pytest.mark.parametrize('headers', [
+    {},
+    {'X-Debug-Token': 'wrong'},
+    {'Authorization': 'Bearer wrong'},
+    {'Authorization': TOKEN},  # Not a bearer token
+    {'X-Debug-Token': ''},
+])
+def test_missing_or_wrong_token_is_forbidden(client, token, headers):
+    for path in ('/api/debug/profile', '/api/debug/memory'):
+        response = client.get(path, headers=headers)
+        assert response.status_code == 403
+        assert response.get_json()['error'] == 'Invalid debug token'
+
+
+@pytest.mark.parametrize('headers', [
+    {'X-Debug-Token': TOKEN},
+    {'Authorization': f'Bearer {TOKEN}'},
+])
+def test_right_token_is_allowed(client, token, headers):
+    response = client.get('/api/debug/memory?stop=1', headers=headers)
+    assert response.status_code == 200
+    assert response.get_json()['caches'] == {'quote': {'entries': 0}}
+
+    response = client.get('/api/debug/profile?seconds=0.05', headers=headers)
+    assert response.status_code == 200
+    assert int(response.headers['X-Profile-Samples']) > 0
+
+
+def test_check_access_results(token):
+    assert diagnostics.check_access({'X-Debug-Token': TOKEN}) is None
+    assert diagnostics.check_access({'X-Debug-Token': 'nope'}) == (403, 'Invalid debug token')
+
+
+# --------------------------------------------------------------------------------
+# ?seconds=
+# --------------------------------------------------------------------------------
+
+def test_seconds_are_clamped_to_the_maximum(monkeypatch):
+    monkeypatch.setattr(diagnostics, 'PROFILE_MAX_SECONDS', 60)
+    assert diagnostics.parse_seconds('3600') == 60
+    assert diagnostics.parse_seconds('2.5') == 2.5
+    assert diagnostics.parse_seconds(None) == 10
+    assert diagnostics.parse_seconds('') == 10
+
+
+@pytest.mark.parametrize('value', ['0', '-5', 'abc'])
+def test_bad_seconds_are_rejected(client, token, value):
+    with pytest.raises(ValueError):
+        diagnostics.parse_seconds(value)
+    response = client.get(f'/api/debug/profile?seconds={value}', headers={'X-Debug-Token': TOKEN})
+    assert response.status_code == 400
+
+
+# --------------------------------------------------------------------------------
+# PROFILER
+# --------------------------------------------------------------------------------
+
+def test_profile_collects_collapsed_stacks():
+    stop = threading.Event()
+    worker = threading.Thread(target=stop.wait, name='db_3')
+    worker.start()
+    try:
+        stacks, summary = diagnostics.SamplingProfiler(interval_ms=5).profile(0.05)
+    finally:
+        stop.set()
+        worker.join()
+
+    assert summary['samples'] > 0
+    # Numbered thread names share one root; each line ends in its sample count
+    lines = [line for line in stacks.splitlines() if line.startswith('db;')]
+    assert lines and all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+
+
+def test_second_profile_is_refused_while_one_runs(client, token):
+    profiler = diagnostics.profiler
+    profiler._lock.acquire()
+    try:
+        with pytest.raises(diagnostics.ProfilerBusy):
+            profiler.profile(0.01)
+        response = client.get('/api/debug/profile?seconds=0.01', headers={'X-Debug-Token': TOKEN})
+        assert response.status_code == 409
+    finally:
+        profiler._lock.release()
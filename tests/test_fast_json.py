@@ -0,0 +1,137 @@
+"""fast_json against the to_dict('records') + strftime + jsonify path it replaced"""
+
+import json
+import math
+from datetime import date, datetime
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+import pytest
+from flask import Flask, jsonify
+
+from fast_json import dumps, encode_column, encode_columns, encode_frame, envelope
+
+app = Flask(__name__)
+
+
+def legacy_body(frame, **fields) -> dict:
+    """The old route body: records, trade_date through strftime, then jsonify"""
+    data = frame.to_dict('records')
+    for item in data:
+        if 'trade_date' in item and item['trade_date']:
+            item['trade_date'] = item['trade_date'].strftime('%Y-%m-%d')
+    with app.app_context():
+        return json.loads(jsonify({'success': True, 'data': data, **fields}).get_data())
+
+
+def new_body(frame, **fields) -> dict:
+    # Strict parse - the new encoder must never emit NaN or Infinity
+    return json.loads(envelope(encode_frame(frame), **fields), parse_constant=pytest.fail)
+
+
+@pytest.fixture
+def history():
+    return pd.DataFrame({
+        'ticker': ['VNM', 'VNM', 'VNM'],
+        'trade_date': [date(2024, 6, 26), date(2024, 6, 27), date(2024, 6, 28)],
+        'open_price': [60.1, 60.5, 61.0],
+        'close_price': [60.5, 61.0, 60.2],
+        'volume': np.array([1_200_000, 0, 9_876_543_210], dtype=np.int64),
+    })
+
+
+# --------------------------------------------------------------------------------
+# SAME DOCUMENT AS BEFORE
+# --------------------------------------------------------------------------------
+
+def test_history_frame_matches_the_old_body(history):
+    assert new_body(history, count=3) == legacy_body(history, count=3)
+
+
+def test_datetime64_trade_dates_match_the_old_body(history):
+    history['trade_date'] = pd.to_datetime(history['trade_date'])
+    assert new_body(history) == legacy_body(history)
+    assert new_body(history)['data'][0]['trade_date'] == '2024-06-26'
+
+
+def test_volumes_stay_integers(history):
+    volumes = [row['volume'] for row in new_body(history)['data']]
+    assert volumes == [1_200_000, 0, 9_876_543_210]
+    assert all(type(v) is int for v in volumes)
+
+
+def test_key_order_follows_the_columns(history):
+    row = json.loads(encode_frame(history))[0]
+    assert list(row) == list(history.columns)
+
+
+def test_empty_frame():
+    assert encode_frame(pd.DataFrame(columns=['ticker', 'trade_date'])) == '[]'
+
+
+# --------------------------------------------------------------------------------
+# DELIBERATE DIFFERENCES
+# --------------------------------------------------------------------------------
+
+def test_missing_numbers_are_null_instead_of_nan(history):
+    history.loc[1, 'close_price'] = np.nan
+    history.loc[2, 'open_price'] = None
+
+    old = legacy_body(history)['data']
+    assert math.isnan(old[1]['close_price'])  # jsonify wrote NaN, which is not JSON
+
+    new = new_body(history)['data']
+    assert new[1]['close_price'] is None and new[2]['open_price'] is None
+    assert new[0] == old[0]
+
+
+def test_missing_trade_date_is_null(history):
+    history['trade_date'] = [date(2024, 6, 26), None, date(2024, 6, 28)]
+    assert new_body(history)['data'][1]['trade_date'] is None
+    assert new_body(history) == legacy_body(history)
+
+
+def test_other_datetime_columns_are_iso_dates_instead_of_http_dates(history):
+    history['listed_at'] = pd.to_datetime(['2010-01-04'] * 3)
+
+    assert legacy_body(history)['data'][0]['listed_at'] == 'Mon, 04 Jan 2010 00:00:00 GMT'
+    assert new_body(history)['data'][0]['listed_at'] == '2010-01-04'
+
+
+# --------------------------------------------------------------------------------
+# BUILDING BLOCKS
+# --------------------------------------------------------------------------------
+
+def test_encode_columns_writes_aliases_from_one_column():
+    columns = {'ticker': np.array(['ACB', 'VNM'], dtype=object), 'price': np.array([25.0, 60.5])}
+    fields = {'symbol': 'ticker', 'ticker': 'ticker', 'price': 'price', 'close_price': 'price'}
+
+    assert json.loads(encode_columns(columns, fields)) == [
+        {'symbol': 'ACB', 'ticker': 'ACB', 'price': 25.0, 'close_price': 25.0},
+        {'symbol': 'VNM', 'ticker': 'VNM', 'price': 60.5, 'close_price': 60.5},
+    ]
+
+
+@pytest.mark.parametrize('values, expected', [
+    (np.array([1.5, np.inf, np.nan]), ['1.5', 'null', 'null']),
+    (np.array([True, False]), ['true', 'false']),
+    (np.array(['2024-06-28', 'NaT'], dtype='datetime64[D]'), ['"2024-06-28"', 'null']),
+    (np.array(['Việt', 'a"b'], dtype=object), ['"Vi\\u1ec7t"', '"a\\"b"']),
+    (np.array([None, 'x'], dtype=object), ['null', '"x"']),
+])
+def test_encode_column(values, expected):
+    assert encode_column(values) == expected
+
+
+def test_dumps_fallbacks_match_flask():
+    value = {'price': Decimal('60.50'), 'day': date(2024, 6, 28), 'n': np.int64(3),
+             'at': datetime(2024, 6, 28, 9, 15)}
+    assert json.loads(dumps(value)) == {'price': '60.50', 'day': '2024-06-28', 'n': 3,
+                                        'at': '2024-06-28T09:15:00'}
+
+
+def test_envelope_puts_data_last():
+    body = envelope('[1,2]', count=2, source='real')
+    assert json.loads(body) == {'success': True, 'count': 2, 'source': 'real', 'data': [1, 2]}
+    assert body.endswith(b',"data":[1,2]}')
@@ -0,0 +1,163 @@
+"""HistoryCache: gap loading and merging, eviction, settled/recent split and expiry"""
+
+from datetime import date, timedelta
+
+import pandas as pd
+import pytest
+
+import history_cache
+from history_cache import HistoryCache
+
+DAY = timedelta(days=1)
+TODAY = date.today()
+SETTLED = TODAY - 10 * DAY  # Comfortably older than settle_days
+
+
+class Loader:
+    """One bar per calendar day, recording every (ticker, start, end) it is asked for"""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, ticker, start, end):
+        self.calls.append((ticker, start, end))
+        days = pd.date_range(start, end, freq='D')
+        return pd.DataFrame({'ticker': ticker, 'trade_date': days, 'close_price': range(len(days))})
+
+
+@pytest.fixture
+def loader():
+    return Loader()
+
+
+def make_cache(**kwargs):
+    kwargs.setdefault('settle_days', 2)
+    kwargs.setdefault('settled_ttl', 0)
+    return HistoryCache(**kwargs)
+
+
+def dates(frame):
+    return [ts.date() for ts in frame['trade_date']]
+
+
+def test_only_missing_gaps_are_loaded_and_merged(loader):
+    cache = make_cache()
+    a, b = SETTLED - 40 * DAY, SETTLED - 20 * DAY
+
+    cache.get_range('VNM', a, a + 5 * DAY, loader)
+    cache.get_range('VNM', b, b + 5 * DAY, loader)
+    frame = cache.get_range('VNM', a, b + 5 * DAY, loader)
+
+    assert loader.calls[-1] == ('VNM', a + 6 * DAY, b - DAY)
+    assert dates(frame) == [a + n * DAY for n in range(26)]
+    stats = cache.stats()
+    assert stats['segments'] == 1
+    assert stats['bars'] == 26
+    assert (stats['misses'], stats['partial_hits']) == (2, 1)
+
+    cache.get_range('VNM', a + DAY, b, loader)
+    assert len(loader.calls) == 3
+    assert cache.stats()['hits'] == 1
+
+
+def test_missing_reports_interior_and_edge_gaps(loader):
+    cache = make_cache()
+    start = SETTLED - 30 * DAY
+    cache.get_range('VNM', start + 10 * DAY, start + 19 * DAY, loader)
+
+    assert cache.missing('VNM', start, start + 29 * DAY) == [
+        (start, start + 9 * DAY), (start + 20 * DAY, start + 29 * DAY)]
+    assert cache.missing('VNM', start + 12 * DAY, start + 15 * DAY) == []
+
+
+def test_least_recently_used_ticker_is_evicted(loader):
+    cache = make_cache(max_bars=25)
+    start = SETTLED - 20 * DAY
+
+    cache.get_range('VNM', start, start + 9 * DAY, loader)
+    cache.get_range('FPT', start, start + 9 * DAY, loader)
+    cache.get_range('VNM', start, start + 9 * DAY, loader)  # VNM is now most recent
+    cache.get_range('HPG', start, start + 9 * DAY, loader)
+
+    stats = cache.stats()
+    assert stats['evictions'] == 1
+    assert stats['bars'] == 20
+    assert cache.missing('FPT', start, start + 9 * DAY) == [(start, start + 9 * DAY)]
+    assert cache.missing('VNM', start, start + 9 * DAY) == []
+
+
+def test_eviction_between_add_and_slice_reloads(loader):
+    cache = make_cache(max_bars=15)
+    start = SETTLED - 20 * DAY
+    add = cache._add
+    evicted = []
+
+    def add_then_evict(ticker, *args):
+        result = add(ticker, *args)
+        if ticker == 'VNM' and not evicted:
+            # Another request fills the cache before this one slices
+            evicted.append(True)
+            add('FPT', start, start + 9 * DAY, loader('FPT', start, start + 9 * DAY))
+            add('HPG', start, start + 9 * DAY, loader('HPG', start, start + 9 * DAY))
+        return result
+
+    cache._add = add_then_evict
+    frame = cache.get_range('VNM', start, start + 9 * DAY, loader)
+
+    assert len(frame) == 10
+    assert cache.stats()['reloads'] == 1
+
+
+def test_recent_days_use_the_short_lived_cache(loader):
+    cache = make_cache(settle_days=2)
+    frame = cache.get_range('VNM', TODAY - 9 * DAY, TODAY, loader)
+
+    assert dates(frame) == [TODAY - n * DAY for n in range(9, -1, -1)]
+    assert loader.calls == [('VNM', TODAY - 9 * DAY, TODAY - 3 * DAY),
+                            ('VNM', TODAY - 2 * DAY, TODAY)]
+    assert cache.stats()['bars'] == 7
+    assert not frame.attrs['stale']
+
+    # The recent part is cached for the TTL, not forever
+    cache.get_range('VNM', TODAY - 9 * DAY, TODAY, loader)
+    assert len(loader.calls) == 2
+
+
+def test_settled_segments_expire(loader, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(history_cache.time, 'monotonic', lambda: clock[0])
+    cache = make_cache(settled_ttl=60)
+    start = SETTLED - 20 * DAY
+
+    cache.get_range('VNM', start, start + 9 * DAY, loader)
+    clock[0] += 30
+    cache.get_range('VNM', start + 10 * DAY, start + 14 * DAY, loader)  # Merges, keeps the older time
+    clock[0] += 31
+    frame = cache.get_range('VNM', start, start + 14 * DAY, loader)
+
+    assert loader.calls[-1] == ('VNM', start, start + 14 * DAY)
+    assert len(frame) == 15
+    stats = cache.stats()
+    assert stats['expirations'] == 1
+    assert stats['bars'] == 15
+
+
+def test_empty_ranges_are_remembered(loader):
+    cache = make_cache()
+    empty = lambda ticker, start, end: loader(ticker, start, end).iloc[0:0]
+    start = SETTLED - 20 * DAY
+
+    assert cache.get_range('VNM', start, start + 5 * DAY, empty).empty
+    assert cache.missing('VNM', start, start + 5 * DAY) == []
+
+
+def test_invalidate(loader):
+    cache = make_cache()
+    start = SETTLED - 20 * DAY
+    cache.get_range('VNM', start, start + 4 * DAY, loader)
+    cache.get_range('FPT', start, start + 4 * DAY, loader)
+
+    assert cache.invalidate('VNM') == 5
+    assert cache.stats()['bars'] == 5
+    assert cache.invalidate() == 5
+    assert cache.stats()['tickers'] == 0
@@ -0,0 +1,65 @@
+"""Keyset page arguments and continuation cursors"""
+
+from datetime import date
+
+import pytest
+
+from history_pages import (MAX_PAGE_SIZE, PageError, decode_cursor, encode_cursor, next_cursor,
+                           parse_page_args, wants_page)
+
+START, END, AFTER = date(2010, 1, 1), date(2024, 12, 31), date(2015, 6, 30)
+
+
+def test_cursor_round_trip():
+    token = encode_cursor('VNM', START, END, AFTER)
+
+    assert '=' not in token  # Padding is stripped - safe in a query string unescaped
+    assert decode_cursor(token) == {'ticker': 'VNM', 'start': START, 'end': END, 'after': AFTER}
+
+
+@pytest.mark.parametrize('token', ['', 'not-base64!', 'eyJ0IjoiVk5NIn0', encode_cursor('VNM', START, END, AFTER)[:-4]])
+def test_malformed_cursors_are_rejected(token):
+    with pytest.raises(PageError):
+        decode_cursor(token)
+
+
+def test_next_cursor_continues_after_the_last_row():
+    assert next_cursor('VNM', START, END, None) is None
+    token = next_cursor('VNM', START, END, '2015-06-30T00:00:00')
+    assert decode_cursor(token)['after'] == AFTER
+
+
+def test_first_page_arguments():
+    args = {'start': '2010-01-01', 'end': '2024-12-31', 'limit': '500'}
+    assert parse_page_args('vnm', args) == ('VNM', START, END, None, 500)
+
+
+def test_cursor_carries_the_range():
+    token = encode_cursor('VNM', START, END, AFTER)
+    args = {'cursor': token, 'start': '2020-01-01'}  # start is ignored on later pages
+    assert parse_page_args('VNM', args)[1:4] == (START, END, AFTER)
+
+
+def test_cursor_for_another_symbol_is_rejected():
+    token = encode_cursor('FPT', START, END, AFTER)
+    with pytest.raises(PageError, match='different symbol'):
+        parse_page_args('VNM', {'cursor': token})
+
+
+@pytest.mark.parametrize('args', [
+    {'start': '2024-01-01', 'end': '2023-01-01'},
+    {'start': '01/01/2024'},
+    {'start': '2024-01-01', 'limit': 'ten'},
+    {'start': '2024-01-01', 'limit': '0'},
+    {'start': '2024-01-01', 'limit': str(MAX_PAGE_SIZE + 1)},
+])
+def test_invalid_arguments_raise_page_error(args):
+    with pytest.raises(PageError):
+        parse_page_args('VNM', args)
+
+
+def test_wants_page():
+    assert wants_page({'start': '2024-01-01'})
+    assert wants_page({'cursor': 'abc'})
+    assert not wants_page({'days': '30'})
+    assert not wants_page({'start': ''})
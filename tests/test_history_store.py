@@ -0,0 +1,104 @@
+"""HistoryStore sync: high-water mark, settled days and the overlap re-read"""
+
+from datetime import date, timedelta
+
+import pytest
+
+import history_store
+from history_store import HistoryStore
+
+TODAY = date.today()
+DAY = timedelta(days=1)
+
+
+class FakeSource:
+    """Market_Data stand-in: {(ticker, trade_date): close}"""
+
+    def __init__(self, bars):
+        self.bars = dict(bars)
+        self.queries = []
+
+    def get_trade_date_range(self):
+        dates = [day for _, day in self.bars]
+        return (min(dates), max(dates)) if dates else (None, None)
+
+    def get_history_rows(self, after, until):
+        self.queries.append((after, until))
+        return [(ticker, day, close, close, close, close, 100)
+                for (ticker, day), close in sorted(self.bars.items())
+                if after < day <= until]
+
+
+def days_back(count):
+    return [TODAY - n * DAY for n in range(count, -1, -1)]
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(history_store, 'SYNC_SETTLE_DAYS', 1)
+    monkeypatch.setattr(history_store, 'SYNC_OVERLAP_DAYS', 3)
+    monkeypatch.setattr(history_store, 'SYNC_START', None)
+    return HistoryStore(tmp_path)
+
+
+def test_sync_stops_before_today(store):
+    source = FakeSource({('VNM', day): 10.0 for day in days_back(10)})
+
+    written = store.sync(source)
+
+    assert written == 10
+    assert store.high_water_mark == TODAY - DAY
+    assert store.low_water_mark == TODAY - 10 * DAY
+    assert store.complete
+    assert len(store.read('VNM', TODAY - 30 * DAY, TODAY)) == 10
+
+
+def test_sync_rereads_overlap_and_picks_up_corrections(store):
+    source = FakeSource({('VNM', day): 10.0 for day in days_back(10)})
+    store.sync(source)
+
+    # A corrected bar inside the overlap and a late bar for another ticker
+    source.bars[('VNM', TODAY - 2 * DAY)] = 11.5
+    source.bars[('FPT', TODAY - 3 * DAY)] = 99.0
+    store.sync(source)
+
+    assert source.queries[-1] == (TODAY - 4 * DAY, TODAY - DAY)
+    assert store.read('VNM', TODAY - 2 * DAY, TODAY - 2 * DAY)['close'].tolist() == [11.5]
+    assert store.read('FPT', TODAY - 30 * DAY, TODAY)['close'].tolist() == [99.0]
+    assert store.high_water_mark == TODAY - DAY
+
+
+def test_sync_lowers_a_mark_that_includes_today(store):
+    source = FakeSource({('VNM', day): 10.0 for day in days_back(5)})
+    store.sync(source, until=TODAY)
+    store._meta['high_water_mark'] = TODAY.isoformat()  # Left by an older sync
+
+    store.sync(source)
+
+    assert store.high_water_mark == TODAY - DAY
+
+
+def test_overlap_never_reaches_below_the_low_water_mark(store, monkeypatch):
+    monkeypatch.setattr(history_store, 'SYNC_START', (TODAY - 2 * DAY).isoformat())
+    source = FakeSource({('VNM', day): 10.0 for day in days_back(10)})
+    store.sync(source)
+    store.sync(source)
+
+    assert not store.complete
+    assert store.read('VNM', TODAY - 30 * DAY, TODAY)['trade_date'].min() == (TODAY - 2 * DAY)
+
+
+def test_sync_of_an_empty_database(store):
+    assert store.sync(FakeSource({})) == 0
+    assert store.high_water_mark is None
+
+
+def test_write_merges_and_new_rows_win(store):
+    day = TODAY - 5 * DAY
+    store.write([('vnm', day, 1.0, 1.0, 1.0, 1.0, 10), ('VNM', day + DAY, 2.0, 2.0, 2.0, 2.0, 20)])
+    store.write([('VNM', day, 3.0, 3.0, 3.0, 3.0, 30), ('../etc', day, 1.0, 1.0, 1.0, 1.0, 1)])
+
+    bars = store.read('VNM', day, day + DAY)
+    assert bars['close'].tolist() == [3.0, 2.0]
+    assert store.tickers() == ['VNM']
+    assert store.tail('VNM', 1)['close'].tolist() == [2.0]
@@ -0,0 +1,116 @@
+"""History ETags follow the body that is actually sent"""
+
+import pandas as pd
+import pytest
+from flask import Flask, Response, request
+
+import shared_routes
+
+
+class FakeFetcher:
+    """History rows that a test can change between requests, as a cache refresh would"""
+
+    def __init__(self):
+        self.rows = [{'ticker': 'VNM', 'trade_date': '2024-01-02', 'price': 10.0},
+                     {'ticker': 'VNM', 'trade_date': '2024-01-03', 'price': 10.5}]
+        self.stale = False
+
+    def get_price_history_status(self):
+        return list(self.rows), self.stale
+
+    def get_history_page(self, ticker, start, end, after=None, limit=1000):
+        rows = [row for row in self.rows if after is None or row['trade_date'] > after.isoformat()]
+        return rows[:limit], len(rows) > limit
+
+
+@pytest.fixture
+def fetcher():
+    return FakeFetcher()
+
+
+@pytest.fixture
+def client(fetcher):
+    app = Flask(__name__)
+
+    @app.route('/api/stock/<symbol>/history')
+    def history(symbol):
+        if request.args.get('start') or request.args.get('cursor'):
+            return shared_routes.history_page(Response, request, symbol, fetcher.get_history_page)
+        rows, stale = fetcher.get_price_history_status()
+        if request.args.get('frame'):
+            rows = pd.DataFrame(rows)
+        return shared_routes.history_response(Response, request, rows, stale, source='real')
+
+    return app.test_client()
+
+
+def revalidate(client, url, etag, **headers):
+    return client.get(url, headers={'If-None-Match': etag, **headers})
+
+
+@pytest.mark.parametrize('url', ['/api/stock/VNM/history?days=30',
+                                 '/api/stock/VNM/history?days=30&frame=1',
+                                 '/api/stock/VNM/history?start=2024-01-01&limit=5'])
+def test_unchanged_rows_give_304(client, url):
+    first = client.get(url)
+    assert first.status_code == 200
+    assert first.headers['Cache-Control'] == 'no-cache'
+    assert 'Last-Modified' not in first.headers
+
+    again = revalidate(client, url, first.headers['ETag'].strip('"'))
+    assert again.status_code == 304
+    assert again.headers['ETag'] == first.headers['ETag']
+
+
+@pytest.mark.parametrize('url', ['/api/stock/VNM/history?days=30',
+                                 '/api/stock/VNM/history?days=30&frame=1',
+                                 '/api/stock/VNM/history?start=2024-01-01&limit=5'])
+def test_changed_rows_give_a_new_body_and_etag(client, fetcher, url):
+    first = client.get(url)
+
+    # A late bar arrives (or the cache refreshes) - the ETag must follow the body
+    fetcher.rows.append({'ticker': 'VNM', 'trade_date': '2024-01-04', 'price': 11.0})
+    changed = revalidate(client, url, first.headers['ETag'].strip('"'))
+
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != first.headers['ETag']
+    assert b'2024-01-04' in changed.get_data()
+
+    # ... and the new ETag validates the new body, not the old one
+    assert revalidate(client, url, changed.headers['ETag'].strip('"')).status_code == 304
+
+
+def test_stale_body_has_its_own_etag(client, fetcher):
+    url = '/api/stock/VNM/history?days=30'
+    fetcher.stale = True
+    stale = client.get(url)
+    fetcher.stale = False
+    fresh = revalidate(client, url, stale.headers['ETag'].strip('"'))
+
+    assert stale.get_json()['stale'] is True
+    assert fresh.status_code == 200
+    assert fresh.get_json()['stale'] is False
+
+
+def test_etag_depends_on_representation(client):
+    url = '/api/stock/VNM/history?days=30'
+    as_json = client.get(url)
+    as_arrow = revalidate(client, url, as_json.headers['ETag'].strip('"'),
+                          Accept='application/vnd.apache.arrow.stream')
+
+    assert as_arrow.status_code == 200
+    assert as_arrow.mimetype == 'application/vnd.apache.arrow.stream'
+    assert as_arrow.headers['ETag'] != as_json.headers['ETag']
+
+
+def test_next_page_cursor_is_part_of_the_validator(client, fetcher):
+    url = '/api/stock/VNM/history?start=2024-01-01&limit=2'
+    first = client.get(url)
+    assert first.get_json()['next_cursor'] is None
+
+    # Same two rows on this page, but now there is a next page
+    fetcher.rows.append({'ticker': 'VNM', 'trade_date': '2024-01-04', 'price': 11.0})
+    more = revalidate(client, url, first.headers['ETag'].strip('"'))
+
+    assert more.status_code == 200
+    assert more.get_json()['next_cursor'] is not None
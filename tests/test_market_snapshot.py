@@ -0,0 +1,237 @@
+"""MarketSnapshot: request-path loads, reload failures, validators and the column store"""
+
+import io
+import json
+import threading
+import time
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import arrow_format
+from market_snapshot import MarketColumns, MarketSnapshot
+
+
+def quote(ticker, price, exchange='HSX'):
+    return {'symbol': ticker, 'ticker': ticker, 'exchange': exchange, 'price': price,
+            'open': price, 'high': price, 'low': price, 'volume': 1000, 'change': 0.0,
+            'pct_change': 0.0, 'trade_date': '2024-06-28'}
+
+
+class Loader:
+    """Counts calls; each call takes `delay` seconds"""
+
+    def __init__(self, data=None, delay=0.0):
+        self.data = data if data is not None else {'VNM': quote('VNM', 60.0)}
+        self.delay = delay
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        return self.data
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('market_snapshot.time.time', lambda: now[0])
+    return now
+
+
+def concurrently(func, n=10):
+    barrier = threading.Barrier(n)
+    results = []
+
+    def run():
+        barrier.wait()
+        results.append(func())
+
+    threads = [threading.Thread(target=run) for _ in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+# --------------------------------------------------------------------------------
+# REQUEST-PATH LOADS
+# --------------------------------------------------------------------------------
+
+def test_cold_callers_share_one_load():
+    loader = Loader(delay=0.1)
+    snapshot = MarketSnapshot(loader, interval=60)
+
+    assert concurrently(snapshot.ensure_loaded) == [True] * 10
+    assert loader.calls == 1
+
+
+def test_failed_cold_load_is_shared_too():
+    loader = Loader(data={}, delay=0.1)
+    snapshot = MarketSnapshot(loader, interval=60)
+
+    assert concurrently(snapshot.ensure_loaded) == [False] * 10
+    assert loader.calls == 1
+    assert not snapshot.ready and snapshot.errors == 1
+
+
+def test_enabled_snapshot_is_not_loaded_on_the_request_path_once_ready():
+    loader = Loader()
+    snapshot = MarketSnapshot(loader, interval=60)
+
+    snapshot.ensure_loaded()
+    snapshot.ensure_loaded()
+    assert loader.calls == 1
+
+
+def test_disabled_snapshot_reuses_a_load_for_the_ttl(clock):
+    loader = Loader()
+    snapshot = MarketSnapshot(loader, interval=0, on_demand_ttl=30)
+
+    for _ in range(5):
+        assert snapshot.ensure_loaded()
+    assert loader.calls == 1
+
+    clock[0] += 31
+    snapshot.ensure_loaded()
+    assert loader.calls == 2
+
+
+def test_plain_refresh_always_reloads():
+    loader = Loader()
+    snapshot = MarketSnapshot(loader, interval=60)
+
+    snapshot.refresh()
+    snapshot.refresh()
+    assert loader.calls == 2
+
+
+def test_failed_cold_load_reports_its_error():
+    def down():
+        raise ConnectionError('database unreachable')
+    snapshot = MarketSnapshot(down, interval=60)
+
+    assert not snapshot.ensure_loaded()
+    assert snapshot.last_error == 'database unreachable'
+    assert snapshot.stats()['last_error'] == 'database unreachable'
+
+
+# --------------------------------------------------------------------------------
+# RELOADS AND VALIDATORS
+# --------------------------------------------------------------------------------
+
+def test_failed_reload_keeps_the_previous_data():
+    loader = Loader()
+    snapshot = MarketSnapshot(loader, interval=60)
+    snapshot.refresh()
+    digest = snapshot.digest
+
+    loader.data = None
+    assert not snapshot.refresh()
+
+    assert snapshot.get('vnm')['price'] == 60.0
+    assert snapshot.ready and snapshot.version == 1 and snapshot.digest == digest
+    assert snapshot.errors == 1 and snapshot.last_error == 'no rows returned'
+
+    # The next good reload clears the error
+    loader.data = {'VNM': quote('VNM', 61.0)}
+    assert snapshot.refresh()
+    assert snapshot.last_error is None and snapshot.errors == 1
+
+
+def test_unchanged_quotes_keep_their_modified_time_and_digest(clock):
+    loader = Loader({'VNM': quote('VNM', 60.0), 'FPT': quote('FPT', 100.0)})
+    snapshot = MarketSnapshot(loader, interval=60)
+    snapshot.refresh()
+    digest = snapshot.digest
+
+    clock[0] += 60
+    snapshot.refresh()
+    assert snapshot.modified() == snapshot.modified('VNM') == 1000.0
+    assert snapshot.digest == digest
+
+    clock[0] += 60
+    loader.data = {'VNM': quote('VNM', 60.0), 'FPT': quote('FPT', 101.0)}
+    snapshot.refresh()
+    assert snapshot.modified('VNM') == 1000.0
+    assert snapshot.modified('FPT') == snapshot.modified() == 1120.0
+    assert snapshot.digest != digest
+
+
+def test_stale_after_two_intervals_without_a_reload(clock):
+    snapshot = MarketSnapshot(Loader(), interval=60)
+    assert not snapshot.stale  # Never loaded is not stale, just not ready
+
+    snapshot.refresh()
+    clock[0] += 120
+    assert not snapshot.stale
+    clock[0] += 1
+    assert snapshot.stale
+
+    snapshot.refresh()
+    assert not snapshot.stale
+
+
+def test_get_many_keys_by_the_symbols_as_given():
+    snapshot = MarketSnapshot(Loader(), interval=60)
+    snapshot.refresh()
+
+    prices = snapshot.get_many(['vnm', 'XXX'])
+    assert prices['vnm']['ticker'] == 'VNM'
+    assert prices['XXX'] is None
+
+
+# --------------------------------------------------------------------------------
+# COLUMN STORE
+# --------------------------------------------------------------------------------
+
+@pytest.fixture
+def columns():
+    return MarketColumns({
+        'VNM': quote('VNM', 60.5),
+        'ACB': dict(quote('ACB', 25.0), volume=None, change=-0.5, pct_change=-1.96),
+        'SHS': quote('SHS', 12.3, exchange='HASTC'),
+        'ACV': quote('ACV', 90.0, exchange='UPCOM'),
+    })
+
+
+def test_records_are_sorted_and_split_by_exchange(columns):
+    assert columns.markets() == {'HOSE': 2, 'HNX': 1, 'UPCOM': 1}
+    assert [row['ticker'] for row in columns.records('HOSE')] == ['ACB', 'VNM']
+    assert columns.records('hsx') == columns.records('HOSE')
+    assert columns.records('NYSE') == []
+
+    acb = columns.records('HOSE')[0]
+    assert acb['volume'] == 0
+    assert acb['change'] == acb['change_amount'] == -0.5
+
+
+@pytest.mark.parametrize('market', ['HOSE', 'HNX', 'UPCOM', 'NYSE'])
+def test_json_body_matches_records(columns, market):
+    body, count = columns.to_json(market)
+    assert json.loads(body) == columns.records(market)
+    assert count == len(columns.records(market))
+
+
+@pytest.mark.parametrize('mimetype', [arrow_format.ARROW_MIMETYPE, arrow_format.PARQUET_MIMETYPE])
+def test_binary_body_matches_records(columns, mimetype):
+    body, count = columns.to_binary('HOSE', mimetype)
+    if mimetype == arrow_format.ARROW_MIMETYPE:
+        table = pa.ipc.open_stream(body).read_all()
+    else:
+        table = pq.read_table(io.BytesIO(body))
+
+    assert table.column_names == list(MarketColumns.BINARY_FIELDS)
+    # Dates travel as a date column rather than text
+    assert table.schema.field('trade_date').type == pa.date32()
+    rows = [dict(row, trade_date=row['trade_date'].isoformat()) for row in table.to_pylist()]
+    expected = [{field: row[field] for field in MarketColumns.BINARY_FIELDS} for row in columns.records('HOSE')]
+    assert rows == expected
+    assert count == 2
+
+
+def test_encoded_bodies_are_built_once(columns):
+    assert columns.to_json('HOSE')[0] is columns.to_json('HOSE')[0]
+    assert columns.nbytes() > 0
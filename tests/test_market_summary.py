@@ -0,0 +1,64 @@
+"""Entra ID fetcher market summaries: one scan per MARKET_CACHE_TTL, shared by repeat polls"""
+
+from datetime import date
+from functools import partial
+
+import pytest
+
+import database_connection_local as local
+import get_stock_prices
+from connection_pool import ConnectionPool
+
+
+@pytest.fixture(scope='module')
+def db_path(tmp_path_factory):
+    path = tmp_path_factory.mktemp('db') / 'market_data.db'
+    local.generate(str(path), tickers=60, years=1, end=date(2024, 6, 28))
+    return str(path)
+
+
+@pytest.fixture
+def fetcher(db_path, monkeypatch):
+    pool = ConnectionPool(partial(local.get_connection, db_path), min_size=0, max_size=2)
+    monkeypatch.setattr(get_stock_prices, 'get_pool', lambda: pool)
+    fetcher = get_stock_prices.StockPriceFetcher()
+    fetcher.scans = 0
+    connection = fetcher.connection
+
+    def counting(operation='query'):
+        if operation == 'market_summary':
+            fetcher.scans += 1
+        return connection(operation)
+    fetcher.connection = counting
+    yield fetcher
+    pool.close()
+
+
+@pytest.mark.filterwarnings('ignore:pandas only supports SQLAlchemy')
+def test_repeat_polls_reuse_one_scan(fetcher):
+    first = fetcher.get_market_summary('HOSE')
+    assert not first.empty
+    assert set(first.columns) >= {'ticker', 'close_price', 'trade_date'}
+
+    for _ in range(3):
+        assert fetcher.get_market_summary('HOSE') is first
+    assert fetcher.scans == 1
+
+    fetcher.get_market_summary('HNX')
+    assert fetcher.scans == 2
+
+
+@pytest.mark.filterwarnings('ignore:pandas only supports SQLAlchemy')
+def test_summary_is_reloaded_after_the_ttl(fetcher):
+    fetcher.get_market_summary('HOSE')
+    fetcher.market_cache.invalidate('HOSE')  # As if MARKET_CACHE_TTL had passed
+
+    fetcher.get_market_summary('HOSE')
+    assert fetcher.scans == 2
+
+
+@pytest.mark.filterwarnings('ignore:pandas only supports SQLAlchemy')
+def test_empty_market_is_not_cached(fetcher):
+    assert fetcher.get_market_summary('NYSE').empty
+    fetcher.get_market_summary('NYSE')
+    assert fetcher.scans == 2
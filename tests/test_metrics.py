@@ -0,0 +1,104 @@
+"""Prometheus exposition text: histograms, label escaping and failing collectors"""
+
+import re
+
+import flask
+import pytest
+
+import metrics
+import shared_routes
+from warmup import WarmUp
+
+SAMPLE_RE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{.*\})? (\S+)$')
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    """Metrics created by a test are dropped afterwards"""
+    monkeypatch.setattr(metrics, '_registry', [])
+    monkeypatch.setattr(metrics, '_collectors', [])
+
+
+def samples(text, name):
+    """[(labels text, value)] for every sample line of one metric name"""
+    found = []
+    for line in text.splitlines():
+        match = SAMPLE_RE.match(line)
+        if match and match.group(1) == name:
+            found.append((match.group(2) or '', float(match.group(3))))
+    return found
+
+
+def test_histogram_buckets_are_cumulative_with_sum_and_count():
+    histogram = metrics.Histogram('test_latency_seconds', 'Test latency', labels=('route',),
+                                  buckets=(0.01, 0.1, 1.0))
+    for value in (0.005, 0.01, 0.05, 0.5, 2.0, 3.0):
+        histogram.observe(value, '/api/stock')
+
+    text = metrics.render()
+    buckets = samples(text, 'test_latency_seconds_bucket')
+    assert [labels for labels, _ in buckets] == [
+        '{route="/api/stock",le="0.01"}', '{route="/api/stock",le="0.1"}',
+        '{route="/api/stock",le="1"}', '{route="/api/stock",le="+Inf"}',
+    ]
+    counts = [value for _, value in buckets]
+    assert counts == [2, 3, 4, 6]  # 0.01 falls in its own bucket (le is inclusive)
+    assert counts == sorted(counts)
+
+    assert samples(text, 'test_latency_seconds_count') == [('{route="/api/stock"}', 6)]
+    assert samples(text, 'test_latency_seconds_sum')[0][1] == pytest.approx(5.565)
+    assert text.count('# TYPE test_latency_seconds histogram') == 1
+
+
+def test_label_values_are_escaped():
+    counter = metrics.Counter('test_requests', 'Test requests', labels=('path',))
+    counter.inc('a"b\\c\nd')
+
+    line = next(line for line in metrics.render().splitlines() if line.startswith('test_requests_total{'))
+    assert line == 'test_requests_total{path="a\\"b\\\\c\\nd"} 1'
+
+
+def test_stats_are_exposed_as_counters_and_gauges():
+    metrics.register_stats('widget', lambda: {'made': 3, 'size': 2.5, 'ok': True, 'name': 'x'},
+                           counters=('made',), gauges={'size': 'size_bytes', 'ok': 'ok', 'name': 'name'},
+                           labels={'kind': 'blue'})
+    text = metrics.render()
+
+    assert '# TYPE widget_made_total counter' in text
+    assert samples(text, 'widget_made_total') == [('{kind="blue"}', 3)]
+    assert samples(text, 'widget_size_bytes') == [('{kind="blue"}', 2.5)]
+    assert samples(text, 'widget_ok') == [('{kind="blue"}', 1)]
+    assert not samples(text, 'widget_name')  # Only numbers are exposed
+
+
+def test_failing_collectors_do_not_break_the_scrape():
+    def broken_stats():
+        raise RuntimeError('pool not created yet')
+
+    def broken_collector():
+        yield 'half_done', 'gauge', 'Half done', {}, 1
+        raise RuntimeError('lost the database')
+
+    metrics.Counter('test_survivor', 'Still scraped').inc()
+    metrics.register_stats('broken', broken_stats, counters=('made',))
+    metrics.register_collector(broken_collector)
+    metrics.register_stats('empty', lambda: None, counters=('made',))
+
+    text = metrics.render()
+    assert samples(text, 'test_survivor_total') == [('', 1)]
+    assert 'broken' not in text and 'half_done' not in text
+
+    app = flask.Flask(__name__)
+    app.register_blueprint(shared_routes.blueprint(flask, WarmUp(enabled=False), dict))
+    response = app.test_client().get('/metrics')
+    assert response.status_code == 200
+    assert response.content_type == metrics.CONTENT_TYPE
+    assert 'test_survivor_total 1' in response.get_data(as_text=True)
+
+
+def test_every_sample_line_is_well_formed():
+    metrics.Histogram('test_a_seconds', 'A', labels=('x',)).observe(0.2, 'v')
+    metrics.Counter('test_b', 'B').inc(amount=0.5)
+
+    for line in metrics.render().splitlines():
+        assert line.startswith('# HELP ') or line.startswith('# TYPE ') or SAMPLE_RE.match(line), line
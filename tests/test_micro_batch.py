@@ -0,0 +1,104 @@
+"""MicroBatcher: window sharing, max_batch, errors and the disabled path"""
+
+import threading
+import time
+
+import pytest
+
+from micro_batch import MicroBatcher
+
+
+class Loader:
+    """Records every batch of keys; values are the keys lower-cased"""
+
+    def __init__(self, error=None, missing=()):
+        self.batches = []
+        self.error = error
+        self.missing = set(missing)
+        self._lock = threading.Lock()
+
+    def __call__(self, keys):
+        with self._lock:
+            self.batches.append(sorted(keys))
+        if self.error is not None:
+            raise self.error
+        return {key: key.lower() for key in keys if key not in self.missing}
+
+
+def load_all(batcher, keys):
+    """batcher.load(key) for every key at once, one thread each -> {key: value or exception}"""
+    barrier = threading.Barrier(len(keys))
+    results = {}
+
+    def run(key):
+        barrier.wait()
+        try:
+            results[key] = batcher.load(key)
+        except Exception as e:
+            results[key] = e
+
+    threads = [threading.Thread(target=run, args=(key,)) for key in keys]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_callers_in_one_window_share_a_loader_call():
+    loader = Loader()
+    batcher = MicroBatcher(loader, window=0.5, max_batch=100)
+
+    results = load_all(batcher, ['VNM', 'FPT', 'HPG', 'VCB'])
+
+    assert results == {'VNM': 'vnm', 'FPT': 'fpt', 'HPG': 'hpg', 'VCB': 'vcb'}
+    assert loader.batches == [['FPT', 'HPG', 'VCB', 'VNM']]
+    stats = batcher.stats()
+    assert (stats['calls'], stats['batches'], stats['keys'], stats['largest_batch']) == (4, 1, 4, 4)
+
+
+def test_full_batch_runs_without_waiting_out_the_window():
+    loader = Loader()
+    batcher = MicroBatcher(loader, window=5, max_batch=3)
+
+    started = time.monotonic()
+    load_all(batcher, ['A', 'B', 'C'])
+    # The next caller starts a new batch rather than joining the closed one
+    load_all(batcher, ['D', 'E', 'F'])
+
+    assert time.monotonic() - started < 2
+    assert loader.batches == [['A', 'B', 'C'], ['D', 'E', 'F']]
+
+
+def test_loader_error_is_raised_in_every_waiter():
+    loader = Loader(error=ConnectionError('database unavailable'))
+    batcher = MicroBatcher(loader, window=0.5, max_batch=100)
+
+    results = load_all(batcher, ['VNM', 'FPT', 'HPG'])
+
+    assert len(loader.batches) == 1
+    assert all(isinstance(result, ConnectionError) for result in results.values())
+    assert batcher.stats()['errors'] == 1
+
+    # The failed batch is gone - later calls load again
+    loader.error = None
+    assert batcher.load('VNM') == 'vnm'
+
+
+def test_keys_missing_from_the_result_are_none():
+    loader = Loader(missing={'XXX'})
+    batcher = MicroBatcher(loader, window=0.5, max_batch=100)
+
+    assert load_all(batcher, ['VNM', 'XXX']) == {'VNM': 'vnm', 'XXX': None}
+
+
+@pytest.mark.parametrize('window, max_batch', [(0, 100), (0.5, 1)])
+def test_disabled_batcher_loads_each_key_alone(window, max_batch):
+    loader = Loader()
+    batcher = MicroBatcher(loader, window=window, max_batch=max_batch)
+    assert not batcher.enabled
+
+    results = load_all(batcher, ['VNM', 'FPT', 'HPG'])
+
+    assert results == {'VNM': 'vnm', 'FPT': 'fpt', 'HPG': 'hpg'}
+    assert sorted(loader.batches) == [['FPT'], ['HPG'], ['VNM']]
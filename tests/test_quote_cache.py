@@ -0,0 +1,125 @@
+"""QuoteCache: TTL, LRU eviction, invalidation and stale-while-revalidate"""
+
+import threading
+
+import pytest
+
+import quote_cache
+from quote_cache import QuoteCache, Revalidator
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(quote_cache.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = QuoteCache(max_size=10, ttl=30, stale=0)
+    cache.set('VNM', {'price': 1})
+
+    clock[0] += 29.9
+    assert cache.get('VNM') == {'price': 1}
+    clock[0] += 0.1
+    assert cache.get('VNM') is None
+
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['expirations']) == (1, 1, 1)
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = QuoteCache(max_size=2, ttl=30)
+    cache.set('VNM', 1)
+    cache.set('FPT', 2)
+    cache.get('VNM')  # FPT is now least recent
+    cache.set('HPG', 3)
+
+    assert cache.get('FPT') is None
+    assert (cache.get('VNM'), cache.get('HPG')) == (1, 3)
+    assert cache.stats()['evictions'] == 1
+
+
+def test_setting_again_resets_the_ttl(clock):
+    cache = QuoteCache(max_size=10, ttl=30, stale=0)
+    cache.set('VNM', 1)
+    clock[0] += 20
+    cache.set('VNM', 2)
+    clock[0] += 20
+    assert cache.get('VNM') == 2
+
+
+@pytest.mark.parametrize('max_size, ttl', [(0, 30), (10, 0)])
+def test_disabled_cache_stores_nothing(clock, max_size, ttl):
+    cache = QuoteCache(max_size=max_size, ttl=ttl)
+    cache.set('VNM', 1)
+    assert not cache.enabled
+    assert cache.get('VNM') is None
+
+
+def test_invalidate_one_or_all(clock):
+    cache = QuoteCache(max_size=10, ttl=30)
+    cache.set('VNM', 1)
+    cache.set('FPT', 2)
+
+    assert cache.invalidate('VNM') == 1
+    assert cache.invalidate('VNM') == 0
+    assert cache.invalidate() == 1
+    assert len(cache) == 0
+
+
+def test_expired_entry_is_served_stale_within_the_bound(clock):
+    cache = QuoteCache(max_size=10, ttl=30, stale=60)
+    cache.set('VNM', 1)
+
+    clock[0] += 45
+    assert cache.get_stale('VNM') == (1, True)
+    assert cache.get('VNM') is None  # Plain get never returns stale values
+    assert cache.get_stale('VNM') == (1, True)  # ... and leaves them in place
+
+    clock[0] += 45
+    assert cache.get_stale('VNM') == (None, False)
+    assert cache.stats()['stale_hits'] == 2
+
+
+def test_fresh_entry_is_not_stale(clock):
+    cache = QuoteCache(max_size=10, ttl=30, stale=60)
+    cache.set('VNM', 1)
+    assert cache.get_stale('VNM') == (1, False)
+
+
+def test_revalidator_runs_one_refresh_per_key():
+    revalidator = Revalidator(workers=2)
+    release = threading.Event()
+    done = threading.Event()
+    calls = []
+
+    def refresh(key):
+        release.wait(5)
+        calls.append(key)
+        done.set()
+
+    assert revalidator.submit('VNM', refresh, 'VNM')
+    assert not revalidator.submit('VNM', refresh, 'VNM')  # Already pending
+    release.set()
+    assert done.wait(5)
+
+    assert calls == ['VNM']
+    stats = revalidator.stats()
+    assert stats['skipped'] == 1
+
+
+def test_revalidator_counts_failures():
+    revalidator = Revalidator(workers=1)
+    failed = threading.Event()
+
+    def refresh():
+        failed.set()
+        raise RuntimeError('database down')
+
+    revalidator.submit('VNM', refresh)
+    assert failed.wait(5)
+    revalidator._executor.shutdown(wait=True)
+    assert revalidator.stats()['errors'] == 1
+    assert revalidator.stats()['pending'] == 0
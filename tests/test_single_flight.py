@@ -0,0 +1,143 @@
+"""SingleFlight: coalescing identical keys, error sharing and the counters"""
+
+import threading
+import time
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+class Gated:
+    """func for do() that blocks until release(), counting its runs"""
+
+    def __init__(self, result='rows', error=None):
+        self.result = result
+        self.error = error
+        self.runs = 0
+        self.gate = threading.Event()
+
+    def __call__(self):
+        self.runs += 1
+        self.gate.wait(5)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def release(self):
+        self.gate.set()
+
+
+def start_callers(flight, key, func, n):
+    """n threads calling flight.do(key, func) -> (threads, outcomes list)"""
+    outcomes = []
+
+    def run():
+        try:
+            outcomes.append(flight.do(key, func))
+        except Exception as e:
+            outcomes.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(n)]
+    for t in threads:
+        t.start()
+    return threads, outcomes
+
+
+def wait_for_calls(flight, key, n):
+    """Block until n calls for key have entered do()"""
+    deadline = time.monotonic() + 5
+    while flight.key_stats().get(repr(key), {}).get('calls', 0) < n:
+        assert time.monotonic() < deadline, 'callers did not arrive'
+        time.sleep(0.001)
+
+
+def join(threads):
+    for t in threads:
+        t.join()
+
+
+def test_identical_keys_run_once_and_share_the_result():
+    flight = SingleFlight()
+    func = Gated()
+
+    threads, outcomes = start_callers(flight, ('market', 'HOSE'), func, 8)
+    wait_for_calls(flight, ('market', 'HOSE'), 8)
+    assert flight.in_flight() == 1
+    func.release()
+    join(threads)
+
+    assert func.runs == 1
+    assert outcomes == ['rows'] * 8
+    assert flight.in_flight() == 0
+
+
+def test_different_keys_do_not_coalesce():
+    flight = SingleFlight()
+    hose, hnx = Gated('hose'), Gated('hnx')
+
+    threads_a, outcomes_a = start_callers(flight, 'HOSE', hose, 2)
+    threads_b, outcomes_b = start_callers(flight, 'HNX', hnx, 2)
+    wait_for_calls(flight, 'HOSE', 2)
+    wait_for_calls(flight, 'HNX', 2)
+    assert flight.in_flight() == 2
+    hose.release()
+    hnx.release()
+    join(threads_a + threads_b)
+
+    assert (hose.runs, hnx.runs) == (1, 1)
+    assert outcomes_a == ['hose', 'hose'] and outcomes_b == ['hnx', 'hnx']
+
+
+def test_leader_error_reaches_every_follower_and_releases_the_key():
+    flight = SingleFlight()
+    func = Gated(error=ConnectionError('database unavailable'))
+
+    threads, outcomes = start_callers(flight, 'VNM', func, 4)
+    wait_for_calls(flight, 'VNM', 4)
+    func.release()
+    join(threads)
+
+    assert func.runs == 1
+    assert len(outcomes) == 4 and all(isinstance(o, ConnectionError) for o in outcomes)
+
+    # Nothing is left in flight - the next call runs func again
+    assert flight.in_flight() == 0
+    assert flight.do('VNM', lambda: 'retried') == 'retried'
+
+
+def test_stats_count_leaders_and_shared_calls():
+    flight = SingleFlight()
+    ok, failing = Gated(), Gated(error=ValueError('bad'))
+
+    threads, _ = start_callers(flight, 'A', ok, 3)
+    wait_for_calls(flight, 'A', 3)
+    ok.release()
+    join(threads)
+
+    threads, _ = start_callers(flight, 'B', failing, 2)
+    wait_for_calls(flight, 'B', 2)
+    failing.release()
+    join(threads)
+
+    stats = flight.stats()
+    assert stats['executions'] == 2
+    assert stats['shared'] == 3
+    assert stats['errors'] == 1
+    assert stats['in_flight'] == 0
+    assert stats['coalesce_rate'] == pytest.approx(3 / 5, abs=1e-4)
+
+    keys = flight.key_stats()
+    assert list(keys) == ["'A'", "'B'"]  # Most shared first
+    assert {k: keys["'A'"][k] for k in ('calls', 'executions', 'shared', 'errors', 'max_waiters')} == \
+        {'calls': 3, 'executions': 1, 'shared': 2, 'errors': 0, 'max_waiters': 2}
+    assert keys["'B'"]['errors'] == 1 and keys["'B'"]['shared'] == 1
+
+
+def test_key_stats_keep_only_the_most_recent_keys():
+    flight = SingleFlight(stats_keys=2)
+    for key in ('A', 'B', 'C'):
+        flight.do(key, lambda: None)
+
+    assert set(flight.key_stats()) == {"'B'", "'C'"}
+    assert flight.stats()['executions'] == 3
@@ -0,0 +1,88 @@
+"""Entra ID token refresh: pooled connections rotate only when the token changes"""
+
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import database_connection as dc
+
+
+class FakeCredential:
+    def __init__(self):
+        self.token = 'token-1'
+        self.expires_on = int(time.time()) + 3600
+
+    def get_token(self, scope):
+        return SimpleNamespace(token=self.token, expires_on=self.expires_on)
+
+
+class FakePool:
+    closed = False
+
+    def __init__(self):
+        self.rotations = 0
+
+    def rotate(self):
+        self.rotations += 1
+
+
+@pytest.fixture
+def credential(monkeypatch, tmp_path):
+    credential = FakeCredential()
+    monkeypatch.setattr(dc, '_credential', credential)
+    monkeypatch.setattr(dc, 'TOKEN_FILE', str(tmp_path / 'token.json'))
+    monkeypatch.setattr(dc, '_token_cache', {'token': None, 'expires_at': None, 'version': 0})
+    monkeypatch.setattr(dc, '_token_stats', {**dc._token_stats, 'refreshes': 0, 'rotations': 0,
+                                             'unchanged': 0, 'failures': 0})
+    return credential
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = FakePool()
+    monkeypatch.setattr(dc, '_pool', pool)
+    return pool
+
+
+def test_same_token_does_not_rotate(credential, pool):
+    dc.refresh_token()
+    assert pool.rotations == 1  # First token replaces whatever the pool had
+
+    # The credential's cache hands back the token we already hold
+    dc.refresh_token()
+    dc.refresh_token()
+    assert pool.rotations == 1
+    assert dc.token_stats()['unchanged'] == 2
+    assert dc.token_stats()['version'] == 1
+
+
+def test_new_token_rotates(credential, pool):
+    dc.refresh_token()
+    credential.token, credential.expires_on = 'token-2', credential.expires_on + 3600
+
+    assert dc.refresh_token() == 'token-2'
+    assert pool.rotations == 2
+    assert dc.token_stats()['refreshes'] == 2
+    assert dc.get_azure_sql_token() == 'token-2'
+
+
+def test_failure_is_counted_and_raised(credential, pool):
+    def fail(scope):
+        raise RuntimeError('login required')
+    credential.get_token = fail
+
+    with pytest.raises(RuntimeError):
+        dc.refresh_token()
+    assert dc.token_stats()['failures'] == 1
+    assert dc.token_stats()['last_error'] == 'login required'
+    assert pool.rotations == 0
+
+
+def test_refresh_margin_leaves_room_in_the_credential_window(credential):
+    # The credential only renews in the last 5 minutes of a token's life
+    assert dc.TOKEN_EXPIRY_MARGIN + dc.TOKEN_REFRESH_MARGIN < 300
+
+    dc.refresh_token()
+    remaining = credential.expires_on - time.time() - dc.TOKEN_EXPIRY_MARGIN - dc.TOKEN_REFRESH_MARGIN
+    assert dc.seconds_until_refresh() == pytest.approx(remaining, abs=2)
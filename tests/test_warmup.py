@@ -0,0 +1,141 @@
+"""WarmUp readiness, retries and the fetcher step checks"""
+
+import threading
+
+from warmup import WarmUp, fetcher_steps
+
+
+def failing(times, calls=None):
+    """Step that raises the first `times` calls"""
+    count = [0]
+
+    def step():
+        count[0] += 1
+        if calls is not None:
+            calls.append(count[0])
+        if count[0] <= times:
+            raise RuntimeError('database unavailable')
+    return step
+
+
+def test_all_steps_pass():
+    warmup = WarmUp(enabled=True)
+    assert not warmup.ready
+
+    assert warmup.run([('pool', lambda: None), ('quote', lambda: None)])
+    assert warmup.state == 'ready'
+    assert warmup.ready
+
+
+def test_optional_failure_is_degraded_but_ready():
+    warmup = WarmUp(enabled=True)
+    warmup.run([('pool', lambda: None), ('history', failing(1))])
+
+    assert warmup.state == 'degraded'
+    assert warmup.ready
+    assert warmup.stats()['steps']['history']['error'] == 'database unavailable'
+
+
+def test_required_failure_is_retried_until_it_passes():
+    calls = []
+    warmup = WarmUp(enabled=True, retry=0.01)
+    then = []
+
+    assert warmup.run([('pool', failing(2, calls)), ('quote', lambda: None)], then=lambda: then.append(warmup.state))
+
+    assert calls == [1, 2, 3]
+    assert warmup.state == 'ready'
+    assert warmup.attempts == 3
+    assert then == ['failed']  # Background jobs start after the first pass, once
+
+
+def test_stop_ends_the_retries_not_ready():
+    warmup = WarmUp(enabled=True, retry=60)
+    warmup.start([('pool', failing(100))])
+    while warmup.attempts == 0:
+        threading.Event().wait(0.01)
+
+    assert warmup.state == 'failed'
+    assert not warmup.ready
+    warmup.stop()
+    warmup._thread.join(5)
+    assert not warmup._thread.is_alive()
+
+
+def test_start_runs_in_the_background():
+    release = threading.Event()
+    warmup = WarmUp(enabled=True)
+    warmup.start([('pool', lambda: release.wait(5))])
+
+    assert warmup.state == 'running'
+    assert not warmup.ready
+    release.set()
+    warmup._thread.join(5)
+    assert warmup.ready
+
+
+def test_disabled_is_ready_and_runs_then_at_once():
+    then = []
+    warmup = WarmUp(enabled=False)
+    warmup.start([('pool', failing(1))], then=lambda: then.append(True))
+
+    assert warmup.ready
+    assert then == [True]
+    assert warmup.steps == {}
+
+
+class Pool:
+    def __init__(self, alive=True):
+        self.alive = alive
+
+    def prefill(self):
+        pass
+
+    def connection(self):
+        class Borrowed:
+            def __enter__(self):
+                return object()
+
+            def __exit__(self, *exc):
+                return False
+        return Borrowed()
+
+    def validate(self, conn):
+        return self.alive
+
+
+class EmptyFetcher:
+    """A fetcher whose queries failed - they log the error and return nothing"""
+
+    def get_latest_price(self, symbol):
+        return None
+
+    def get_multiple_prices(self, symbols):
+        return {symbol: None for symbol in symbols}
+
+    def get_price_history(self, symbol, days):
+        return []
+
+    def get_history_page(self, ticker, start, end):
+        return [], False
+
+
+def test_fetcher_steps_fail_on_empty_results():
+    warmup = WarmUp(enabled=True)
+    warmup.run(fetcher_steps(EmptyFetcher(), Pool(), tickers=['VNM', 'FPT'], days=5))
+
+    errors = {name: step['error'] for name, step in warmup.steps.items()}
+    assert errors['pool'] is None
+    assert all(errors[name] for name in ('quote', 'quotes', 'history', 'history_page'))
+    assert warmup.state == 'degraded'
+
+
+def test_dead_connection_fails_the_pool_step():
+    warmup = WarmUp(enabled=True, retry=60)
+    warmup.start(fetcher_steps(EmptyFetcher(), Pool(alive=False), tickers=[]))
+    while warmup.attempts == 0:
+        threading.Event().wait(0.01)
+    warmup.stop()
+
+    assert warmup.state == 'failed'
+    assert 'liveness' in warmup.steps['pool']['error']
@@ -0,0 +1,219 @@
+"""
+Startup warm-up
+Runs before a server takes traffic so the first requests after a restart or
+redeploy do not pay for connection setup, token acquisition, SQL Server plan
+compilation and empty caches. It runs in the background while the server
+starts; GET /api/ready answers 503 until the required steps have passed
+"""
+
+import os
+import threading
+import time
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+
+# WARMUP=0 skips the warm-up (the server is ready immediately)
+WARMUP_ENABLED = os.getenv('WARMUP', '1').lower() not in ('0', 'false', 'no')
+
+# Tickers queried during warm-up - their quotes and history start out cached
+WARMUP_TICKERS = [
+    t.strip().upper()
+    for t in os.getenv('WARMUP_TICKERS', 'VNM,VCB,HPG,FPT,VIC,MWG,SSI,MSN').split(',')
+    if t.strip()
+]
+
+# Days of history loaded per hot ticker
+WARMUP_HISTORY_DAYS = int(os.getenv('WARMUP_HISTORY_DAYS', 30))
+
+# Seconds between retries of failed steps while a required step keeps failing
+WARMUP_RETRY = float(os.getenv('WARMUP_RETRY', 15))
+
+# Steps that must pass before the server reports ready - without a database
+# connection (or the snapshot the quote routes read) it cannot serve anything
+REQUIRED_STEPS = ('pool', 'snapshot')
+
+Step = Tuple[str, Callable[[], object]]
+
+
+class WarmUp:
+    """
+    Runs named warm-up steps and tracks whether the server is ready
+
+    A failing step is logged and recorded but does not stop the others. If only
+    optional steps failed the server is ready ('degraded') and serves those paths
+    cold; if a required step failed it is not ready ('failed') and the failed
+    steps are retried every `retry` seconds until they pass
+    """
+
+    def __init__(self, enabled: Optional[bool] = None, retry: Optional[float] = None,
+                 required: Sequence[str] = REQUIRED_STEPS):
+        self.enabled = WARMUP_ENABLED if enabled is None else enabled
+        self.retry = WARMUP_RETRY if retry is None else retry
+        self.required = tuple(required)
+        self.state = 'pending' if self.enabled else 'disabled'
+        self.steps = {}  # name -> {'time': seconds, 'error': message or None}
+        self.duration = None
+        self.attempts = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state in ('ready', 'degraded', 'disabled')
+
+    def start(self, steps: Sequence[Step], then: Optional[Callable[[], None]] = None):
+        """
+        Run the steps on a background thread, so the server can take requests
+        (and answer /api/ready with 503) meanwhile
+
+        Args:
+            then: Called once after the first pass, whatever its outcome -
+                e.g. to start the background refresh jobs
+        """
+        if not self.enabled:
+            if then is not None:
+                then()
+            return
+        self._thread = threading.Thread(target=self.run, args=(steps, then), name='warmup', daemon=True)
+        self._thread.start()
+
+    def run(self, steps: Sequence[Step], then: Optional[Callable[[], None]] = None) -> bool:
+        """
+        Run every step in order (once per process), then retry failed ones
+        while a required step is failing
+
+        Returns:
+            True once the server is ready, False if stopped before that
+        """
+        with self._lock:
+            if self.state != 'pending':
+                return self.ready
+            self.state = 'running'
+
+        start = time.monotonic()
+        pending = list(steps)
+        while True:
+            failed = self._run_steps(pending)
+            blocking = [name for name in failed if name in self.required]
+            self.state = 'failed' if blocking else 'degraded' if failed else 'ready'
+            self.attempts += 1
+            if self.duration is None:
+                self.duration = round(time.monotonic() - start, 4)
+                print(f"🔥 Warm-up finished in {self.duration:.2f}s"
+                      + (f" ({len(failed)} failed: {', '.join(failed)})" if failed else ""))
+
+            if then is not None:
+                then()
+                then = None
+
+            if not blocking:
+                if self.attempts > 1:
+                    print(f"✅ Warm-up passed after {self.attempts} attempts")
+                return True
+
+            print(f"❌ Not ready - {', '.join(blocking)} failed, retrying in {self.retry:.0f}s")
+            if self._stop.wait(self.retry):
+                return False
+            pending = [(name, step) for name, step in steps if self.steps[name]['error']]
+
+    def _run_steps(self, steps: Sequence[Step]) -> List[str]:
+        """Run steps in order and record each one, returns the names that failed"""
+        failed = []
+        for name, step in steps:
+            step_start = time.monotonic()
+            error = None
+            try:
+                step()
+            except Exception as e:
+                error = str(e)
+                failed.append(name)
+                print(f"⚠️  Warm-up step '{name}' failed: {e}")
+            self.steps[name] = {'time': round(time.monotonic() - step_start, 4), 'error': error}
+        return failed
+
+    def stop(self):
+        """Stop retrying (the server shuts down)"""
+        self._stop.set()
+
+    def stats(self) -> Dict:
+        return {
+            'state': self.state,
+            'ready': self.ready,
+            'duration': self.duration,
+            'attempts': self.attempts,
+            'steps': dict(self.steps),
+        }
+
+
+def _expect(value, what: str):
+    """Fail a step whose fetcher call came back empty - the fetchers log errors and return None"""
+    if value is None or (hasattr(value, '__len__') and len(value) == 0):
+        raise RuntimeError(f'no {what} returned')
+    return value
+
+
+def check_pool(pool):
+    """Open the pool's minimum connections and prove one of them can run a query"""
+    pool.prefill()
+    with pool.connection() as conn:
+        if not pool.validate(conn):
+            raise RuntimeError('connection failed its liveness check')
+
+
+def fetcher_steps(fetcher, pool, snapshot=None, tickers: Optional[List[str]] = None,
+                  days: Optional[int] = None) -> List[Step]:
+    """
+    Warm-up steps for a StockPriceFetcher and the server around it
+
+    Opens the pool's minimum connections, runs every query the routes use
+    once (priming the caches on the way), loads the market snapshot and
+    encodes each market's JSON body. A query that returns nothing fails its step
+
+    Args:
+        fetcher: Any of the StockPriceFetcher variants
+        pool: The ConnectionPool the fetcher borrows from
+        snapshot: MarketSnapshot to load, if the server has one (and it is enabled)
+        tickers: Hot tickers (default WARMUP_TICKERS)
+        days: History days per ticker (default WARMUP_HISTORY_DAYS)
+    """
+    tickers = WARMUP_TICKERS if tickers is None else tickers
+    days = WARMUP_HISTORY_DAYS if days is None else days
+
+    steps = [('pool', lambda: check_pool(pool))]
+
+    # A disabled snapshot is never reloaded, so it must not be loaded here either
+    if snapshot is not None and snapshot.enabled:
+        def load_snapshot():
+            if not snapshot.refresh():
+                raise RuntimeError(snapshot.last_error or 'snapshot load failed')
+            # Encode every market body once so the first /api/market hit is cached
+            for market in snapshot.columns.markets():
+                snapshot.market_json(market)
+        steps.append(('snapshot', load_snapshot))
+
+    if tickers:
+        # One ticker alone (single-quote path), then the rest in one IN query
+        steps.append(('quote', lambda: _expect(fetcher.get_latest_price(tickers[0]), f'quote for {tickers[0]}')))
+        if len(tickers) > 1:
+            def load_quotes():
+                prices = fetcher.get_multiple_prices(tickers[1:]) or {}
+                _expect([price for price in prices.values() if price], 'quotes')
+            steps.append(('quotes', load_quotes))
+
+        def load_history():
+            for ticker in tickers:
+                _expect(fetcher.get_price_history(ticker, days), f'history for {ticker}')
+        steps.append(('history', load_history))
+
+        def load_page():
+            end = date.today()
+            rows, _ = fetcher.get_history_page(tickers[0], end - timedelta(days=days), end)
+            _expect(rows, f'history page for {tickers[0]}')
+        steps.append(('history_page', load_page))
+
+    if hasattr(fetcher, 'get_market_summary'):
+        steps.append(('market', lambda: _expect(fetcher.get_market_summary('HOSE'), 'HOSE summary')))
+
+    return steps